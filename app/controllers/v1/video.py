@@ -1,10 +1,9 @@
-import glob
 import os
 import pathlib
 import shutil
 from typing import Union
 
-from fastapi import BackgroundTasks, Depends, Path, Request, UploadFile
+from fastapi import BackgroundTasks, Depends, Path, Query, Request, UploadFile
 from fastapi.params import File
 from fastapi.responses import FileResponse, StreamingResponse
 from loguru import logger
@@ -19,6 +18,8 @@ from app.models.schema import (
     AudioRequest,
     BgmRetrieveResponse,
     BgmUploadResponse,
+    CacheStatsResponse,
+    HttpStatsResponse,
     SubtitleRequest,
     TaskDeletionResponse,
     TaskQueryRequest,
@@ -26,8 +27,10 @@ from app.models.schema import (
     TaskResponse,
     TaskVideoRequest,
 )
+from app.services import search_cache, song_library
 from app.services import state as sm
 from app.services import task as tm
+from app.services.utils import file_cache, http_client
 from app.utils import utils
 
 # 认证依赖项
@@ -53,9 +56,14 @@ else:
 
 @router.post("/videos", response_model=TaskResponse, summary="Generate a short video")
 def create_video(
-    background_tasks: BackgroundTasks, request: Request, body: TaskVideoRequest
+    background_tasks: BackgroundTasks,
+    request: Request,
+    body: TaskVideoRequest,
+    dry_run: bool = Query(
+        False, description="Only plan the timelines, they are returned by the task query"
+    ),
 ):
-    return create_task(request, body, stop_at="video")
+    return create_task(request, body, stop_at="timeline" if dry_run else "video")
 
 
 @router.post("/subtitle", response_model=TaskResponse, summary="Generate subtitle only")
@@ -183,16 +191,17 @@ def delete_video(request: Request, task_id: str = Path(..., description="Task ID
     "/musics", response_model=BgmRetrieveResponse, summary="Retrieve local BGM files"
 )
 def get_bgm_list(request: Request):
-    suffix = "*.mp3"
-    song_dir = utils.song_dir()
-    files = glob.glob(os.path.join(song_dir, suffix))
     bgm_list = []
-    for file in files:
+    for song in song_library.get_songs():
         bgm_list.append(
             {
-                "name": os.path.basename(file),
-                "size": os.path.getsize(file),
-                "file": file,
+                "name": song["name"],
+                "size": song["size"],
+                "file": song["file"],
+                "duration": song["duration"],
+                "sample_rate": song["sample_rate"],
+                "loudness": song["loudness"],
+                "gain": song["gain"],
             }
         )
     response = {"files": bgm_list}
@@ -215,6 +224,8 @@ def upload_bgm_file(request: Request, file: UploadFile = File(...)):
             # If the file already exists, it will be overwritten
             file.file.seek(0)
             buffer.write(file.file.read())
+        # an overwritten song does not change the mtime of the directory
+        song_library.refresh(force=True)
         response = {"file": save_path}
         return utils.get_response(200, response)
 
@@ -223,6 +234,26 @@ def upload_bgm_file(request: Request, file: UploadFile = File(...)):
     )
 
 
+@router.get(
+    "/caches",
+    response_model=CacheStatsResponse,
+    summary="Retrieve hit and miss counters of the local caches",
+)
+def get_cache_stats(request: Request):
+    response = {"caches": file_cache.get_stats(), "search": search_cache.get_stats()}
+    return utils.get_response(200, response)
+
+
+@router.get(
+    "/connections",
+    response_model=HttpStatsResponse,
+    summary="Retrieve request, retry and connection counters of the provider hosts",
+)
+def get_http_stats(request: Request):
+    response = {"hosts": http_client.get_stats()}
+    return utils.get_response(200, response)
+
+
 @router.get("/stream/{file_path:path}")
 async def stream_video(request: Request, file_path: str):
     tasks_dir = utils.task_dir()
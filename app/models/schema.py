@@ -103,6 +103,67 @@ class VideoParams(BaseModel):
     stroke_width: float = 1.5
     n_threads: Optional[int] = 2
     paragraph_number: Optional[int] = 1
+    # auto, nvenc, nvenc_hevc, qsv, vaapi, x264, x265, empty uses the video_encoder setting
+    video_encoder: Optional[str] = ""
+    # moviepy or ffmpeg, empty uses the render_engine setting
+    render_engine: Optional[str] = ""
+    # moviepy or libass, empty uses the subtitle_renderer setting
+    subtitle_renderer: Optional[str] = ""
+
+
+class TimelineClip(BaseModel):
+    source: str
+    start: float
+    end: float
+    width: int = 0
+    height: int = 0
+    transition: Optional[str] = None
+    # left, right, top or bottom, only used by slide transitions
+    transition_side: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class TimelineSubtitle(BaseModel):
+    start: float
+    end: float
+    text: str
+
+
+class TimelineAudioTrack(BaseModel):
+    kind: str  # voice or bgm
+    source: str
+    duration: float = 0
+    volume: float = 1.0
+    loop: bool = False
+    fade_out: float = 0
+
+
+class Timeline(BaseModel):
+    """
+    The edit decision list of one video: the cut list of the materials, the subtitle
+    events and the audio tracks. It is planned before rendering, so any render engine
+    can consume it without probing the materials again.
+    """
+
+    width: int
+    height: int
+    fps: int = 30
+    # duration of the voice track
+    duration: float = 0
+    clips: List[TimelineClip] = []
+    subtitle_path: str = ""
+    subtitles: List[TimelineSubtitle] = []
+    audio_tracks: List[TimelineAudioTrack] = []
+
+    @property
+    def video_duration(self) -> float:
+        return sum(clip.duration for clip in self.clips)
+
+    def get_audio_track(self, kind: str) -> Optional[TimelineAudioTrack]:
+        return next((track for track in self.audio_tracks if track.kind == kind), None)
 
 
 class SubtitleRequest(BaseModel):
@@ -285,6 +346,10 @@ class BgmRetrieveResponse(BaseResponse):
                             "name": "output013.mp3",
                             "size": 1891269,
                             "file": "/MoneyPrinterTurbo/resource/songs/output013.mp3",
+                            "duration": 180.0,
+                            "sample_rate": 48000,
+                            "loudness": -19.8,
+                            "gain": 1.023,
                         }
                     ]
                 },
@@ -301,3 +366,57 @@ class BgmUploadResponse(BaseResponse):
                 "data": {"file": "/MoneyPrinterTurbo/resource/songs/example.mp3"},
             },
         }
+
+
+class CacheStatsResponse(BaseResponse):
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": 200,
+                "message": "success",
+                "data": {
+                    "caches": [
+                        {
+                            "name": "cache_clips",
+                            "hits": 12,
+                            "misses": 4,
+                            "hit_rate": 0.75,
+                            "entries": 16,
+                            "size": 73400320,
+                            "max_size": 10737418240,
+                        }
+                    ],
+                    "search": {
+                        "name": "cache_search",
+                        "hits": 8,
+                        "stale_hits": 1,
+                        "misses": 3,
+                        "errors": 0,
+                        "hit_rate": 0.75,
+                        "entries": 11,
+                    },
+                },
+            },
+        }
+
+
+class HttpStatsResponse(BaseResponse):
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": 200,
+                "message": "success",
+                "data": {
+                    "hosts": [
+                        {
+                            "host": "api.pexels.com",
+                            "requests": 6,
+                            "retries": 1,
+                            "errors": 0,
+                            "connections": 1,
+                            "idle_connections": 1,
+                        }
+                    ]
+                },
+            },
+        }
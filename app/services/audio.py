@@ -0,0 +1,90 @@
+import os
+import tempfile
+
+import numpy as np
+from loguru import logger
+
+from app.config import config
+from app.models.schema import Timeline
+from app.services import narration
+from app.services.utils import ffmpeg, file_cache
+
+sample_rate = 44100
+channels = 2
+
+# decoded background music, shared by all tasks
+bgm_cache = file_cache.FileCache("cache_bgm", config.app.get("bgm_cache_size_mb", 1024))
+
+
+def get_bgm_pcm(bgm_file: str, rate: int = sample_rate) -> np.ndarray:
+    """
+    The background music as float32 PCM, decoded once per file and sample rate. Cached
+    songs are memory mapped, so only the part that is mixed in is read.
+    """
+    if not bgm_cache.enabled:
+        return ffmpeg.decode_audio(bgm_file, rate, channels)
+
+    key = file_cache.FileCache.make_key(file_cache.file_hash(bgm_file), rate, channels)
+    cached_file = bgm_cache.get(key, ext="npy")
+    if cached_file:
+        try:
+            return np.load(cached_file, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning(f"failed to load cached bgm {cached_file}: {str(e)}")
+
+    pcm = ffmpeg.decode_audio(bgm_file, rate, channels)
+    fd, temp_file = tempfile.mkstemp(suffix=".npy.tmp", dir=bgm_cache.cache_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, pcm)
+        bgm_cache.put(key, temp_file, ext="npy")
+    finally:
+        os.remove(temp_file)
+    return pcm
+
+
+def fade_out_envelope(length: int, fade_samples: int, volume: float, count: int) -> np.ndarray:
+    """
+    The first `count` gains of a track of `length` samples whose last `fade_samples`
+    fall linearly to silence.
+    """
+    gain = np.full(count, volume, dtype=np.float32)
+    fade_start = length - fade_samples
+    if fade_samples > 0 and count > fade_start:
+        position = np.arange(max(0, fade_start), count, dtype=np.float32)
+        gain[max(0, fade_start) :] *= (length - position) / fade_samples
+    return gain
+
+
+def mix_audio(timeline: Timeline, duration: float, output_file: str, rate: int = sample_rate) -> str:
+    """
+    Writes the voice and the looped background music of the timeline as one audio file,
+    at least `duration` seconds long. Like the ffmpeg render engine, the music fades out
+    at the end of the song and loops from there.
+    """
+    voice_track = timeline.get_audio_track("voice")
+    # decoded once per task and shared by all the videos of the task
+    voice = narration.get_pcm(voice_track.source, rate, channels)
+    samples = max(len(voice), int(round(duration * rate)))
+
+    mix = np.zeros((samples, channels), dtype=np.float32)
+    mix[: len(voice)] = voice
+    mix[: len(voice)] *= voice_track.volume
+
+    bgm_track = timeline.get_audio_track("bgm")
+    if bgm_track:
+        try:
+            song = get_bgm_pcm(bgm_track.source, rate)
+            length = len(song)
+            fade_samples = min(length, int(round(bgm_track.fade_out * rate)))
+            gain = fade_out_envelope(length, fade_samples, bgm_track.volume, min(length, samples))
+            for start in range(0, samples, length):
+                count = min(length, samples - start)
+                mix[start : start + count] += song[:count] * gain[:count, np.newaxis]
+                if not bgm_track.loop:
+                    break
+        except Exception as e:
+            logger.error(f"failed to add bgm: {str(e)}")
+
+    np.clip(mix, -1.0, 1.0, out=mix)
+    return ffmpeg.encode_audio(mix, rate, output_file)
@@ -0,0 +1,191 @@
+import os
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from loguru import logger
+from moviepy.config import FFMPEG_BINARY
+
+from app.config import config
+
+
+@dataclass(frozen=True)
+class EncoderProfile:
+    name: str
+    codec: str
+    # rate control and preset options
+    params: List[str] = field(default_factory=list)
+    # global options that open the hardware device, e.g. -vaapi_device
+    device_params: List[str] = field(default_factory=list)
+    # filter that uploads frames to the hardware device, appended to the filter chain
+    hw_filter: str = ""
+
+    @property
+    def key(self) -> str:
+        """Identifies the encoder output, used in cache keys."""
+        return " ".join([self.codec, *self.params, self.hw_filter])
+
+    @property
+    def codec_name(self) -> str:
+        """Name of the compressed format, as reported when the output is probed."""
+        return "hevc" if "265" in self.codec or "hevc" in self.codec else "h264"
+
+    @property
+    def ffmpeg_params(self) -> List[str]:
+        """Options for moviepy's write_videofile, which has no filter graph of its own."""
+        params = list(self.device_params)
+        if self.hw_filter:
+            params.extend(["-vf", self.hw_filter])
+        params.extend(self.params)
+        return params
+
+    @property
+    def output_params(self) -> List[str]:
+        """Options for ffmpeg commands that apply `hw_filter` in their own filter graph."""
+        return [*self.device_params, *self.params]
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+_vaapi_device = os.environ.get("VAAPI_DEVICE", "/dev/dri/renderD128")
+
+ENCODER_PROFILES: Dict[str, EncoderProfile] = {
+    "nvenc": EncoderProfile(
+        name="nvenc",
+        codec="h264_nvenc",
+        params=[
+            "-preset", "p4",           # NVENC preset: p1 (fastest) to p7 (slowest/best quality)
+            "-b:v", "5M",              # Target bitrate: 5 Mbps
+            "-maxrate", "8M",          # Maximum bitrate: 8 Mbps
+            "-bufsize", "10M",         # Buffer size for rate control
+        ],
+    ),
+    "nvenc_hevc": EncoderProfile(
+        name="nvenc_hevc",
+        codec="hevc_nvenc",
+        params=["-preset", "p4", "-b:v", "4M", "-maxrate", "6M", "-bufsize", "8M", "-tag:v", "hvc1"],
+    ),
+    "qsv": EncoderProfile(
+        name="qsv",
+        codec="h264_qsv",
+        params=["-preset", "medium", "-b:v", "5M", "-maxrate", "8M", "-bufsize", "10M", "-pix_fmt", "nv12"],
+    ),
+    "vaapi": EncoderProfile(
+        name="vaapi",
+        codec="h264_vaapi",
+        params=["-b:v", "5M", "-maxrate", "8M", "-bufsize", "10M"],
+        device_params=["-vaapi_device", _vaapi_device],
+        hw_filter="format=nv12,hwupload",
+    ),
+    "x264": EncoderProfile(
+        name="x264",
+        codec="libx264",
+        params=["-preset", "veryfast", "-crf", "21", "-maxrate", "8M", "-bufsize", "10M"],
+    ),
+    "x265": EncoderProfile(
+        name="x265",
+        codec="libx265",
+        params=["-preset", "fast", "-crf", "24", "-maxrate", "6M", "-bufsize", "8M", "-pix_fmt", "yuv420p", "-tag:v", "hvc1"],
+    ),
+}
+
+# order of preference of the "auto" encoder, libx264 is the cpu fallback
+AUTO_ENCODERS = ["nvenc", "qsv", "vaapi", "x264"]
+
+_lock = threading.Lock()
+_available_codecs = None
+_usable_profiles: Dict[str, bool] = {}
+
+
+def available_codecs() -> set:
+    """Video encoders compiled into ffmpeg, read once per process."""
+    global _available_codecs
+    with _lock:
+        if _available_codecs is not None:
+            return _available_codecs
+
+        codecs = set()
+        try:
+            result = subprocess.run(
+                [FFMPEG_BINARY, "-hide_banner", "-encoders"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=30,
+            )
+            for line in result.stdout.decode("utf-8", errors="ignore").splitlines():
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].startswith("V"):
+                    codecs.add(parts[1])
+        except Exception as e:
+            logger.error(f"failed to list ffmpeg encoders: {str(e)}")
+
+        _available_codecs = codecs
+        return codecs
+
+
+def is_usable(profile: EncoderProfile) -> bool:
+    """
+    Encodes a few frames with the profile. Hardware encoders are usually compiled into
+    ffmpeg even when the host has no matching device, so listing them is not enough.
+    """
+    with _lock:
+        if profile.name in _usable_profiles:
+            return _usable_profiles[profile.name]
+
+    usable = profile.codec in available_codecs()
+    if usable:
+        video_filter = "format=yuv420p"
+        if profile.hw_filter:
+            video_filter = f"{video_filter},{profile.hw_filter}"
+        cmd = [
+            FFMPEG_BINARY, "-hide_banner", "-loglevel", "error",
+            *profile.device_params,
+            "-f", "lavfi", "-i", "color=c=black:s=256x256:r=30:d=0.2",
+            "-vf", video_filter,
+            "-c:v", profile.codec,
+            *profile.params,
+            "-f", "null", "-",
+        ]
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+            usable = result.returncode == 0
+            if not usable:
+                stderr = result.stderr.decode("utf-8", errors="ignore").strip()
+                logger.debug(f"encoder {profile.codec} is not usable: {stderr}")
+        except Exception as e:
+            logger.debug(f"encoder {profile.codec} is not usable: {str(e)}")
+            usable = False
+
+    with _lock:
+        _usable_profiles[profile.name] = usable
+    return usable
+
+
+def probe_encoders() -> Dict[str, bool]:
+    result = {name: is_usable(profile) for name, profile in ENCODER_PROFILES.items()}
+    logger.info(f"video encoders: {result}, auto: {get_encoder('auto').codec}")
+    return result
+
+
+def get_encoder(name: str = "") -> EncoderProfile:
+    """
+    Returns the encoder profile by name ("auto", "nvenc", "x264", ...) or by ffmpeg codec
+    name ("h264_nvenc", "libx264", ...). An empty name uses the `video_encoder` setting.
+    Unusable encoders fall back to the automatic choice.
+    """
+    name = (name or config.app.get("video_encoder", "auto") or "auto").strip().lower()
+    if name != "auto":
+        profile = ENCODER_PROFILES.get(name)
+        if profile is None:
+            profile = next((p for p in ENCODER_PROFILES.values() if p.codec == name), None)
+        if profile and is_usable(profile):
+            return profile
+        logger.warning(f"video encoder '{name}' is not available, falling back to auto")
+
+    for auto_name in AUTO_ENCODERS:
+        profile = ENCODER_PROFILES[auto_name]
+        if is_usable(profile):
+            return profile
+    return ENCODER_PROFILES["x264"]
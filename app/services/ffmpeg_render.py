@@ -0,0 +1,153 @@
+import os
+
+from loguru import logger
+
+from app.models.schema import Timeline, VideoParams, VideoTransitionMode
+from app.services import encoder as video_encoders
+from app.services import video
+from app.services.utils import ass, ffmpeg
+from app.utils import utils
+
+audio_bitrate = "192k"
+audio_sample_rate = 44100
+
+
+def _transition_filter(transition: str, side: str, duration: float, video_width: int, video_height: int) -> str:
+    """
+    The same effects as app.services.utils.video_effects, applied to one clip over a black
+    background. Returns a filter that is inserted between the clip and the concat filter.
+    """
+    if transition == VideoTransitionMode.fade_in.value:
+        return "fade=t=in:st=0:d=1"
+    if transition == VideoTransitionMode.fade_out.value:
+        return f"fade=t=out:st={max(0.0, duration - 1):.3f}:d=1"
+
+    if transition == VideoTransitionMode.slide_in.value:
+        # progress goes from 0 to 1 during the first second
+        progress = "min(t,1)"
+    elif transition == VideoTransitionMode.slide_out.value:
+        # progress goes from 1 to 0 during the last second
+        progress = f"min({duration:.3f}-t,1)"
+    else:
+        return ""
+
+    x, y = "0", "0"
+    if side == "left":
+        x = f"-{video_width}*(1-{progress})"
+    elif side == "right":
+        x = f"{video_width}*(1-{progress})"
+    elif side == "top":
+        y = f"-{video_height}*(1-{progress})"
+    else:
+        y = f"{video_height}*(1-{progress})"
+    return f"overlay=x='{x}':y='{y}':eval=frame"
+
+
+def render_video(output_file: str, timeline: Timeline, params: VideoParams) -> str:
+    """
+    Renders the final video of `timeline` with a single ffmpeg process: every clip is
+    trimmed, scaled, padded and transitioned inside one filter graph, subtitles are burned
+    in by libass and the voice is mixed with the background music, so frames are decoded
+    and encoded once.
+    """
+    video_width, video_height = timeline.width, timeline.height
+    encoder = video_encoders.get_encoder(params.video_encoder)
+
+    clips = timeline.clips
+    if not clips:
+        raise ValueError("no clips available for rendering")
+    video_duration = timeline.video_duration
+    voice_track = timeline.get_audio_track("voice")
+    if voice_track is None:
+        raise ValueError("no voice track available for rendering")
+    subtitle_path = timeline.subtitle_path
+
+    logger.info(f"rendering video with ffmpeg: {video_width} x {video_height}, encoder: {encoder.codec}")
+    logger.info(f"  ① clips: {len(clips)}, duration: {video_duration:.2f}s, audio duration: {timeline.duration:.2f}s")
+    logger.info(f"  ② audio: {voice_track.source}")
+    logger.info(f"  ③ subtitle: {subtitle_path}")
+    logger.info(f"  ④ output: {output_file}")
+
+    args = []
+    filters = []
+    for i, clip in enumerate(clips):
+        duration = clip.duration
+        args.extend(["-ss", f"{clip.start:.3f}", "-t", f"{duration:.3f}", "-i", clip.source])
+
+        chain = (
+            f"[{i}:v]scale={video_width}:{video_height}:force_original_aspect_ratio=decrease,"
+            f"pad={video_width}:{video_height}:(ow-iw)/2:(oh-ih)/2:color=black,"
+            f"setsar=1,format=yuv420p,"
+            f"trim=duration={duration:.3f},setpts=PTS-STARTPTS,"
+            # after setpts, which would otherwise drop the frame rate of the fps filter
+            f"fps={timeline.fps}"
+        )
+        transition_filter = _transition_filter(
+            clip.transition, clip.transition_side, duration, video_width, video_height
+        )
+        if transition_filter.startswith("overlay"):
+            filters.append(f"{chain}[fg{i}]")
+            filters.append(
+                f"color=c=black:s={video_width}x{video_height}:r={timeline.fps}:d={duration:.3f}[bg{i}]"
+            )
+            filters.append(f"[bg{i}][fg{i}]{transition_filter}:shortest=1,format=yuv420p[v{i}]")
+        elif transition_filter:
+            filters.append(f"{chain},{transition_filter}[v{i}]")
+        else:
+            filters.append(f"{chain}[v{i}]")
+
+    inputs = "".join(f"[v{i}]" for i in range(len(clips)))
+    video_chain = f"{inputs}concat=n={len(clips)}:v=1:a=0"
+    ass_file = ""
+    if timeline.subtitles:
+        ass_file = f"{os.path.splitext(output_file)[0]}.ass"
+        ass.create_ass_file(timeline.subtitles, params, video_width, video_height, ass_file)
+        video_chain = f"{video_chain},{ffmpeg.subtitles_filter(ass_file, utils.font_dir())}"
+    if encoder.hw_filter:
+        video_chain = f"{video_chain},{encoder.hw_filter}"
+    filters.append(f"{video_chain}[vout]")
+
+    voice_index = len(clips)
+    args.extend(["-i", voice_track.source])
+    voice_chain = (
+        f"[{voice_index}:a]aresample={audio_sample_rate},"
+        f"aformat=channel_layouts=stereo,volume={voice_track.volume}"
+    )
+
+    bgm_track = timeline.get_audio_track("bgm")
+    if bgm_track:
+        args.extend(["-i", bgm_track.source])
+        filters.append(f"{voice_chain}[voice]")
+        # fade out before looping, like AudioFadeOut + AudioLoop in the moviepy path
+        filters.append(
+            f"[{voice_index + 1}:a]aresample={audio_sample_rate},aformat=channel_layouts=stereo,"
+            f"volume={bgm_track.volume},"
+            f"afade=t=out:st={max(0.0, bgm_track.duration - bgm_track.fade_out):.3f}:d={bgm_track.fade_out},"
+            f"aloop=loop=-1:size={int(bgm_track.duration * audio_sample_rate)},"
+            f"atrim=duration={video_duration:.3f}[bgm]"
+        )
+        filters.append("[voice][bgm]amix=inputs=2:duration=longest:dropout_transition=0:normalize=0[aout]")
+    else:
+        filters.append(f"{voice_chain}[aout]")
+
+    args.extend(
+        [
+            "-filter_complex", ";".join(filters),
+            "-map", "[vout]",
+            "-map", "[aout]",
+            "-r", str(timeline.fps),
+            "-c:v", encoder.codec,
+            *encoder.output_params,
+            "-c:a", video.audio_codec,
+            "-b:a", audio_bitrate,
+            "-threads", str(params.n_threads or 2),
+            "-movflags", "+faststart",
+            output_file,
+        ]
+    )
+    try:
+        ffmpeg.run(args)
+    finally:
+        if ass_file:
+            video.delete_files(ass_file)
+    return output_file
@@ -10,6 +10,7 @@ from openai import AzureOpenAI, OpenAI
 from openai.types.chat import ChatCompletion
 
 from app.config import config
+from app.services.utils import http_client
 
 _max_retries = 5
 
@@ -110,7 +111,9 @@ def _generate_response(prompt: str) -> str:
                     }
                     
                     # Make the API request
-                    response = requests.post(base_url, headers=headers, json=payload)
+                    response = http_client.post(
+                        base_url, headers=headers, json=payload, timeout=(30, 300)
+                    )
                     response.raise_for_status()
                     result = response.json()
                     
@@ -211,7 +214,7 @@ def _generate_response(prompt: str) -> str:
                 return generated_text
 
             if llm_provider == "cloudflare":
-                response = requests.post(
+                response = http_client.post(
                     f"https://api.cloudflare.com/client/v4/accounts/{account_id}/ai/run/{model_name}",
                     headers={"Authorization": f"Bearer {api_key}"},
                     json={
@@ -223,14 +226,15 @@ def _generate_response(prompt: str) -> str:
                             {"role": "user", "content": prompt},
                         ]
                     },
+                    timeout=(30, 300),
                 )
                 result = response.json()
                 logger.info(result)
                 return result["result"]["response"]
 
             if llm_provider == "ernie":
-                response = requests.post(
-                    "https://aip.baidubce.com/oauth/2.0/token", 
+                response = http_client.post(
+                    "https://aip.baidubce.com/oauth/2.0/token",
                     params={
                         "grant_type": "client_credentials",
                         "client_id": api_key,
@@ -253,8 +257,8 @@ def _generate_response(prompt: str) -> str:
                 )
                 headers = {"Content-Type": "application/json"}
 
-                response = requests.request(
-                    "POST", url, headers=headers, data=payload
+                response = http_client.post(
+                    url, headers=headers, data=payload, timeout=(30, 300)
                 ).json()
                 return response.get("result")
 
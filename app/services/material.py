@@ -1,18 +1,30 @@
+import contextlib
 import os
 import random
-from typing import List
-from urllib.parse import urlencode
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List
+from urllib.parse import urlencode, urlparse
 
 import requests
 from loguru import logger
-from moviepy.video.io.VideoFileClip import VideoFileClip
 
 from app.config import config
 from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode
+from app.services import probe, search_cache
+from app.services.utils import http_client
 from app.utils import utils
 
 requested_count = 0
 
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+# held while a video is downloaded, dropped when no download uses it
+_file_locks = weakref.WeakValueDictionary()
+_file_locks_lock = threading.Lock()
+
 
 def get_api_key(cfg_key: str):
     api_keys = config.app.get(cfg_key)
@@ -35,116 +47,224 @@ def search_videos_pexels(
     search_term: str,
     minimum_duration: int,
     video_aspect: VideoAspect = VideoAspect.portrait,
+) -> List[MaterialInfo]:
+    per_page = 20
+    # a missing api key fails the task even when the results are cached
+    api_key = get_api_key("pexels_api_keys")
+    return search_cache.search(
+        "pexels",
+        search_term,
+        video_aspect,
+        per_page,
+        minimum_duration,
+        fetch=lambda: _search_videos_pexels(
+            search_term, minimum_duration, video_aspect, per_page, api_key
+        ),
+    )
+
+
+def _search_videos_pexels(
+    search_term: str,
+    minimum_duration: int,
+    video_aspect: VideoAspect,
+    per_page: int,
+    api_key: str,
 ) -> List[MaterialInfo]:
     aspect = VideoAspect(video_aspect)
     video_orientation = aspect.name
     video_width, video_height = aspect.to_resolution()
-    api_key = get_api_key("pexels_api_keys")
     headers = {
         "Authorization": api_key,
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
     }
     # Build URL
-    params = {"query": search_term, "per_page": 20, "orientation": video_orientation}
+    params = {"query": search_term, "per_page": per_page, "orientation": video_orientation}
     query_url = f"https://api.pexels.com/videos/search?{urlencode(params)}"
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
-    try:
-        r = requests.get(
-            query_url,
-            headers=headers,
-            proxies=config.proxy,
-            verify=False,
-            timeout=(30, 60),
-        )
-        response = r.json()
-        video_items = []
-        if "videos" not in response:
-            logger.error(f"search videos failed: {response}")
-            return video_items
-        videos = response["videos"]
-        # loop through each video in the result
-        for v in videos:
-            duration = v["duration"]
-            # check if video has desired minimum duration
-            if duration < minimum_duration:
-                continue
-            video_files = v["video_files"]
-            # loop through each url to determine the best quality
-            for video in video_files:
-                w = int(video["width"])
-                h = int(video["height"])
-                if w == video_width and h == video_height:
-                    item = MaterialInfo()
-                    item.provider = "pexels"
-                    item.url = video["link"]
-                    item.duration = duration
-                    video_items.append(item)
-                    break
-        return video_items
-    except Exception as e:
-        logger.error(f"search videos failed: {str(e)}")
-
-    return []
+    r = http_client.get(
+        query_url,
+        headers=headers,
+        proxies=config.proxy,
+        verify=False,
+        timeout=(30, 60),
+    )
+    response = r.json()
+    video_items = []
+    if "videos" not in response:
+        raise ValueError(f"unexpected response: {response}")
+    videos = response["videos"]
+    # loop through each video in the result
+    for v in videos:
+        duration = v["duration"]
+        # check if video has desired minimum duration
+        if duration < minimum_duration:
+            continue
+        video_files = v["video_files"]
+        # loop through each url to determine the best quality
+        for video in video_files:
+            w = int(video["width"])
+            h = int(video["height"])
+            if w == video_width and h == video_height:
+                item = MaterialInfo()
+                item.provider = "pexels"
+                item.url = video["link"]
+                item.duration = duration
+                video_items.append(item)
+                break
+    return video_items
 
 
 def search_videos_pixabay(
     search_term: str,
     minimum_duration: int,
     video_aspect: VideoAspect = VideoAspect.portrait,
+) -> List[MaterialInfo]:
+    per_page = 50
+    # a missing api key fails the task even when the results are cached
+    api_key = get_api_key("pixabay_api_keys")
+    return search_cache.search(
+        "pixabay",
+        search_term,
+        video_aspect,
+        per_page,
+        minimum_duration,
+        fetch=lambda: _search_videos_pixabay(
+            search_term, minimum_duration, video_aspect, per_page, api_key
+        ),
+    )
+
+
+def _search_videos_pixabay(
+    search_term: str,
+    minimum_duration: int,
+    video_aspect: VideoAspect,
+    per_page: int,
+    api_key: str,
 ) -> List[MaterialInfo]:
     aspect = VideoAspect(video_aspect)
 
     video_width, video_height = aspect.to_resolution()
 
-    api_key = get_api_key("pixabay_api_keys")
     # Build URL
     params = {
         "q": search_term,
         "video_type": "all",  # Accepted values: "all", "film", "animation"
-        "per_page": 50,
+        "per_page": per_page,
         "key": api_key,
     }
     query_url = f"https://pixabay.com/api/videos/?{urlencode(params)}"
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
-    try:
-        r = requests.get(
-            query_url, proxies=config.proxy, verify=False, timeout=(30, 60)
+    r = http_client.get(
+        query_url, proxies=config.proxy, verify=False, timeout=(30, 60)
+    )
+    response = r.json()
+    video_items = []
+    if "hits" not in response:
+        raise ValueError(f"unexpected response: {response}")
+    videos = response["hits"]
+    # loop through each video in the result
+    for v in videos:
+        duration = v["duration"]
+        # check if video has desired minimum duration
+        if duration < minimum_duration:
+            continue
+        video_files = v["videos"]
+        # loop through each url to determine the best quality
+        for video_type in video_files:
+            video = video_files[video_type]
+            w = int(video["width"])
+            # h = int(video["height"])
+            if w >= video_width:
+                item = MaterialInfo()
+                item.provider = "pixabay"
+                item.url = video["url"]
+                item.duration = duration
+                video_items.append(item)
+                break
+    return video_items
+
+
+class IncompleteDownloadError(Exception):
+    pass
+
+
+def _content_length(r: requests.Response, offset: int) -> int | None:
+    """
+    The size of the whole file, from Content-Range for a resumed download.
+    """
+    content_range = r.headers.get("Content-Range", "")
+    if r.status_code == 206 and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = r.headers.get("Content-Length")
+    if content_length and content_length.isdigit():
+        return offset + int(content_length)
+    return None
+
+
+def download_file(
+    url: str,
+    file_path: str,
+    headers: dict = None,
+    stop_event: threading.Event = None,
+    chunk_size: int = 1024 * 1024,
+) -> bool:
+    """
+    Streams `url` to `file_path`.part and renames it to `file_path` once the size matches
+    the Content-Length. A partial file left by an interrupted or cancelled download is
+    resumed with a Range request. Returns False when the download was cancelled.
+    """
+    part_path = f"{file_path}.part"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    request_headers = dict(headers or {})
+    if offset:
+        request_headers["Range"] = f"bytes={offset}-"
+    with http_client.get(
+        url,
+        headers=request_headers,
+        proxies=config.proxy,
+        verify=False,
+        timeout=(60, 240),
+        stream=True,
+    ) as r:
+        if offset and r.status_code == 416:
+            # the partial file is not a prefix of the current file
+            os.remove(part_path)
+            return download_file(url, file_path, headers, stop_event, chunk_size)
+        r.raise_for_status()
+
+        content_range = r.headers.get("Content-Range", "")
+        if offset and not (r.status_code == 206 and content_range.startswith(f"bytes {offset}-")):
+            logger.info(f"server does not resume downloads, downloading again: {url}")
+            offset = 0
+        elif offset:
+            logger.info(f"resuming download at {offset} bytes: {url}")
+        expected_size = _content_length(r, offset)
+
+        with open(part_path, "ab" if offset else "wb") as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if stop_event is not None and stop_event.is_set():
+                    logger.info(f"download cancelled: {url}")
+                    return False
+                f.write(chunk)
+
+    size = os.path.getsize(part_path)
+    if expected_size is not None and size != expected_size:
+        if size > expected_size:
+            os.remove(part_path)
+        raise IncompleteDownloadError(
+            f"downloaded {size} bytes, expected {expected_size} bytes: {url}"
         )
-        response = r.json()
-        video_items = []
-        if "hits" not in response:
-            logger.error(f"search videos failed: {response}")
-            return video_items
-        videos = response["hits"]
-        # loop through each video in the result
-        for v in videos:
-            duration = v["duration"]
-            # check if video has desired minimum duration
-            if duration < minimum_duration:
-                continue
-            video_files = v["videos"]
-            # loop through each url to determine the best quality
-            for video_type in video_files:
-                video = video_files[video_type]
-                w = int(video["width"])
-                # h = int(video["height"])
-                if w >= video_width:
-                    item = MaterialInfo()
-                    item.provider = "pixabay"
-                    item.url = video["url"]
-                    item.duration = duration
-                    video_items.append(item)
-                    break
-        return video_items
-    except Exception as e:
-        logger.error(f"search videos failed: {str(e)}")
-
-    return []
+    os.replace(part_path, file_path)
+    return True
 
 
-def save_video(video_url: str, save_dir: str = "") -> str:
+def save_video(
+    video_url: str, save_dir: str = "", stop_event: threading.Event = None
+) -> str:
     if not save_dir:
         save_dir = utils.storage_dir("cache_videos")
 
@@ -156,34 +276,24 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     video_id = f"vid-{url_hash}"
     video_path = f"{save_dir}/{video_id}.mp4"
 
-    # if video already exists, return the path
-    if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
-        logger.info(f"video already exists: {video_path}")
-        return video_path
+    with _file_lock(video_path):
+        # if video already exists, return the path
+        if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
+            logger.info(f"video already exists: {video_path}")
+            return video_path
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
-    }
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
+        }
 
-    # if video does not exist, download it
-    with open(video_path, "wb") as f:
-        f.write(
-            requests.get(
-                video_url,
-                headers=headers,
-                proxies=config.proxy,
-                verify=False,
-                timeout=(60, 240),
-            ).content
-        )
+        # if video does not exist, download it
+        if not download_file(video_url, video_path, headers=headers, stop_event=stop_event):
+            return ""
 
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         try:
-            clip = VideoFileClip(video_path)
-            duration = clip.duration
-            fps = clip.fps
-            clip.close()
-            if duration > 0 and fps > 0:
+            info = probe.probe(video_path)
+            if info.duration > 0 and info.fps > 0:
                 return video_path
         except Exception as e:
             try:
@@ -194,6 +304,134 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     return ""
 
 
+def _file_lock(file_path: str) -> threading.Lock:
+    # a video is downloaded once when tasks need it at the same time
+    with _file_locks_lock:
+        return _file_locks.setdefault(file_path, threading.Lock())
+
+
+def _host_limit(url: str) -> threading.Semaphore:
+    host = urlparse(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.Semaphore(
+                config.app.get("material_download_per_host", 4)
+            )
+        return _host_limits[host]
+
+
+def _download_video(item: MaterialInfo, save_dir: str, stop_event: threading.Event) -> str:
+    try:
+        with _host_limit(item.url):
+            if stop_event.is_set():
+                return ""
+            logger.info(f"downloading video: {item.url}")
+            saved_video_path = save_video(
+                video_url=item.url, save_dir=save_dir, stop_event=stop_event
+            )
+        if saved_video_path:
+            logger.info(f"video saved: {saved_video_path}")
+        return saved_video_path
+    except Exception as e:
+        logger.error(f"failed to download video: {utils.to_json(item)} => {str(e)}")
+        return ""
+
+
+def download_in_order(
+    video_items: Iterable[MaterialInfo],
+    save_dir: str = "",
+    audio_duration: float = 0.0,
+    max_clip_duration: int = 5,
+) -> List[str]:
+    """
+    Downloads the videos concurrently and returns the saved paths in the order of
+    `video_items`, stopping once the downloaded clips are longer than `audio_duration`.
+    The items are only taken from `video_items` when a download can start.
+    Downloads only start while the finished and running ones may fall short of the
+    audio, the ones still running when it is covered are cancelled.
+    """
+    workers = max(1, config.app.get("material_download_workers", 4))
+    stop_event = threading.Event()
+    video_paths = []
+    total_duration = 0.0
+    # the clip seconds of the downloaded videos and of the running downloads
+    planned_duration = 0.0
+    pending = deque()
+    items = iter(video_items)
+    exhausted = False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while not exhausted and len(pending) < workers and planned_duration <= audio_duration:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                    break
+                future = executor.submit(_download_video, item, save_dir, stop_event)
+                pending.append((item, future))
+                planned_duration += min(max_clip_duration, item.duration)
+            if not pending:
+                break
+
+            item, future = pending.popleft()
+            seconds = min(max_clip_duration, item.duration)
+            saved_video_path = future.result()
+            if not saved_video_path:
+                planned_duration -= seconds
+                continue
+
+            video_paths.append(saved_video_path)
+            total_duration += seconds
+            if total_duration > audio_duration:
+                logger.info(
+                    f"total duration of downloaded videos: {total_duration} seconds, skip downloading more"
+                )
+                break
+
+        stop_event.set()
+        for _, future in pending:
+            future.cancel()
+
+    return video_paths
+
+
+def search_all(
+    search_videos: Callable[..., List[MaterialInfo]],
+    search_terms: List[str],
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    minimum_duration: int = 5,
+    audio_duration: float = 0.0,
+) -> Iterator[MaterialInfo]:
+    """
+    Searches all the terms at once and yields the videos of each term in the order of
+    the terms as soon as its search finished, skipping videos found by an earlier term.
+    """
+    seen_urls = set()
+    found_duration = 0.0
+    with ThreadPoolExecutor(max_workers=max(1, len(search_terms))) as executor:
+        futures = [
+            executor.submit(
+                search_videos,
+                search_term=search_term,
+                minimum_duration=minimum_duration,
+                video_aspect=video_aspect,
+            )
+            for search_term in search_terms
+        ]
+        for search_term, future in zip(search_terms, futures):
+            video_items = future.result()
+            logger.info(f"found {len(video_items)} videos for '{search_term}'")
+            for item in video_items:
+                if item.url not in seen_urls:
+                    seen_urls.add(item.url)
+                    found_duration += item.duration
+                    yield item
+
+    logger.info(
+        f"found total videos: {len(seen_urls)}, required duration: {audio_duration} seconds, found duration: {found_duration} seconds"
+    )
+
+
 def download_videos(
     task_id: str,
     search_terms: List[str],
@@ -203,60 +441,35 @@ def download_videos(
     audio_duration: float = 0.0,
     max_clip_duration: int = 5,
 ) -> List[str]:
-    valid_video_items = []
-    valid_video_urls = []
-    found_duration = 0.0
     search_videos = search_videos_pexels
     if source == "pixabay":
         search_videos = search_videos_pixabay
 
-    for search_term in search_terms:
-        video_items = search_videos(
-            search_term=search_term,
-            minimum_duration=max_clip_duration,
-            video_aspect=video_aspect,
-        )
-        logger.info(f"found {len(video_items)} videos for '{search_term}'")
-
-        for item in video_items:
-            if item.url not in valid_video_urls:
-                valid_video_items.append(item)
-                valid_video_urls.append(item.url)
-                found_duration += item.duration
-
-    logger.info(
-        f"found total videos: {len(valid_video_items)}, required duration: {audio_duration} seconds, found duration: {found_duration} seconds"
-    )
-    video_paths = []
-
     material_directory = config.app.get("material_directory", "").strip()
     if material_directory == "task":
         material_directory = utils.task_dir(task_id)
     elif material_directory and not os.path.isdir(material_directory):
         material_directory = ""
 
-    if video_contact_mode.value == VideoConcatMode.random.value:
-        random.shuffle(valid_video_items)
-
-    total_duration = 0.0
-    for item in valid_video_items:
-        try:
-            logger.info(f"downloading video: {item.url}")
-            saved_video_path = save_video(
-                video_url=item.url, save_dir=material_directory
-            )
-            if saved_video_path:
-                logger.info(f"video saved: {saved_video_path}")
-                video_paths.append(saved_video_path)
-                seconds = min(max_clip_duration, item.duration)
-                total_duration += seconds
-                if total_duration > audio_duration:
-                    logger.info(
-                        f"total duration of downloaded videos: {total_duration} seconds, skip downloading more"
-                    )
-                    break
-        except Exception as e:
-            logger.error(f"failed to download video: {utils.to_json(item)} => {str(e)}")
+    video_items = search_all(
+        search_videos,
+        search_terms,
+        video_aspect=video_aspect,
+        minimum_duration=max_clip_duration,
+        audio_duration=audio_duration,
+    )
+    with contextlib.closing(video_items):
+        if video_contact_mode.value == VideoConcatMode.random.value:
+            # shuffled across all the search terms
+            video_items = list(video_items)
+            random.shuffle(video_items)
+
+        video_paths = download_in_order(
+            video_items,
+            save_dir=material_directory,
+            audio_duration=audio_duration,
+            max_clip_duration=max_clip_duration,
+        )
     logger.success(f"downloaded {len(video_paths)} videos")
     return video_paths
 
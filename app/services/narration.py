@@ -0,0 +1,155 @@
+"""
+The narration of a task decoded once to raw PCM files next to it, one per sample format,
+with the duration and sample rate in a json file beside each. The timeline, the audio mix
+of every video variant and whisper read the samples from a memory mapping of these files.
+"""
+
+import glob
+import json
+import os
+import threading
+import weakref
+from typing import List
+
+import numpy as np
+from loguru import logger
+
+from app.services.utils import ffmpeg
+
+# the format the voice is mixed in and the one whisper transcribes
+mix_format = (44100, 2)
+whisper_format = (16000, 1)
+
+# one decode at a time per narration, other narrations are decoded meanwhile
+_locks = weakref.WeakValueDictionary()
+_locks_lock = threading.Lock()
+
+
+def pcm_file(audio_file: str, sample_rate: int, channels: int) -> str:
+    return f"{audio_file}.{sample_rate}x{channels}.f32"
+
+
+def _info_file(audio_file: str, sample_rate: int, channels: int) -> str:
+    return f"{pcm_file(audio_file, sample_rate, channels)}.json"
+
+
+def _lock(audio_file: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(os.path.abspath(audio_file), threading.Lock())
+
+
+def _source_stamp(audio_file: str) -> dict:
+    stat = os.stat(audio_file)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def get_info(audio_file: str, sample_rate: int = mix_format[0], channels: int = mix_format[1]) -> dict:
+    """
+    The duration, sample rate, channels and samples of the decoded narration, decoding
+    it first if needed.
+    """
+    info_file = _info_file(audio_file, sample_rate, channels)
+    with _lock(audio_file):
+        info = _read_info(info_file, audio_file)
+        if info is None:
+            decode(audio_file, [(sample_rate, channels)])
+            info = _read_info(info_file, audio_file)
+    if info is None:
+        raise RuntimeError(f"failed to decode {audio_file}")
+    return info
+
+
+def _read_info(info_file: str, audio_file: str) -> dict | None:
+    try:
+        with open(info_file, "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # the narration was generated again
+    if any(info.get(k) != v for k, v in _source_stamp(audio_file).items()):
+        return None
+    return info
+
+
+def decode(audio_file: str, formats: List[tuple]):
+    """
+    Decodes the narration to all (sample_rate, channels) `formats` in one ffmpeg pass.
+    """
+    # written under temporary names, a file in use by another process is replaced whole
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    outputs = [
+        (f"{pcm_file(audio_file, rate, channels)}{suffix}", rate, channels)
+        for rate, channels in formats
+    ]
+    logger.debug(f"decoding narration: {audio_file}, formats: {formats}")
+    try:
+        ffmpeg.decode_audio_files(audio_file, outputs)
+
+        stamp = _source_stamp(audio_file)
+        for temp_file, rate, channels in outputs:
+            samples = os.path.getsize(temp_file) // (4 * channels)
+            info = {
+                **stamp,
+                "sample_rate": rate,
+                "channels": channels,
+                "samples": samples,
+                "duration": samples / rate,
+            }
+            info_file = _info_file(audio_file, rate, channels)
+            with open(f"{info_file}{suffix}", "w", encoding="utf-8") as f:
+                json.dump(info, f)
+            os.replace(temp_file, pcm_file(audio_file, rate, channels))
+            os.replace(f"{info_file}{suffix}", info_file)
+    finally:
+        for temp_file, rate, channels in outputs:
+            for file in (temp_file, f"{_info_file(audio_file, rate, channels)}{suffix}"):
+                if os.path.exists(file):
+                    os.remove(file)
+
+
+def prepare(audio_file: str, formats: List[tuple]):
+    """
+    Decodes the formats that are not decoded yet, together.
+    """
+    with _lock(audio_file):
+        missing = [
+            (rate, channels)
+            for rate, channels in formats
+            if _read_info(_info_file(audio_file, rate, channels), audio_file) is None
+        ]
+        if missing:
+            decode(audio_file, missing)
+
+
+def get_pcm(audio_file: str, sample_rate: int = mix_format[0], channels: int = mix_format[1]) -> np.ndarray:
+    """
+    The narration as read-only float32 samples shaped (samples, channels).
+    """
+    info = get_info(audio_file, sample_rate, channels)
+    if not info["samples"]:
+        return np.zeros((0, channels), dtype=np.float32)
+    return np.memmap(
+        pcm_file(audio_file, sample_rate, channels),
+        dtype=np.float32,
+        mode="r",
+        shape=(info["samples"], channels),
+    )
+
+
+def get_duration(audio_file: str) -> float:
+    return get_info(audio_file)["duration"]
+
+
+def remove(audio_file: str):
+    """
+    Deletes the decoded formats of the narration, once the videos of the task are written.
+    """
+    with _lock(audio_file):
+        files = glob.glob(f"{glob.escape(audio_file)}.*x*.f32") + glob.glob(
+            f"{glob.escape(audio_file)}.*x*.f32.json"
+        )
+        for file in files:
+            try:
+                os.remove(file)
+            except OSError as e:
+                logger.warning(f"failed to delete decoded narration {file}: {str(e)}")
@@ -0,0 +1,405 @@
+"""
+Media metadata without opening a clip: duration, size and frame rate are read from the
+MP4 and MP3 headers in-process, other formats fall back to parsing `ffmpeg -i`. Results
+are kept in a sqlite index under the storage directory, keyed by path, size and mtime,
+so a file is only probed again after it changed.
+"""
+
+import json
+import math
+import os
+import sqlite3
+import struct
+import threading
+
+from loguru import logger
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from app.utils import utils
+
+_db = None
+_db_lock = threading.Lock()
+# the index is pruned when it is opened and after this many new entries
+prune_interval = 1000
+_writes = 0
+# bumped when MediaInfo gets new fields, older entries are probed again
+index_version = 2
+
+# boxes on the path from moov to the boxes read below
+_mp4_containers = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+# sample entry boxes with the decoder configuration of a video track
+_codec_config_boxes = {b"avcC", b"hvcC", b"av1C", b"vpcC"}
+
+_mp3_bitrates = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_mp3_sample_rates = [44100, 48000, 32000]
+
+
+class TruncatedFileError(ValueError):
+    pass
+
+
+class MediaInfo(dict):
+    """
+    duration in seconds, width and height after rotation, fps and the audio sample rate,
+    0 when unknown.
+    """
+
+    @property
+    def duration(self) -> float:
+        return self.get("duration") or 0.0
+
+    @property
+    def width(self) -> int:
+        return self.get("width") or 0
+
+    @property
+    def height(self) -> int:
+        return self.get("height") or 0
+
+    @property
+    def size(self) -> tuple:
+        return self.width, self.height
+
+    @property
+    def fps(self) -> float:
+        return self.get("fps") or 0.0
+
+    @property
+    def sample_rate(self) -> int:
+        return self.get("sample_rate") or 0
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: int = None):
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[offset : offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[offset + 8 : offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise ValueError(f"invalid {box_type!r} box")
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _read_moov(f, file_size: int) -> bytes:
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size or offset + size > file_size:
+            # a download that stopped in the middle of the media data
+            raise TruncatedFileError(f"truncated {box_type!r} box at {offset}")
+        if box_type == b"moov":
+            f.seek(offset + header_size)
+            return f.read(size - header_size)
+        offset += size
+    raise ValueError("no moov box")
+
+
+def _parse_track(data: bytes, start: int, end: int) -> dict:
+    track = {}
+
+    def walk(box_start, box_end):
+        for box_type, body, box_stop in _iter_boxes(data, box_start, box_end):
+            if box_type in _mp4_containers:
+                walk(body, box_stop)
+            elif box_type == b"tkhd":
+                # the display matrix follows the durations, 16.16 fixed point
+                matrix = body + (52 if data[body] == 1 else 40)
+                a, b = struct.unpack(">ii", data[matrix : matrix + 8])
+                track["rotation"] = round(math.degrees(math.atan2(b, a))) % 360
+            elif box_type == b"mdhd":
+                if data[body] == 1:
+                    timescale, duration = struct.unpack(">IQ", data[body + 20 : body + 32])
+                else:
+                    timescale, duration = struct.unpack(">II", data[body + 12 : body + 20])
+                track["timescale"], track["duration"] = timescale, duration
+            elif box_type == b"hdlr":
+                track["handler"] = data[body + 8 : body + 12]
+            elif box_type == b"stsd":
+                entry = body + 8
+                track["codec"] = data[entry + 4 : entry + 8].decode("latin-1")
+                if track.get("handler") == b"vide":
+                    track["width"], track["height"] = struct.unpack(
+                        ">HH", data[entry + 32 : entry + 36]
+                    )
+                    # the boxes after the 78 byte visual sample entry hold the decoder
+                    # configuration, e.g. the SPS and PPS in avcC
+                    entry_end = entry + struct.unpack(">I", data[entry : entry + 4])[0]
+                    for child_type, child_body, child_end in _iter_boxes(data, entry + 86, entry_end):
+                        if child_type in _codec_config_boxes:
+                            track["codec_config"] = data[child_body:child_end]
+            elif box_type == b"stts":
+                entries = struct.unpack(">I", data[body + 4 : body + 8])[0]
+                samples = [
+                    struct.unpack(">II", data[body + 8 + i * 8 : body + 16 + i * 8])
+                    for i in range(entries)
+                ]
+                # the duration of most samples, ffmpeg reports the frame rate from it too
+                track["sample_delta"] = max(samples)[1] if samples else 0
+
+    walk(start, end)
+    return track
+
+
+def probe_mp4(file_path: str) -> MediaInfo:
+    with open(file_path, "rb") as f:
+        moov = _read_moov(f, os.path.getsize(file_path))
+
+    info = MediaInfo(duration=0.0, width=0, height=0, fps=0.0, has_audio=False, sample_rate=0)
+    for box_type, body, box_end in _iter_boxes(moov):
+        if box_type == b"mvhd":
+            if moov[body] == 1:
+                timescale, duration = struct.unpack(">IQ", moov[body + 20 : body + 32])
+            else:
+                timescale, duration = struct.unpack(">II", moov[body + 12 : body + 20])
+            info["duration"] = duration / timescale if timescale else 0.0
+        elif box_type == b"trak":
+            track = _parse_track(moov, body, box_end)
+            handler = track.get("handler")
+            if handler == b"soun" and not info["has_audio"]:
+                info["has_audio"] = True
+                # the media timescale of an audio track is its sample rate
+                info["sample_rate"] = track.get("timescale", 0)
+            elif handler == b"vide" and not info["width"]:
+                width, height = track.get("width", 0), track.get("height", 0)
+                # ffmpeg rotates the decoded frames, so the display size is reported
+                if track.get("rotation") in (90, 270):
+                    width, height = height, width
+                info["width"], info["height"] = width, height
+                info["video_codec"] = track.get("codec", "")
+                if track.get("sample_delta"):
+                    info["fps"] = round(track.get("timescale", 0) / track["sample_delta"], 3)
+    if info.duration <= 0:
+        raise ValueError("no duration in mvhd")
+    return info
+
+
+def get_codec_config(file_path: str) -> bytes:
+    """
+    The decoder configuration of the first video track of an MP4 file, empty when there
+    is none. Two files can only share one decoder when it is the same.
+    """
+    with open(file_path, "rb") as f:
+        moov = _read_moov(f, os.path.getsize(file_path))
+    for box_type, body, box_end in _iter_boxes(moov):
+        if box_type == b"trak":
+            track = _parse_track(moov, body, box_end)
+            if track.get("handler") == b"vide":
+                return track.get("codec_config", b"")
+    return b""
+
+
+def _mp3_frame(header: bytes) -> dict | None:
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 3
+    layer = 4 - ((header[1] >> 1) & 3)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 3
+    if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    version = 1 if version_bits == 3 else 2
+    bitrate = _mp3_bitrates[(version, layer)][bitrate_index] * 1000
+    sample_rate = _mp3_sample_rates[sample_rate_index] >> {3: 0, 2: 1, 0: 2}[version_bits]
+    padding = (header[2] >> 1) & 1
+    if layer == 1:
+        samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 576 if layer == 3 and version == 2 else 1152
+        length = samples // 8 * bitrate // sample_rate + padding
+    return {
+        "version": version,
+        "layer": layer,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "samples": samples,
+        "length": length,
+        "mono": header[3] >> 6 == 3,
+    }
+
+
+def probe_mp3(file_path: str) -> MediaInfo:
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        head = f.read(10)
+        offset = 0
+        if head[:3] == b"ID3":
+            tag_size = 0
+            for byte in head[6:10]:
+                tag_size = (tag_size << 7) | (byte & 0x7F)
+            offset = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+
+        f.seek(offset)
+        data = f.read(64 * 1024)
+        f.seek(max(0, file_size - 128))
+        has_id3v1 = f.read(3) == b"TAG"
+
+    # the first frame header that is followed by another one
+    frame = None
+    for i in range(len(data) - 4):
+        frame = _mp3_frame(data[i : i + 4])
+        if frame and _mp3_frame(data[i + frame["length"] : i + frame["length"] + 4]):
+            break
+        frame = None
+    if not frame:
+        raise ValueError("no mp3 frame header")
+
+    # a Xing, Info or VBRI header holds the number of frames of a vbr file
+    frames = 0
+    if frame["layer"] == 3:
+        side_info = (32 if not frame["mono"] else 17) if frame["version"] == 1 else (17 if not frame["mono"] else 9)
+        xing = i + 4 + side_info
+        if data[xing : xing + 4] in (b"Xing", b"Info"):
+            flags = struct.unpack(">I", data[xing + 4 : xing + 8])[0]
+            if flags & 1:
+                frames = struct.unpack(">I", data[xing + 8 : xing + 12])[0]
+        elif data[i + 36 : i + 40] == b"VBRI":
+            frames = struct.unpack(">I", data[i + 50 : i + 54])[0]
+
+    if frames:
+        duration = frames * frame["samples"] / frame["sample_rate"]
+    else:
+        audio_size = file_size - offset - i - (128 if has_id3v1 else 0)
+        duration = audio_size * 8 / frame["bitrate"]
+    return MediaInfo(
+        duration=duration,
+        width=0,
+        height=0,
+        fps=0.0,
+        has_audio=True,
+        sample_rate=frame["sample_rate"],
+    )
+
+
+def probe_ffmpeg(file_path: str) -> MediaInfo:
+    infos = ffmpeg_parse_infos(file_path)
+    width, height = infos.get("video_size") or (0, 0)
+    if abs(infos.get("video_rotation", 0)) in (90, 270):
+        width, height = height, width
+    return MediaInfo(
+        duration=infos.get("duration") or 0.0,
+        width=width,
+        height=height,
+        fps=infos.get("video_fps") or 0.0,
+        has_audio=bool(infos.get("audio_found")),
+        sample_rate=infos.get("audio_fps") or 0,
+    )
+
+
+def _probe(file_path: str) -> MediaInfo:
+    with open(file_path, "rb") as f:
+        head = f.read(12)
+
+    parser = None
+    if head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+        parser = probe_mp4
+    elif head[:3] == b"ID3" or _mp3_frame(head[:4]):
+        parser = probe_mp3
+
+    if parser:
+        try:
+            return parser(file_path)
+        except TruncatedFileError:
+            # ffmpeg reads the headers of a truncated file just fine
+            raise
+        except Exception as e:
+            logger.debug(f"failed to read headers of {file_path}, probing with ffmpeg: {str(e)}")
+    return probe_ffmpeg(file_path)
+
+
+def _get_db() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        db_file = os.path.join(utils.storage_dir("probe", create=True), "probe.db")
+        _db = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, info TEXT)"
+        )
+        _db.commit()
+        _prune(_db)
+    return _db
+
+
+def _prune(db: sqlite3.Connection):
+    """
+    Removes the entries of files that were deleted or replaced, most are temporary clips.
+    """
+    stale = []
+    for path, size, mtime_ns in db.execute("SELECT path, size, mtime_ns FROM probes"):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stale.append((path,))
+            continue
+        if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+            stale.append((path,))
+    if stale:
+        db.executemany("DELETE FROM probes WHERE path = ?", stale)
+        db.commit()
+        logger.debug(f"pruned {len(stale)} entries from the probe index")
+
+
+def probe(file_path: str) -> MediaInfo:
+    """
+    Returns the metadata of a media file. Raises when the file cannot be read as media,
+    failures are not cached.
+    """
+    global _writes
+    stat = os.stat(file_path)
+    path = os.path.abspath(file_path)
+    try:
+        with _db_lock:
+            row = (
+                _get_db()
+                .execute("SELECT size, mtime_ns, info FROM probes WHERE path = ?", (path,))
+                .fetchone()
+            )
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            info = json.loads(row[2])
+            if info.pop("index_version", None) == index_version:
+                return MediaInfo(info)
+    except sqlite3.Error as e:
+        logger.warning(f"failed to read the probe index: {str(e)}")
+
+    info = _probe(file_path)
+    try:
+        with _db_lock:
+            db = _get_db()
+            db.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime_ns, info) VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, json.dumps({**info, "index_version": index_version})),
+            )
+            db.commit()
+            _writes += 1
+            if _writes % prune_interval == 0:
+                _prune(db)
+    except sqlite3.Error as e:
+        logger.warning(f"failed to update the probe index: {str(e)}")
+    return info
+
+
+def get_duration(file_path: str) -> float:
+    return probe(file_path).duration
@@ -0,0 +1,176 @@
+"""
+Results of the material searches kept in a sqlite table under the storage directory, keyed
+by provider, search term, aspect, page size and minimum duration. Results younger than
+`search_cache_ttl_hours` are used as they are, older ones are used for another
+`search_cache_stale_hours` while a background thread searches again, and failed searches
+fall back to the last results.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, List
+
+from loguru import logger
+
+from app.config import config
+from app.models.schema import MaterialInfo, VideoAspect
+from app.utils import utils
+
+_db = None
+_db_lock = threading.Lock()
+# keys searched again in the background
+_refreshing = set()
+_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "errors": 0}
+
+
+def _get_db() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        db_file = os.path.join(utils.storage_dir("cache_search", create=True), "search.db")
+        _db = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(
+            "CREATE TABLE IF NOT EXISTS searches ("
+            "key TEXT PRIMARY KEY, created_at REAL, items TEXT)"
+        )
+        _db.commit()
+        _prune(_db)
+    return _db
+
+
+def _prune(db: sqlite3.Connection):
+    """
+    Removes the results that are too old to be used even while searching again.
+    """
+    db.execute("DELETE FROM searches WHERE created_at < ?", (time.time() - _ttl() - _stale_ttl(),))
+    db.commit()
+
+
+def _ttl() -> float:
+    return config.app.get("search_cache_ttl_hours", 24) * 3600
+
+
+def _stale_ttl() -> float:
+    return config.app.get("search_cache_stale_hours", 72) * 3600
+
+
+def _count(counter: str):
+    with _db_lock:
+        _stats[counter] += 1
+
+
+def make_key(
+    provider: str, search_term: str, video_aspect: VideoAspect, per_page: int, minimum_duration: int
+) -> str:
+    aspect = VideoAspect(video_aspect).value
+    return json.dumps([provider, search_term.strip().lower(), aspect, per_page, minimum_duration])
+
+
+def _load(key: str):
+    try:
+        with _db_lock:
+            row = (
+                _get_db()
+                .execute("SELECT created_at, items FROM searches WHERE key = ?", (key,))
+                .fetchone()
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"failed to read the search cache: {str(e)}")
+        return None
+    if not row:
+        return None
+    return row[0], [MaterialInfo(**item) for item in json.loads(row[1])]
+
+
+def _store(key: str, items: List[MaterialInfo]):
+    now = time.time()
+    data = json.dumps(
+        [{"provider": item.provider, "url": item.url, "duration": item.duration} for item in items]
+    )
+    try:
+        with _db_lock:
+            db = _get_db()
+            db.execute(
+                "INSERT OR REPLACE INTO searches (key, created_at, items) VALUES (?, ?, ?)",
+                (key, now, data),
+            )
+            _prune(db)
+    except sqlite3.Error as e:
+        logger.warning(f"failed to update the search cache: {str(e)}")
+
+
+def _revalidate(key: str, fetch: Callable[[], List[MaterialInfo]]):
+    try:
+        _store(key, fetch())
+        logger.debug(f"search results refreshed: {key}")
+    except Exception as e:
+        _count("errors")
+        logger.warning(f"failed to refresh search results {key}: {str(e)}")
+    finally:
+        with _db_lock:
+            _refreshing.discard(key)
+
+
+def search(
+    provider: str,
+    search_term: str,
+    video_aspect: VideoAspect,
+    per_page: int,
+    minimum_duration: int,
+    fetch: Callable[[], List[MaterialInfo]],
+) -> List[MaterialInfo]:
+    """
+    The results of `fetch`, which raises when the search fails, from the cache when
+    possible. Returns an empty list when the search fails and nothing is cached.
+    """
+    ttl = _ttl()
+    key = make_key(provider, search_term, video_aspect, per_page, minimum_duration)
+    cached = _load(key) if ttl > 0 else None
+    if cached:
+        created_at, items = cached
+        age = time.time() - created_at
+        if age < ttl:
+            _count("hits")
+            logger.info(f"found {len(items)} cached videos for '{search_term}' ({provider})")
+            return items
+        if age < ttl + _stale_ttl():
+            _count("stale_hits")
+            with _db_lock:
+                start = key not in _refreshing
+                _refreshing.add(key)
+            if start:
+                threading.Thread(target=_revalidate, args=(key, fetch), daemon=True).start()
+            return items
+
+    _count("misses")
+    try:
+        items = fetch()
+    except Exception as e:
+        _count("errors")
+        logger.error(f"search videos failed: {str(e)}")
+        return cached[1] if cached else []
+    if ttl > 0:
+        _store(key, items)
+    return items
+
+
+def get_stats() -> dict:
+    entries = 0
+    try:
+        with _db_lock:
+            entries = _get_db().execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+    except sqlite3.Error as e:
+        logger.warning(f"failed to read the search cache: {str(e)}")
+    with _db_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+    hits = stats["hits"] + stats["stale_hits"]
+    return {
+        "name": "cache_search",
+        **stats,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        "entries": entries,
+    }
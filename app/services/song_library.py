@@ -0,0 +1,193 @@
+"""
+Index of the background music in the songs directory: duration, sample rate, integrated
+loudness and the gain that brings a song to `target_loudness`. The index is kept in the
+storage directory and refreshed when the mtime of the songs directory changes, only new
+or changed songs are analyzed again. Their duration is read from the headers right away,
+the loudness is measured in a background thread.
+"""
+
+import glob
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from loguru import logger
+
+from app.services import probe
+from app.services.utils import ffmpeg
+from app.utils import utils
+
+suffix = "*.mp3"
+# the loudness the suggested gains bring the songs to, in LUFS
+target_loudness = -20.0
+min_gain = 0.25
+max_gain = 4.0
+# bumped when the songs get new fields, older indexes are analyzed again
+index_version = 2
+
+_lock = threading.Lock()
+_songs = []
+_dir_mtime = None
+# the thread measuring the loudness of the songs not analyzed yet
+_analysis = None
+
+
+def _index_file() -> str:
+    return os.path.join(utils.storage_dir(create=True), "song_library.json")
+
+
+def suggested_gain(loudness: float | None) -> float:
+    if loudness is None:
+        return 1.0
+    gain = 10 ** ((target_loudness - loudness) / 20)
+    return round(min(max_gain, max(min_gain, gain)), 3)
+
+
+def probe_song(file_path: str) -> dict:
+    """
+    A song with the duration and sample rate from its headers, the loudness is measured
+    by `analyze_song`.
+    """
+    stat = os.stat(file_path)
+    song = {
+        "name": os.path.basename(file_path),
+        "file": file_path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "duration": 0.0,
+        "sample_rate": 0,
+        "loudness": None,
+        "gain": 1.0,
+        "analyzed": False,
+    }
+    try:
+        info = probe.probe(file_path)
+        song["duration"] = round(info.duration, 3)
+        song["sample_rate"] = info.sample_rate
+    except Exception as e:
+        logger.warning(f"failed to probe song {file_path}: {str(e)}")
+    return song
+
+
+def analyze_song(song: dict) -> dict:
+    song = dict(song, analyzed=True)
+    try:
+        song["loudness"] = ffmpeg.measure_loudness(song["file"])
+        song["gain"] = suggested_gain(song["loudness"])
+    except Exception as e:
+        logger.warning(f"failed to analyze song {song['file']}: {str(e)}")
+    return song
+
+
+def _load_index() -> dict:
+    try:
+        with open(_index_file(), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != index_version:
+            return {}
+        return {song["file"]: song for song in index.get("songs", [])}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(songs: List[dict]):
+    index_file = _index_file()
+    temp_file = f"{index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump({"version": index_version, "songs": songs}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, index_file)
+    except OSError as e:
+        logger.warning(f"failed to save the song library: {str(e)}")
+
+
+def _analyze_pending(pending: List[dict]):
+    global _songs, _analysis
+
+    logger.info(f"measuring the loudness of {len(pending)} songs")
+    analyzed = {}
+    try:
+        # the analysis runs in ffmpeg processes
+        with ThreadPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as executor:
+            analyzed = {song["file"]: song for song in executor.map(analyze_song, pending)}
+    except Exception as e:
+        logger.error(f"failed to analyze songs: {str(e)}")
+
+    with _lock:
+        _analysis = None
+        if not analyzed:
+            return
+        # a song replaced in the meantime is measured again below
+        songs = [
+            analyzed[song["file"]]
+            if song["file"] in analyzed and song["mtime_ns"] == analyzed[song["file"]]["mtime_ns"]
+            else song
+            for song in _songs
+        ]
+        _save_index(songs)
+        _songs = songs
+        pending = [song for song in songs if not song["analyzed"]]
+        if pending:
+            _start_analysis(pending)
+
+
+def _start_analysis(pending: List[dict]):
+    """
+    Measures the loudness of `pending` in the background, called with the lock held.
+    """
+    global _analysis
+    if _analysis is None:
+        _analysis = threading.Thread(target=_analyze_pending, args=(pending,), daemon=True)
+        _analysis.start()
+
+
+def refresh(force: bool = False) -> List[dict]:
+    global _songs, _dir_mtime
+
+    song_dir = utils.song_dir()
+    dir_mtime = os.stat(song_dir).st_mtime_ns
+    with _lock:
+        if not force and dir_mtime == _dir_mtime:
+            return _songs
+
+        known = _load_index()
+        songs = []
+        missing = []
+        for file_path in sorted(glob.glob(os.path.join(song_dir, suffix))):
+            stat = os.stat(file_path)
+            song = known.get(file_path)
+            if song and song["size"] == stat.st_size and song["mtime_ns"] == stat.st_mtime_ns:
+                songs.append(song)
+            else:
+                missing.append(file_path)
+
+        if missing:
+            logger.info(f"indexing {len(missing)} songs in {song_dir}")
+            songs.extend(probe_song(file_path) for file_path in missing)
+            songs.sort(key=lambda s: s["name"])
+
+        if missing or len(songs) != len(known):
+            _save_index(songs)
+        _songs, _dir_mtime = songs, dir_mtime
+
+        pending = [song for song in songs if not song["analyzed"]]
+        if pending:
+            _start_analysis(pending)
+        return songs
+
+
+def get_songs() -> List[dict]:
+    return refresh()
+
+
+def pick_song(min_duration: float = 0) -> dict | None:
+    """
+    A random song, preferring songs at least `min_duration` long, which are not looped.
+    """
+    songs = get_songs()
+    long_songs = [song for song in songs if song["duration"] >= min_duration]
+    candidates = long_songs or songs
+    return random.choice(candidates) if candidates else None
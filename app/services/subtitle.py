@@ -7,6 +7,7 @@ from faster_whisper import WhisperModel
 from loguru import logger
 
 from app.config import config
+from app.services import narration
 from app.utils import utils
 
 model_size = config.whisper.get("model_size", "large-v3")
@@ -45,8 +46,15 @@ def create(audio_file, subtitle_file: str = ""):
     if not subtitle_file:
         subtitle_file = f"{audio_file}.srt"
 
+    # the narration decoded for the audio mix is decoded in the same ffmpeg pass
+    try:
+        audio = narration.get_pcm(audio_file, *narration.whisper_format).reshape(-1)
+    except Exception as e:
+        logger.warning(f"failed to decode {audio_file}, transcribing the file: {str(e)}")
+        audio = audio_file
+
     segments, info = model.transcribe(
-        audio_file,
+        audio,
         beam_size=5,
         word_timestamps=True,
         vad_filter=True,
@@ -2,13 +2,23 @@ import math
 import os.path
 import re
 from os import path
+from timeit import default_timer as timer
 
 from loguru import logger
 
 from app.config import config
 from app.models import const
 from app.models.schema import VideoConcatMode, VideoParams
-from app.services import llm, material, subtitle, video, voice
+from app.services import (
+    ffmpeg_render,
+    llm,
+    material,
+    narration,
+    subtitle,
+    video,
+    voice,
+)
+from app.services import timeline as timeline_service
 from app.services import state as sm
 from app.utils import utils
 
@@ -111,6 +121,8 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
             logger.warning("subtitle file not found, fallback to whisper")
 
     if subtitle_provider == "whisper" or subtitle_fallback:
+        # one decode for whisper and for the audio mix of the videos
+        narration.prepare(audio_file, [narration.mix_format, narration.whisper_format])
         subtitle.create(audio_file=audio_file, subtitle_file=subtitle_path)
         logger.info("\n\n## correcting subtitle")
         subtitle.correct(subtitle_file=subtitle_path, video_script=video_script)
@@ -127,7 +139,9 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
     if params.video_source == "local":
         logger.info("\n\n## preprocess local materials")
         materials = video.preprocess_video(
-            materials=params.video_materials, clip_duration=params.video_clip_duration
+            materials=params.video_materials,
+            clip_duration=params.video_clip_duration,
+            video_encoder=params.video_encoder,
         )
         if not materials:
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -156,39 +170,87 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
         return downloaded_videos
 
 
-def generate_final_videos(
-    task_id, params, downloaded_videos, audio_file, subtitle_path
-):
-    final_video_paths = []
-    combined_video_paths = []
+def generate_timelines(task_id, params, downloaded_videos, audio_file, subtitle_path):
+    logger.info("\n\n## planning timelines")
     video_concat_mode = (
         params.video_concat_mode if params.video_count == 1 else VideoConcatMode.random
     )
-    video_transition_mode = params.video_transition_mode
 
-    _progress = 50
+    timelines = []
     for i in range(params.video_count):
         index = i + 1
+        timeline = timeline_service.build_timeline(
+            video_paths=downloaded_videos,
+            audio_file=audio_file,
+            subtitle_path=subtitle_path,
+            params=params,
+            video_concat_mode=video_concat_mode,
+        )
+        timeline_service.save_timeline(
+            timeline, path.join(utils.task_dir(task_id), f"timeline-{index}.json")
+        )
+        timelines.append(timeline)
+    return timelines
+
+
+def generate_final_videos(task_id, params, timelines, audio_file, subtitle_path):
+    try:
+        return _generate_final_videos(task_id, params, timelines, audio_file, subtitle_path)
+    finally:
+        # the decoded samples are only needed while the videos are rendered
+        narration.remove(audio_file)
+
+
+def _generate_final_videos(task_id, params, timelines, audio_file, subtitle_path):
+    final_video_paths = []
+    combined_video_paths = []
+
+    render_engine = (
+        params.render_engine or config.app.get("render_engine", "moviepy")
+    ).strip().lower()
+
+    _progress = 50
+    for i, timeline in enumerate(timelines):
+        index = i + 1
+        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
+        start_time = timer()
+
+        if render_engine == "ffmpeg":
+            logger.info(f"\n\n## rendering video with ffmpeg: {index} => {final_video_path}")
+            try:
+                ffmpeg_render.render_video(
+                    output_file=final_video_path,
+                    timeline=timeline,
+                    params=params,
+                )
+                _progress += 50 / params.video_count
+                sm.state.update_task(task_id, progress=_progress)
+                final_video_paths.append(final_video_path)
+                logger.info(
+                    f"video {index} rendered by ffmpeg in {timer() - start_time:.2f} seconds"
+                )
+                continue
+            except Exception as e:
+                logger.error(
+                    f"failed to render video with ffmpeg, falling back to moviepy: {str(e)}"
+                )
+
         combined_video_path = path.join(
             utils.task_dir(task_id), f"combined-{index}.mp4"
         )
         logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
         video.combine_videos(
             combined_video_path=combined_video_path,
-            video_paths=downloaded_videos,
+            video_paths=[],
             audio_file=audio_file,
-            video_aspect=params.video_aspect,
-            video_concat_mode=video_concat_mode,
-            video_transition_mode=video_transition_mode,
-            max_clip_duration=params.video_clip_duration,
             threads=params.n_threads,
+            video_encoder=params.video_encoder,
+            timeline=timeline,
         )
 
         _progress += 50 / params.video_count / 2
         sm.state.update_task(task_id, progress=_progress)
 
-        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
-
         logger.info(f"\n\n## generating video: {index} => {final_video_path}")
         video.generate_video(
             video_path=combined_video_path,
@@ -196,6 +258,7 @@ def generate_final_videos(
             subtitle_path=subtitle_path,
             output_file=final_video_path,
             params=params,
+            timeline=timeline,
         )
 
         _progress += 50 / params.video_count / 2
@@ -203,6 +266,9 @@ def generate_final_videos(
 
         final_video_paths.append(final_video_path)
         combined_video_paths.append(combined_video_path)
+        logger.info(
+            f"video {index} rendered by moviepy in {timer() - start_time:.2f} seconds"
+        )
 
     return final_video_paths, combined_video_paths
 
@@ -298,11 +364,26 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         )
         return {"materials": downloaded_videos}
 
+    # 6. Plan the timelines
+    timelines = generate_timelines(
+        task_id, params, downloaded_videos, audio_file, subtitle_path
+    )
+
+    if stop_at == "timeline":
+        timeline_data = [timeline.model_dump() for timeline in timelines]
+        sm.state.update_task(
+            task_id,
+            state=const.TASK_STATE_COMPLETE,
+            progress=100,
+            timelines=timeline_data,
+        )
+        return {"timelines": timeline_data}
+
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
 
-    # 6. Generate final videos
+    # 7. Generate final videos
     final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
+        task_id, params, timelines, audio_file, subtitle_path
     )
 
     if not final_video_paths:
@@ -0,0 +1,234 @@
+import itertools
+import os
+import random
+from typing import List
+
+from loguru import logger
+from moviepy.video.tools.subtitles import file_to_subtitles
+
+from app.models.schema import (
+    Timeline,
+    TimelineAudioTrack,
+    TimelineClip,
+    TimelineSubtitle,
+    VideoAspect,
+    VideoConcatMode,
+    VideoParams,
+    VideoTransitionMode,
+)
+from app.services import narration, probe, song_library
+
+fps = 30
+bgm_fade_out = 3
+
+
+def get_bgm_file(bgm_type: str = "random", bgm_file: str = "", min_duration: float = 0):
+    if not bgm_type:
+        return ""
+
+    if bgm_file and os.path.exists(bgm_file):
+        return bgm_file
+
+    if bgm_type == "random":
+        song = song_library.pick_song(min_duration)
+        return song["file"] if song else ""
+
+    return ""
+
+
+def get_audio_duration(audio_file: str) -> float:
+    return probe.get_duration(audio_file)
+
+
+def pick_transition(video_transition_mode: VideoTransitionMode = None):
+    """
+    Resolves the random parts of a transition up front, so clips rendered in other
+    processes get the same effect as when rendered in order.
+    """
+    shuffle_side = random.choice(["left", "right", "top", "bottom"])
+    if not video_transition_mode:
+        return VideoTransitionMode.none.value, shuffle_side
+
+    transition = VideoTransitionMode(video_transition_mode).value
+    if transition == VideoTransitionMode.shuffle.value:
+        transition = random.choice(
+            [
+                VideoTransitionMode.fade_in.value,
+                VideoTransitionMode.fade_out.value,
+                VideoTransitionMode.slide_in.value,
+                VideoTransitionMode.slide_out.value,
+            ]
+        )
+    return transition, shuffle_side
+
+
+def get_clip_windows(
+    video_paths: List[str],
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    max_clip_duration: int = 5,
+) -> List[TimelineClip]:
+    """
+    Cuts the materials into windows of `max_clip_duration` seconds, shuffled in random mode.
+    """
+    video_concat_mode = VideoConcatMode(video_concat_mode)
+    windows = []
+    for video_path in video_paths:
+        info = probe.probe(video_path)
+        clip_duration = info.duration
+        clip_w, clip_h = info.size
+
+        start_time = 0
+        while start_time < clip_duration:
+            end_time = min(start_time + max_clip_duration, clip_duration)
+            if clip_duration - start_time >= max_clip_duration:
+                windows.append(
+                    TimelineClip(
+                        source=video_path,
+                        start=start_time,
+                        end=end_time,
+                        width=clip_w,
+                        height=clip_h,
+                    )
+                )
+            start_time = end_time
+            if video_concat_mode.value == VideoConcatMode.sequential.value:
+                break
+
+    if video_concat_mode.value == VideoConcatMode.random.value:
+        random.shuffle(windows)
+
+    return windows
+
+
+def plan_clips(
+    video_paths: List[str],
+    audio_duration: float,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+) -> List[TimelineClip]:
+    """
+    Takes windows in order until the audio is covered, the last clip is trimmed to the
+    remaining audio and windows that are not needed are left out. Windows are looped if
+    the materials are too short, a looped window keeps its transition so the same cut
+    is rendered once.
+    """
+    windows = get_clip_windows(video_paths, video_concat_mode, max_clip_duration)
+    if not windows:
+        return []
+
+    transitions = {}
+    clips = []
+    # counted in frames, so every cut ends on a frame boundary
+    audio_frames = round(audio_duration * fps)
+    video_frames = 0
+    for i, window in enumerate(itertools.cycle(windows)):
+        remaining = audio_frames - video_frames
+        if remaining <= 0:
+            break
+
+        index = i % len(windows)
+        if index not in transitions:
+            transitions[index] = pick_transition(video_transition_mode)
+        transition, side = transitions[index]
+        if i == len(windows):
+            logger.warning(
+                f"video duration ({video_frames / fps:.2f}s) is shorter than audio duration ({audio_duration:.2f}s), looping clips to match audio length."
+            )
+
+        frames = min(round((window.end - window.start) * fps), remaining)
+        end = round(window.start + frames / fps, 6)
+        clips.append(
+            window.model_copy(update={"end": end, "transition": transition, "transition_side": side})
+        )
+        video_frames += frames
+
+    return clips
+
+
+def get_subtitles(subtitle_path: str) -> List[TimelineSubtitle]:
+    if not subtitle_path or not os.path.exists(subtitle_path):
+        return []
+
+    return [
+        TimelineSubtitle(start=start, end=end, text=text)
+        for (start, end), text in file_to_subtitles(subtitle_path, encoding="utf-8")
+    ]
+
+
+def get_audio_tracks(audio_file: str, params: VideoParams) -> List[TimelineAudioTrack]:
+    # the length of the decoded samples the voice is mixed from
+    voice_duration = narration.get_duration(audio_file)
+    tracks = [
+        TimelineAudioTrack(
+            kind="voice",
+            source=audio_file,
+            duration=voice_duration,
+            volume=params.voice_volume,
+        )
+    ]
+
+    # a song as long as the video is not looped
+    bgm_file = get_bgm_file(
+        bgm_type=params.bgm_type, bgm_file=params.bgm_file, min_duration=voice_duration
+    )
+    if bgm_file:
+        try:
+            tracks.append(
+                TimelineAudioTrack(
+                    kind="bgm",
+                    source=bgm_file,
+                    duration=get_audio_duration(bgm_file),
+                    volume=params.bgm_volume,
+                    loop=True,
+                    fade_out=bgm_fade_out,
+                )
+            )
+        except Exception as e:
+            logger.error(f"failed to add bgm: {str(e)}")
+    return tracks
+
+
+def build_timeline(
+    video_paths: List[str],
+    audio_file: str,
+    subtitle_path: str,
+    params: VideoParams,
+    video_concat_mode: VideoConcatMode = None,
+) -> Timeline:
+    video_width, video_height = VideoAspect(params.video_aspect).to_resolution()
+    audio_tracks = get_audio_tracks(audio_file, params)
+    audio_duration = audio_tracks[0].duration
+    clips = plan_clips(
+        video_paths=video_paths,
+        audio_duration=audio_duration,
+        video_concat_mode=video_concat_mode or params.video_concat_mode,
+        video_transition_mode=params.video_transition_mode,
+        max_clip_duration=params.video_clip_duration,
+    )
+    timeline = Timeline(
+        width=video_width,
+        height=video_height,
+        fps=fps,
+        duration=audio_duration,
+        clips=clips,
+        subtitle_path=subtitle_path or "",
+        subtitles=get_subtitles(subtitle_path),
+        audio_tracks=audio_tracks,
+    )
+    logger.info(
+        f"timeline planned: {len(clips)} clips, video duration: {timeline.video_duration:.2f}s, "
+        f"audio duration: {audio_duration:.2f}s, subtitles: {len(timeline.subtitles)}"
+    )
+    return timeline
+
+
+def save_timeline(timeline: Timeline, timeline_file: str) -> str:
+    with open(timeline_file, "w", encoding="utf-8") as f:
+        f.write(timeline.model_dump_json(indent=2))
+    return timeline_file
+
+
+def load_timeline(timeline_file: str) -> Timeline:
+    with open(timeline_file, "r", encoding="utf-8") as f:
+        return Timeline.model_validate_json(f.read())
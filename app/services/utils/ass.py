@@ -0,0 +1,225 @@
+import os
+import struct
+from typing import List
+
+from loguru import logger
+from PIL import ImageFont
+
+from app.models.schema import TimelineSubtitle, VideoParams
+from app.services.utils import text_layout
+from app.utils import utils
+
+
+def ass_color(color: str, alpha: int = 0) -> str:
+    """#RRGGBB => &HAABBGGRR"""
+    color = (color or "#FFFFFF").lstrip("#")
+    if len(color) != 6:
+        color = "FFFFFF"
+    r, g, b = color[0:2], color[2:4], color[4:6]
+    return f"&H{alpha:02X}{b}{g}{r}".upper()
+
+
+def format_time(seconds: float) -> str:
+    """seconds => H:MM:SS.cc"""
+    centiseconds = int(round(max(0.0, seconds) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+
+def escape_text(text: str) -> str:
+    text = text.replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}")
+    return text.replace("\r\n", "\n").replace("\n", "\\N")
+
+
+def get_font_info(font_path: str, font_size: int) -> tuple:
+    """Returns the family name libass looks the font up by, and whether it is bold."""
+    try:
+        family, style = ImageFont.truetype(font_path, font_size).getname()
+        return family, "bold" in (style or "").lower()
+    except Exception as e:
+        logger.warning(f"failed to read font name: {str(e)}")
+        return os.path.splitext(os.path.basename(font_path))[0], False
+
+
+def _read_win_metrics(font_path: str):
+    """
+    The units per em and the OS/2 win ascent and descent of the font, None when they
+    can't be read.
+    """
+    try:
+        with open(font_path, "rb") as f:
+            data = f.read()
+        offset = 0
+        if data[:4] == b"ttcf":
+            # the first font of a collection, the one PIL loads by default
+            offset = struct.unpack(">I", data[12:16])[0]
+        num_tables = struct.unpack(">H", data[offset + 4 : offset + 6])[0]
+        tables = {}
+        for i in range(num_tables):
+            record = offset + 12 + 16 * i
+            tag, _, table_offset, _ = struct.unpack(">4sIII", data[record : record + 16])
+            tables[tag] = table_offset
+        head, os2 = tables[b"head"], tables[b"OS/2"]
+        units_per_em = struct.unpack(">H", data[head + 18 : head + 20])[0]
+        win_ascent, win_descent = struct.unpack(">HH", data[os2 + 74 : os2 + 78])
+        if units_per_em and win_ascent + win_descent:
+            return units_per_em, win_ascent, win_descent
+    except Exception as e:
+        logger.warning(f"failed to read font metrics: {str(e)}")
+    return None
+
+
+def get_font_scale(font_path: str) -> float:
+    """
+    libass scales a font so its OS/2 win ascent plus descent fills the font size, while
+    PIL, and so the TextClip overlays, scale the em square. Returns the factor from the
+    PIL font size to the ASS font size.
+    """
+    metrics = _read_win_metrics(font_path)
+    if not metrics:
+        return 1.0
+    units_per_em, win_ascent, win_descent = metrics
+    return (win_ascent + win_descent) / units_per_em
+
+
+def get_font_ascent(font_path: str, font_size: int) -> float:
+    """
+    Distance from the top of a line libass draws to its baseline, at the PIL `font_size`.
+    """
+    metrics = _read_win_metrics(font_path)
+    if not metrics:
+        return float(font_size)
+    units_per_em, win_ascent, _ = metrics
+    return font_size * win_ascent / units_per_em
+
+
+def create_style(params: VideoParams, font_path: str, video_width: int, video_height: int) -> str:
+    font_size = int(params.font_size)
+    font_family, bold = get_font_info(font_path, font_size)
+
+    # the same placement as the TextClip overlays of generate_video
+    margin_h = int(video_width * 0.05)
+    if params.subtitle_position == "top":
+        alignment = 8
+        margin_v = int(video_height * 0.05)
+    elif params.subtitle_position == "center":
+        alignment = 5
+        margin_v = 0
+    elif params.subtitle_position == "custom":
+        # every event is placed with \pos, see get_custom_position
+        alignment = 8
+        margin_v = 10
+    else:
+        alignment = 2
+        margin_v = int(video_height * 0.05)
+
+    background = params.text_background_color
+    if isinstance(background, str) and background.startswith("#"):
+        # opaque box behind the text
+        border_style, back_color = 3, ass_color(background)
+    else:
+        border_style, back_color = 1, ass_color("#000000", 0xFF)
+
+    fields = [
+        "Default",
+        font_family,
+        f"{font_size * get_font_scale(font_path):.1f}",
+        ass_color(params.text_fore_color),
+        ass_color(params.text_fore_color),
+        ass_color(params.stroke_color),
+        back_color,
+        "-1" if bold else "0",
+        "0",
+        "0",
+        "0",
+        "100",
+        "100",
+        "0",
+        "0",
+        str(border_style),
+        f"{float(params.stroke_width):g}",
+        "0",
+        str(alignment),
+        str(margin_h),
+        str(margin_h),
+        str(margin_v),
+        "1",
+    ]
+    return "Style: " + ",".join(fields)
+
+
+def get_custom_position(
+    text: str, params: VideoParams, font_path: str, video_width: int, video_height: int
+) -> list:
+    """
+    Wraps `text` like the TextClip overlays and returns its lines, each with the top center
+    point libass draws it at. The TextClip's top is at `custom_position` of the space its
+    height leaves, and its lines are closer together than libass would put them.
+    """
+    font_size = int(params.font_size)
+    text, _ = text_layout.wrap_text(text, video_width * 0.9, font_path, font_size)
+    height, baselines = text_layout.get_label_layout(text, font_path, font_size, int(params.stroke_width))
+    # the same bounds as create_text_clip
+    margin = 10
+    top = (video_height - height) * (float(params.custom_position) / 100)
+    top = max(margin, min(top, video_height - height - margin))
+    ascent = get_font_ascent(font_path, font_size)
+    return [
+        (line, (video_width / 2, top + baseline - ascent))
+        for line, baseline in zip(text.split("\n"), baselines)
+    ]
+
+
+def create_ass_file(
+    subtitles: List[TimelineSubtitle],
+    params: VideoParams,
+    video_width: int,
+    video_height: int,
+    ass_file: str,
+) -> str:
+    """
+    Writes the subtitle events as an ASS file styled by `params`, for ffmpeg's subtitles
+    filter. The script resolution is the video resolution, so sizes are in pixels.
+    """
+    if not params.font_name:
+        params.font_name = "STHeitiMedium.ttc"
+    font_path = os.path.join(utils.font_dir(), params.font_name)
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {video_width}",
+        f"PlayResY: {video_height}",
+        "WrapStyle: 0",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, "
+        "BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, "
+        "BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+        create_style(params, font_path, video_width, video_height),
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for item in subtitles:
+        texts = [escape_text(item.text)]
+        if params.subtitle_position == "custom":
+            # one event per line, ASS has no line spacing to match the TextClip's
+            texts = [
+                f"{{\\an8\\pos({x:.0f},{y:.0f})}}{escape_text(line)}"
+                for line, (x, y) in get_custom_position(
+                    item.text, params, font_path, video_width, video_height
+                )
+            ]
+        for text in texts:
+            lines.append(
+                f"Dialogue: 0,{format_time(item.start)},{format_time(item.end)},Default,,0,0,0,,"
+                f"{text}"
+            )
+
+    with open(ass_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return ass_file
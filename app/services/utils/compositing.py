@@ -0,0 +1,42 @@
+from bisect import bisect_left, bisect_right
+
+from moviepy import CompositeVideoClip
+
+
+class IntervalCompositeVideoClip(CompositeVideoClip):
+    """
+    A CompositeVideoClip that looks up the clips playing at `t` in an index of their
+    sorted start times, instead of checking every clip on every frame. Only the clips
+    that started less than the longest clip duration ago are checked, so the cost of a
+    frame does not grow with the number of short overlays such as subtitle lines.
+    """
+
+    def __init__(self, clips, size=None, bg_color=None, use_bgclip=False, is_mask=False):
+        super().__init__(
+            clips, size=size, bg_color=bg_color, use_bgclip=use_bgclip, is_mask=is_mask
+        )
+        self._build_index()
+
+        if isinstance(self.mask, CompositeVideoClip) and not isinstance(
+            self.mask, IntervalCompositeVideoClip
+        ):
+            self.mask = IntervalCompositeVideoClip(
+                self.mask.clips, self.size, is_mask=True, bg_color=0.0
+            )
+
+    def _build_index(self):
+        # positions in self.clips, which is sorted by layer
+        bounded = [i for i, clip in enumerate(self.clips) if clip.end is not None]
+        bounded.sort(key=lambda i: self.clips[i].start)
+        self._order = bounded
+        self._starts = [self.clips[i].start for i in bounded]
+        self._max_duration = max(
+            (self.clips[i].end - self.clips[i].start for i in bounded), default=0
+        )
+        self._unbounded = [i for i, clip in enumerate(self.clips) if clip.end is None]
+
+    def playing_clips(self, t=0):
+        hi = bisect_right(self._starts, t)
+        lo = bisect_left(self._starts, t - self._max_duration, 0, hi)
+        indices = sorted(self._order[lo:hi] + self._unbounded)
+        return [self.clips[i] for i in indices if self.clips[i].is_playing(t)]
@@ -0,0 +1,351 @@
+import hashlib
+import os
+import re
+import subprocess
+import threading
+from typing import List
+
+import numpy as np
+from loguru import logger
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.io.ffmpeg_reader import FFmpegInfosParser
+
+from app.services import probe
+from app.services.encoder import EncoderProfile
+
+_memo_lock = threading.Lock()
+_stream_infos = {}
+_keyframes = {}
+# temp files are probed too, the memos are cleared once they grow past this size
+_max_memo_size = 4096
+
+
+def run(args: List[str], input: bytes = None) -> subprocess.CompletedProcess:
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", *args]
+    logger.debug(f"running ffmpeg: {' '.join(cmd)}")
+    result = subprocess.run(cmd, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        stderr = result.stderr.decode("utf-8", errors="ignore").strip()
+        raise RuntimeError(f"ffmpeg exited with code {result.returncode}: {stderr}")
+    return result
+
+
+def escape_filter_value(value: str) -> str:
+    """Quotes a file path for use as a filter option inside -vf or -filter_complex."""
+    value = value.replace("\\", "/").replace(":", "\\:").replace("'", r"'\''")
+    return f"'{value}'"
+
+
+def subtitles_filter(subtitle_file: str, fonts_dir: str = "") -> str:
+    subtitles = f"subtitles=filename={escape_filter_value(subtitle_file)}"
+    if fonts_dir:
+        subtitles = f"{subtitles}:fontsdir={escape_filter_value(fonts_dir)}"
+    return subtitles
+
+
+def _file_memo_key(file_path: str) -> tuple:
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+
+def get_video_stream_info(file_path: str) -> dict:
+    """
+    Returns the parameters that must match for two files to be joined with stream copy.
+    """
+    memo_key = _file_memo_key(file_path)
+    with _memo_lock:
+        if memo_key in _stream_infos:
+            return _stream_infos[memo_key]
+
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-hide_banner", "-i", file_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    output = result.stderr.decode("utf-8", errors="ignore")
+    infos = FFmpegInfosParser(output, file_path).parse()
+    pix_fmt = re.search(r"Stream #.*?Video: [^,]+, (\w+)", output)
+    time_base = re.search(r"Stream #.*?Video: .*?([\d.]+k?) tbn", output)
+    try:
+        # segments from different encoders carry different SPS and PPS
+        codec_config = hashlib.sha1(probe.get_codec_config(file_path)).hexdigest()
+    except Exception:
+        codec_config = None
+    info = {
+        "codec": infos.get("video_codec_name"),
+        "profile": infos.get("video_profile"),
+        "size": tuple(infos.get("video_size") or ()),
+        "fps": infos.get("video_fps"),
+        "pix_fmt": pix_fmt.group(1) if pix_fmt else None,
+        "time_base": time_base.group(1) if time_base else None,
+        "codec_config": codec_config,
+        "duration": infos.get("duration"),
+    }
+    with _memo_lock:
+        if len(_stream_infos) >= _max_memo_size:
+            _stream_infos.clear()
+        _stream_infos[memo_key] = info
+    return info
+
+
+def get_keyframes(file_path: str) -> List[float]:
+    """
+    Timestamps of the keyframes of the first video stream, only keyframes are decoded.
+    """
+    memo_key = _file_memo_key(file_path)
+    with _memo_lock:
+        if memo_key in _keyframes:
+            return _keyframes[memo_key]
+
+    result = subprocess.run(
+        [
+            FFMPEG_BINARY, "-hide_banner",
+            "-skip_frame", "nokey",
+            "-i", file_path,
+            "-map", "0:v:0",
+            "-vf", "showinfo",
+            "-f", "null", "-",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    output = result.stderr.decode("utf-8", errors="ignore")
+    keyframes = sorted(float(t) for t in re.findall(r"pts_time:(-?[\d.]+)", output))
+    with _memo_lock:
+        if len(_keyframes) >= _max_memo_size:
+            _keyframes.clear()
+        _keyframes[memo_key] = keyframes
+    return keyframes
+
+
+def measure_loudness(audio_file: str) -> float | None:
+    """
+    Integrated loudness of the first audio stream in LUFS (EBU R128), None if unknown.
+    """
+    result = subprocess.run(
+        [
+            FFMPEG_BINARY, "-hide_banner", "-nostats",
+            "-i", audio_file,
+            "-map", "0:a:0",
+            "-af", "ebur128=framelog=quiet",
+            "-f", "null", "-",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    output = result.stderr.decode("utf-8", errors="ignore")
+    matches = re.findall(r"I:\s+(-?[\d.]+) LUFS", output)
+    return float(matches[-1]) if matches else None
+
+
+def cut_video(file_path: str, output_file: str, start: float, frames: int) -> str:
+    """
+    Cuts `frames` frames with stream copy and drops the audio. `start` must be a keyframe.
+    """
+    run(
+        [
+            "-ss", f"{start:.3f}",
+            "-i", file_path,
+            "-frames:v", str(frames),
+            "-map", "0:v:0",
+            "-c", "copy",
+            "-avoid_negative_ts", "make_zero",
+            "-movflags", "+faststart",
+            output_file,
+        ]
+    )
+    return output_file
+
+
+def can_join_with_copy(video_files: List[str]) -> bool:
+    """
+    Whether the files can be joined with the concat demuxer and stream copy, one decoder
+    must be able to play all of them.
+    """
+    stream_infos = []
+    for video_file in dict.fromkeys(video_files):
+        info = get_video_stream_info(video_file)
+        stream_infos.append({k: v for k, v in info.items() if k != "duration"})
+    return all(info == stream_infos[0] for info in stream_infos)
+
+
+def _escape_concat_path(file_path: str) -> str:
+    file_path = os.path.abspath(file_path).replace("\\", "/")
+    return file_path.replace("'", "'\\''")
+
+
+def concat_videos(
+    video_files: List[str],
+    output_file: str,
+    size: tuple,
+    fps: int,
+    encoder: EncoderProfile,
+    threads: int = 2,
+) -> str:
+    """
+    Joins the video files in a single linear pass.
+
+    When every file shares the same codec parameters, decoder configuration and time
+    base they are joined with the concat demuxer and stream copy, otherwise they are decoded once and re-encoded once
+    through the concat filter.
+    """
+    if can_join_with_copy(video_files):
+        output_dir = os.path.dirname(output_file)
+        list_file = os.path.join(output_dir, "temp-concat-list.txt")
+        with open(list_file, "w", encoding="utf-8") as f:
+            for video_file in video_files:
+                f.write(f"file '{_escape_concat_path(video_file)}'\n")
+        try:
+            logger.info(f"joining {len(video_files)} clips with stream copy")
+            run(
+                [
+                    "-f", "concat",
+                    "-safe", "0",
+                    "-i", list_file,
+                    "-c", "copy",
+                    "-movflags", "+faststart",
+                    output_file,
+                ]
+            )
+        finally:
+            try:
+                os.remove(list_file)
+            except OSError:
+                pass
+        return output_file
+
+    logger.info(
+        f"codec parameters differ between clips, re-encoding {len(video_files)} clips in one pass"
+    )
+    video_width, video_height = size
+    args = []
+    for video_file in video_files:
+        args.extend(["-i", video_file])
+
+    filters = []
+    for i in range(len(video_files)):
+        filters.append(
+            f"[{i}:v]scale={video_width}:{video_height},setsar=1,fps={fps},format=yuv420p[v{i}]"
+        )
+    inputs = "".join(f"[v{i}]" for i in range(len(video_files)))
+    concat_filter = f"{inputs}concat=n={len(video_files)}:v=1:a=0"
+    if encoder.hw_filter:
+        concat_filter = f"{concat_filter},{encoder.hw_filter}"
+    filters.append(f"{concat_filter}[outv]")
+
+    args.extend(
+        [
+            "-filter_complex", ";".join(filters),
+            "-map", "[outv]",
+            "-c:v", encoder.codec,
+            *encoder.output_params,
+            "-threads", str(threads),
+            "-movflags", "+faststart",
+            output_file,
+        ]
+    )
+    run(args)
+    return output_file
+
+
+def mux_audio(video_file: str, audio_file: str, output_file: str) -> str:
+    """
+    Adds the audio track to a video without re-encoding either of them.
+    """
+    run(
+        [
+            "-i", video_file,
+            "-i", audio_file,
+            "-map", "0:v:0",
+            "-map", "1:a:0",
+            "-c", "copy",
+            "-shortest",
+            "-movflags", "+faststart",
+            output_file,
+        ]
+    )
+    return output_file
+
+
+def decode_audio(audio_file: str, sample_rate: int, channels: int = 2) -> np.ndarray:
+    """
+    Decodes the first audio stream to float32 PCM, shaped (samples, channels).
+    """
+    result = run(
+        [
+            "-i", audio_file,
+            "-map", "0:a:0",
+            "-f", "f32le",
+            "-acodec", "pcm_f32le",
+            "-ar", str(sample_rate),
+            "-ac", str(channels),
+            "-",
+        ]
+    )
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels)
+
+
+def decode_audio_files(audio_file: str, outputs: List[tuple]) -> List[str]:
+    """
+    Decodes the first audio stream once into raw float32 PCM files, one per
+    (output_file, sample_rate, channels) of `outputs`.
+    """
+    args = ["-i", audio_file]
+    for output_file, sample_rate, channels in outputs:
+        args += [
+            "-map", "0:a:0",
+            "-f", "f32le",
+            "-acodec", "pcm_f32le",
+            "-ar", str(sample_rate),
+            "-ac", str(channels),
+            output_file,
+        ]
+    run(args)
+    return [output_file for output_file, _, _ in outputs]
+
+
+def encode_audio(pcm: np.ndarray, sample_rate: int, output_file: str, codec: str = "aac") -> str:
+    """
+    Encodes float32 PCM shaped (samples, channels) to an audio file.
+    """
+    run(
+        [
+            "-f", "f32le",
+            "-ar", str(sample_rate),
+            "-ac", str(pcm.shape[1]),
+            "-i", "-",
+            "-c:a", codec,
+            output_file,
+        ],
+        input=np.ascontiguousarray(pcm, dtype=np.float32).tobytes(),
+    )
+    return output_file
+
+
+def burn_subtitles(
+    video_file: str,
+    subtitle_file: str,
+    output_file: str,
+    encoder: EncoderProfile,
+    fonts_dir: str = "",
+    threads: int = 2,
+) -> str:
+    """
+    Draws the subtitles on the video with libass while encoding it, the audio is dropped.
+    """
+    video_filter = subtitles_filter(subtitle_file, fonts_dir)
+    if encoder.hw_filter:
+        video_filter = f"{video_filter},{encoder.hw_filter}"
+    run(
+        [
+            "-i", video_file,
+            "-map", "0:v:0",
+            "-vf", video_filter,
+            "-c:v", encoder.codec,
+            *encoder.output_params,
+            "-threads", str(threads),
+            "-movflags", "+faststart",
+            output_file,
+        ]
+    )
+    return output_file
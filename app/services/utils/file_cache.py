@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from loguru import logger
+
+from app.utils import utils
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+# all caches created in this process, used to report their counters
+caches = {}
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Content hash of a file, memoized by path, size and mtime.
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        if memo_key in _file_hashes:
+            return _file_hashes[memo_key]
+
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _file_hashes_lock:
+        _file_hashes[memo_key] = digest
+    return digest
+
+
+def link_or_copy(src: str, dst: str):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class FileCache:
+    """
+    Content-addressed files in the storage directory, evicted in least recently used
+    order once the total size exceeds `max_size_mb`. A size of 0 disables the cache.
+    """
+
+    def __init__(self, name: str, max_size_mb: int = 0):
+        self.name = name
+        self.max_size = int(max_size_mb or 0) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @property
+    def cache_dir(self) -> str:
+        return utils.storage_dir(self.name, create=True)
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha1(
+            json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def path(self, key: str, ext: str = "mp4") -> str:
+        return os.path.join(self.cache_dir, f"{key}.{ext}")
+
+    def get(self, key: str, ext: str = "mp4") -> str:
+        if not self.enabled:
+            return ""
+
+        file_path = self.path(key, ext)
+        if os.path.isfile(file_path) and os.path.getsize(file_path) > 0:
+            try:
+                # mtime is the last access time used for eviction
+                os.utime(file_path)
+            except OSError:
+                pass
+            with self._lock:
+                self.hits += 1
+            return file_path
+
+        with self._lock:
+            self.misses += 1
+        return ""
+
+    def put(self, key: str, file_path: str, ext: str = "mp4") -> str:
+        if not self.enabled or not os.path.isfile(file_path):
+            return ""
+
+        cache_file = self.path(key, ext)
+        # thread idents repeat across the worker processes
+        temp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            link_or_copy(file_path, temp_file)
+            os.replace(temp_file, cache_file)
+        except OSError as e:
+            logger.warning(f"failed to add file to cache {self.name}: {str(e)}")
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+            return ""
+
+        self.evict()
+        return cache_file
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        if total_size <= self.max_size:
+            return
+
+        entries.sort()
+        for _, size, file_path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(file_path)
+                total_size -= size
+                logger.debug(f"evicted from cache {self.name}: {file_path}")
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        size = 0
+        entries = 0
+        if os.path.isdir(utils.storage_dir(self.name)):
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.endswith(".tmp"):
+                        size += entry.stat().st_size
+                        entries += 1
+
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_size,
+        }
+
+
+def get_stats() -> list:
+    return [cache.stats() for cache in caches.values()]
@@ -0,0 +1,152 @@
+"""
+Shared HTTP sessions for the material, LLM and TTS providers. Each host gets a keep-alive
+session with a sized connection pool, requests are retried on connection errors and on
+429/5xx responses with jittered exponential backoff, honouring Retry-After. A POST may
+have been run, and billed, before a 500 or 504, so it is only sent again after a 429 or
+a 503 with Retry-After.
+"""
+
+import inspect
+import threading
+from urllib.parse import urlparse
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.config import config
+
+# (connect, read) seconds, for the calls that do not pass their own
+default_timeout = (30, 120)
+retry_status = (429, 500, 502, 503, 504)
+idempotent_methods = frozenset(["DELETE", "GET", "HEAD", "OPTIONS", "PUT", "TRACE"])
+
+# urllib3 1.26 has no backoff jitter and a fixed maximum backoff of 120 seconds
+_retry_params = inspect.signature(Retry.__init__).parameters
+_backoff_options = {
+    name: value
+    for name, value in (("backoff_jitter", 1.0), ("backoff_max", 60))
+    if name in _retry_params
+}
+
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _count(host: str, counter: str):
+    with _lock:
+        stats = _stats.setdefault(host, {"requests": 0, "retries": 0, "errors": 0})
+        stats[counter] += 1
+
+
+class _Retry(Retry):
+    # the host of the session, counted for the retries of its redirects too
+    host = ""
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.host = self.host
+        return retry
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() not in idempotent_methods:
+            # the provider turned the request away without running it
+            if not (status_code == 429 or (status_code == 503 and has_retry_after)):
+                return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # raises once the retries are used up
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        _count(self.host, "retries")
+        reason = f"status {response.status}" if response is not None else str(error)
+        logger.warning(f"retrying {method} {self.host}{url or ''}: {reason}")
+        return retry
+
+
+def _create_session(host: str) -> requests.Session:
+    retries = config.app.get("http_retries", 3)
+    retry = _Retry(
+        total=retries,
+        connect=retries,
+        # the request may have been processed, a slow answer is not sent again
+        read=0,
+        status=retries,
+        status_forcelist=retry_status,
+        # the provider calls are POSTs, is_retry picks the statuses they are sent again on
+        allowed_methods=None,
+        backoff_factor=config.app.get("http_backoff_factor", 1.0),
+        respect_retry_after_header=True,
+        # the caller gets the last response and handles the status
+        raise_on_status=False,
+        **_backoff_options,
+    )
+    retry.host = host
+    pool_size = config.app.get("http_pool_size", 10)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    host = urlparse(url).netloc
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _create_session(host)
+        return session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", default_timeout)
+    host = urlparse(url).netloc
+    _count(host, "requests")
+    try:
+        return get_session(url).request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        _count(host, "errors")
+        raise
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def _connection_stats(session: requests.Session) -> dict:
+    opened, idle = 0, 0
+    for adapter in set(session.adapters.values()):
+        managers = [adapter.poolmanager, *adapter.proxy_manager.values()]
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                # the queue is filled with None for the connections not opened yet
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+    return {"connections": opened, "idle_connections": idle}
+
+
+def get_stats() -> list:
+    """
+    Requests, retries, errors and the connections opened per host.
+    """
+    with _lock:
+        hosts = sorted(_stats)
+        stats = {host: dict(_stats[host]) for host in hosts}
+        sessions = {host: _sessions.get(host) for host in hosts}
+    result = []
+    for host in hosts:
+        item = {"host": host, **stats[host], "connections": 0, "idle_connections": 0}
+        if sessions[host] is not None:
+            item.update(_connection_stats(sessions[host]))
+        result.append(item)
+    return result
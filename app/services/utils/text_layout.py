@@ -0,0 +1,167 @@
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+
+from PIL import Image, ImageDraw, ImageFont
+
+max_fonts = 16
+max_glyphs = 16384
+
+
+@lru_cache(maxsize=max_fonts)
+def get_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, font_size)
+
+
+@lru_cache(maxsize=max_glyphs)
+def get_glyph_advance(font_path: str, font_size: int, char: str) -> float:
+    return get_font(font_path, font_size).getlength(char)
+
+
+def get_text_size(font: ImageFont.FreeTypeFont, text: str):
+    left, top, right, bottom = font.getbbox(text.strip())
+    return right - left, bottom - top
+
+
+def get_label_layout(text: str, font_path: str, font_size: int, stroke_width: int = 0, spacing: int = 4):
+    """
+    Height of the image moviepy's TextClip draws `text` into, the bounding box of the
+    lines `spacing` pixels apart with the stroke, and the baseline of each line measured
+    from the top of that image.
+    """
+    font = get_font(font_path, font_size)
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    # with the anchor at the first baseline, top is the ascent of the first line
+    left, top, right, bottom = draw.multiline_textbbox(
+        (0, 0), text, font=font, spacing=spacing, stroke_width=stroke_width, anchor="ls"
+    )
+    # PIL puts every line the same distance below the previous one
+    line_height = (
+        draw.multiline_textbbox((0, 0), "A\nA", font=font, spacing=spacing, stroke_width=stroke_width, anchor="ls")[3]
+        - draw.textbbox((0, 0), "A", font=font, stroke_width=stroke_width, anchor="ls")[3]
+    )
+    baselines = [i * line_height - top for i in range(len(text.split("\n")))]
+    return int(bottom - top), baselines
+
+
+def _find_overflow(overflows, lo: int, hi: int, guess: int) -> int:
+    """
+    Returns the first index in [lo, hi) for which `overflows` is true, or hi if there
+    is none. The width of a line only grows as pieces are appended, so the predicate is
+    monotone and a search finds the same break as measuring every prefix. It gallops
+    out from the guess of the glyph advances, which is usually within a piece or two,
+    so only lines about as long as the answer are measured.
+    """
+    if lo >= hi:
+        return hi
+    guess = max(lo, min(guess, hi - 1))
+    step = 1
+    if overflows(guess):
+        # the answer is in (guess - step, guess]
+        while guess > lo:
+            below = max(lo, guess - step)
+            if not overflows(below):
+                lo = below + 1
+                break
+            guess = below
+            step *= 2
+        hi = guess
+    else:
+        # the answer is in (guess, guess + step]
+        while True:
+            above = guess + step
+            if above >= hi:
+                lo = guess + 1
+                break
+            if overflows(above):
+                lo, hi = guess + 1, above
+                break
+            guess = above
+            step *= 2
+
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if overflows(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class _Layout:
+    def __init__(self, font_path: str, font_size: int, max_width: float, pieces, separator: str):
+        self.font_path = font_path
+        self.font_size = font_size
+        self.font = get_font(font_path, font_size)
+        self.max_width = max_width
+        self.pieces = pieces
+        self.separator = separator
+        separator_advance = self.advance(separator)
+        self.offsets = [0.0] + list(
+            accumulate(self.advance(piece) + separator_advance for piece in pieces)
+        )
+
+    def advance(self, text: str) -> float:
+        return sum(get_glyph_advance(self.font_path, self.font_size, c) for c in text)
+
+    def find_break(self, start: int, first: int) -> int:
+        """
+        Returns the first piece from `first` on that makes the line starting at `start`
+        wider than max_width, or the number of pieces if the rest fits.
+        """
+
+        def overflows(end):
+            line = self.separator.join(self.pieces[start : end + 1])
+            return get_text_size(self.font, line)[0] > self.max_width
+
+        # the piece whose advance reaches past the line
+        guess = bisect_right(self.offsets, self.offsets[start] + self.max_width) - 1
+        return _find_overflow(overflows, first, len(self.pieces), guess)
+
+
+def wrap_text(text: str, max_width: float, font_path: str, font_size: int = 60):
+    """
+    Wraps `text` into lines of at most `max_width` pixels, by words or by characters for
+    scripts without spaces. Returns the wrapped text and its height.
+    """
+    font = get_font(font_path, font_size)
+    width, height = get_text_size(font, text)
+    if width <= max_width:
+        return text, height
+
+    # by words, a line breaks before the word that overflows it. The word that starts a
+    # line is only measured together with the next one, except on the first line, where
+    # a word too wide for a line of its own falls back to wrapping by characters
+    words = text.split(" ")
+    layout = _Layout(font_path, font_size, max_width, words, " ")
+    lines = []
+    processed = True
+    start = 0
+    first = 0
+    while True:
+        end = layout.find_break(start, first)
+        if end == len(words):
+            lines.append(" ".join(words[start:]).strip())
+            break
+        if " ".join(words[start : end + 1]).strip() == words[end].strip():
+            processed = False
+            break
+        lines.append(" ".join(words[start:end]).strip())
+        start, first = end, end + 1
+
+    if processed:
+        return "\n".join(lines).strip(), len(lines) * height
+
+    # by characters, a line ends with the character that overflows it
+    chars = list(text)
+    layout = _Layout(font_path, font_size, max_width, chars, "")
+    lines = []
+    start = 0
+    while True:
+        end = layout.find_break(start, start)
+        if end == len(chars):
+            lines.append("".join(chars[start:]))
+            break
+        lines.append("".join(chars[start : end + 1]))
+        start = end + 1
+    return "\n".join(lines).strip(), len(lines) * height
@@ -1,34 +1,43 @@
-import glob
 import itertools
 import os
-import random
 import gc
+import multiprocessing
 import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List
+import numpy as np
 from loguru import logger
 from moviepy import (
-    AudioFileClip,
     ColorClip,
-    CompositeAudioClip,
     CompositeVideoClip,
     ImageClip,
     TextClip,
+    VideoClip,
     VideoFileClip,
-    afx,
-    concatenate_videoclips,
 )
-from moviepy.video.tools.subtitles import SubtitlesClip
-from PIL import ImageFont
+from PIL import Image
 
+from app.config import config
 from app.models import const
 from app.models.schema import (
     MaterialInfo,
+    Timeline,
+    TimelineClip,
+    TimelineSubtitle,
     VideoAspect,
     VideoConcatMode,
     VideoParams,
     VideoTransitionMode,
 )
-from app.services.utils import video_effects
+from app.services import audio
+from app.services import encoder as video_encoders
+from app.services import probe
+from app.services import timeline as timeline_service
+from app.services.encoder import EncoderProfile
+from app.services.utils import ass, ffmpeg, file_cache, text_layout, video_effects
+from app.services.utils.compositing import IntervalCompositeVideoClip
 from app.utils import utils
 
 class SubClippedVideoClip:
@@ -48,16 +57,30 @@ class SubClippedVideoClip:
 
 
 audio_codec = "aac"
-video_codec = "h264_nvenc"  # GPU-accelerated NVIDIA NVENC encoder
-fps = 30
-
-# NVENC encoding parameters (FFmpeg 6.1 syntax)
-nvenc_params = [
-    "-preset", "p4",           # NVENC preset: p1 (fastest) to p7 (slowest/best quality)
-    "-b:v", "5M",              # Target bitrate: 5 Mbps
-    "-maxrate", "8M",          # Maximum bitrate: 8 Mbps
-    "-bufsize", "10M",         # Buffer size for rate control
-]
+fps = timeline_service.fps
+max_render_chunks = 8
+# how far a stream copy cut may move the in point to reach a keyframe, in seconds
+max_keyframe_shift = 0.5
+# longest side of the clips made from image materials
+max_image_size = 1920
+# shorter chunks do not pay off the process startup
+min_chunk_duration = 2
+
+# normalized clips shared across tasks and video_count variants
+clip_cache = file_cache.FileCache(
+    "cache_clips", config.app.get("clip_cache_size_mb", 10240)
+)
+# clips made from image materials
+image_cache = file_cache.FileCache(
+    "cache_images", config.app.get("image_cache_size_mb", 2048)
+)
+# rasterized subtitle lines
+subtitle_cache = file_cache.FileCache(
+    "cache_subtitles", config.app.get("subtitle_cache_size_mb", 512)
+)
+max_subtitle_sprites = 256
+_subtitle_sprites = OrderedDict()
+_subtitle_sprites_lock = threading.Lock()
 
 def close_clip(clip):
     if clip is None:
@@ -106,20 +129,213 @@ def delete_files(files: List[str] | str):
         except:
             pass
 
-def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
-    if not bgm_type:
-        return ""
+def get_clip_workers(clip_count: int) -> int:
+    """
+    Number of processes used to normalize clips, `video_clip_workers = 0` means one share
+    of the available cores per concurrent task.
+    """
+    workers = int(config.app.get("video_clip_workers", 0) or 0)
+    if workers <= 0:
+        max_concurrent_tasks = max(1, int(config.app.get("max_concurrent_tasks", 5)))
+        workers = (os.cpu_count() or 1) // max_concurrent_tasks
+    return max(1, min(workers, clip_count))
+
+
+def normalize_clip(
+    timeline_clip: TimelineClip,
+    clip_file: str,
+    video_width: int,
+    video_height: int,
+    encoder: EncoderProfile = None,
+) -> SubClippedVideoClip | None:
+    encoder = encoder or video_encoders.get_encoder()
+    transition = timeline_clip.transition
+    shuffle_side = timeline_clip.transition_side or "left"
+    try:
+        clip = VideoFileClip(timeline_clip.source, audio=False).subclipped(timeline_clip.start, timeline_clip.end)
+        clip_duration = clip.duration
+        # Not all videos are same size, so we need to resize them
+        clip_w, clip_h = clip.size
+        if clip_w != video_width or clip_h != video_height:
+            clip_ratio = clip.w / clip.h
+            video_ratio = video_width / video_height
+            logger.debug(f"resizing clip, source: {clip_w}x{clip_h}, ratio: {clip_ratio:.2f}, target: {video_width}x{video_height}, ratio: {video_ratio:.2f}")
+
+            if clip_ratio == video_ratio:
+                clip = clip.resized(new_size=(video_width, video_height))
+            else:
+                if clip_ratio > video_ratio:
+                    scale_factor = video_width / clip_w
+                else:
+                    scale_factor = video_height / clip_h
+
+                new_width = int(clip_w * scale_factor)
+                new_height = int(clip_h * scale_factor)
+
+                background = ColorClip(size=(video_width, video_height), color=(0, 0, 0)).with_duration(clip_duration)
+                clip_resized = clip.resized(new_size=(new_width, new_height)).with_position("center")
+                clip = CompositeVideoClip([background, clip_resized])
+
+        if transition == VideoTransitionMode.fade_in.value:
+            clip = video_effects.fadein_transition(clip, 1)
+        elif transition == VideoTransitionMode.fade_out.value:
+            clip = video_effects.fadeout_transition(clip, 1)
+        elif transition == VideoTransitionMode.slide_in.value:
+            clip = video_effects.slidein_transition(clip, 1, shuffle_side)
+        elif transition == VideoTransitionMode.slide_out.value:
+            clip = video_effects.slideout_transition(clip, 1, shuffle_side)
+
+        # wirte clip to temp file
+        clip.write_videofile(clip_file, audio=False, logger=None, fps=fps, codec=encoder.codec, ffmpeg_params=encoder.ffmpeg_params)
+        duration = clip.duration
+        close_clip(clip)
 
-    if bgm_file and os.path.exists(bgm_file):
-        return bgm_file
+        return SubClippedVideoClip(file_path=clip_file, duration=duration, width=clip_w, height=clip_h)
+    except Exception as e:
+        logger.error(f"failed to process clip: {str(e)}")
+        return None
 
-    if bgm_type == "random":
-        suffix = "*.mp3"
-        song_dir = utils.song_dir()
-        files = glob.glob(os.path.join(song_dir, suffix))
-        return random.choice(files)
 
-    return ""
+def _normalize_clip_job(job: tuple) -> SubClippedVideoClip | None:
+    return normalize_clip(*job)
+
+
+def normalize_clips(jobs: List[tuple], workers: int = 1) -> List[SubClippedVideoClip | None]:
+    """
+    Normalizes the clips described by `jobs`, results are returned in the order of `jobs`.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [_normalize_clip_job(job) for job in jobs]
+
+    # spawn instead of fork, tasks run in threads of the api server
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=mp_context) as executor:
+        return list(executor.map(_normalize_clip_job, jobs))
+
+
+def clip_cache_key(
+    timeline_clip: TimelineClip,
+    video_width: int,
+    video_height: int,
+    encoder: EncoderProfile = None,
+) -> str:
+    shuffle_side = timeline_clip.transition_side
+    if timeline_clip.transition not in (VideoTransitionMode.slide_in.value, VideoTransitionMode.slide_out.value):
+        shuffle_side = None
+    return file_cache.FileCache.make_key(
+        file_cache.file_hash(timeline_clip.source),
+        timeline_clip.start,
+        timeline_clip.end,
+        video_width,
+        video_height,
+        timeline_clip.transition,
+        shuffle_side,
+        encoder.key,
+        fps,
+    )
+
+
+def normalize_clips_cached(jobs: List[tuple], workers: int = 1) -> List[SubClippedVideoClip | None]:
+    """
+    Same as `normalize_clips`, but finished clips are looked up in and added to the clip cache.
+    """
+    results = [None] * len(jobs)
+    cache_keys = [None] * len(jobs)
+    missed = []
+    for i, job in enumerate(jobs):
+        timeline_clip, clip_file, video_width, video_height, encoder = job
+        if clip_cache.enabled:
+            try:
+                cache_keys[i] = clip_cache_key(timeline_clip, video_width, video_height, encoder)
+            except OSError as e:
+                logger.warning(f"failed to build clip cache key: {str(e)}")
+
+        cached_file = clip_cache.get(cache_keys[i]) if cache_keys[i] else ""
+        if cached_file:
+            logger.debug(f"clip cache hit: {timeline_clip}")
+            file_cache.link_or_copy(cached_file, clip_file)
+            results[i] = SubClippedVideoClip(
+                file_path=clip_file,
+                duration=timeline_clip.duration,
+                width=timeline_clip.width,
+                height=timeline_clip.height,
+            )
+        else:
+            missed.append(i)
+
+    normalized = normalize_clips([jobs[i] for i in missed], workers)
+    for i, processed_clip in zip(missed, normalized):
+        results[i] = processed_clip
+        if processed_clip and cache_keys[i]:
+            clip_cache.put(cache_keys[i], processed_clip.file_path)
+
+    return results
+
+
+def get_copy_start(
+    timeline_clip: TimelineClip,
+    video_width: int,
+    video_height: int,
+    encoder: EncoderProfile,
+) -> float | None:
+    """
+    Returns the keyframe near the in point where the clip can be cut with stream copy,
+    or None when it has to be normalized: it has a transition, the source does not match
+    the target format or there is no keyframe close enough.
+    """
+    if timeline_clip.transition not in (None, VideoTransitionMode.none.value):
+        return None
+
+    try:
+        info = ffmpeg.get_video_stream_info(timeline_clip.source)
+        if (
+            info["codec"] != encoder.codec_name
+            or info["size"] != (video_width, video_height)
+            or info["pix_fmt"] != "yuv420p"
+            or not info["fps"]
+            or abs(info["fps"] - fps) > 0.01
+        ):
+            return None
+
+        source_duration = info["duration"] or 0
+        keyframes = [
+            keyframe
+            for keyframe in ffmpeg.get_keyframes(timeline_clip.source)
+            if abs(keyframe - timeline_clip.start) <= max_keyframe_shift
+            and keyframe + timeline_clip.duration <= source_duration
+        ]
+    except Exception as e:
+        logger.warning(f"failed to probe clip for stream copy: {str(e)}")
+        return None
+
+    if not keyframes:
+        return None
+    return min(keyframes, key=lambda keyframe: abs(keyframe - timeline_clip.start))
+
+
+def cut_clip(timeline_clip: TimelineClip, clip_file: str, start: float) -> SubClippedVideoClip | None:
+    try:
+        frames = int(round(timeline_clip.duration * fps))
+        ffmpeg.cut_video(timeline_clip.source, clip_file, start, frames)
+        return SubClippedVideoClip(
+            file_path=clip_file,
+            duration=timeline_clip.duration,
+            width=timeline_clip.width,
+            height=timeline_clip.height,
+        )
+    except Exception as e:
+        logger.error(f"failed to cut clip: {str(e)}")
+        return None
+
+
+def _clip_identity(timeline_clip: TimelineClip) -> tuple:
+    return (
+        timeline_clip.source,
+        timeline_clip.start,
+        timeline_clip.end,
+        timeline_clip.transition,
+        timeline_clip.transition_side,
+    )
 
 
 def combine_videos(
@@ -131,243 +347,385 @@ def combine_videos(
     video_transition_mode: VideoTransitionMode = None,
     max_clip_duration: int = 5,
     threads: int = 2,
+    video_encoder: str = "",
+    timeline: Timeline = None,
 ) -> str:
-    audio_clip = AudioFileClip(audio_file)
-    audio_duration = audio_clip.duration
+    """
+    Renders the cut list of `timeline` into one video without audio. Without a timeline
+    the cut list is planned from the other arguments first.
+    """
+    if timeline is None:
+        video_width, video_height = VideoAspect(video_aspect).to_resolution()
+        audio_duration = timeline_service.get_audio_duration(audio_file)
+        timeline = Timeline(
+            width=video_width,
+            height=video_height,
+            fps=fps,
+            duration=audio_duration,
+            clips=timeline_service.plan_clips(
+                video_paths=video_paths,
+                audio_duration=audio_duration,
+                video_concat_mode=video_concat_mode,
+                video_transition_mode=video_transition_mode,
+                max_clip_duration=max_clip_duration,
+            ),
+        )
+
+    audio_duration = timeline.duration
+    video_width, video_height = timeline.width, timeline.height
     logger.info(f"audio duration: {audio_duration} seconds")
-    # Required duration of each clip
-    req_dur = audio_duration / len(video_paths)
-    req_dur = max_clip_duration
-    logger.info(f"maximum clip duration: {req_dur} seconds")
     output_dir = os.path.dirname(combined_video_path)
 
-    aspect = VideoAspect(video_aspect)
-    video_width, video_height = aspect.to_resolution()
+    encoder = video_encoders.get_encoder(video_encoder)
+    logger.info(f"video encoder: {encoder.codec}")
+
+    # a cut that appears several times in the timeline is rendered once
+    jobs = {}
+    for timeline_clip in timeline.clips:
+        identity = _clip_identity(timeline_clip)
+        if identity not in jobs:
+            jobs[identity] = (
+                timeline_clip,
+                f"{output_dir}/temp-clip-{len(jobs) + 1}.mp4",
+                video_width,
+                video_height,
+                encoder,
+            )
+    logger.debug(f"total timeline clips: {len(timeline.clips)}, distinct: {len(jobs)}")
+
+    # clips that already match the target format are cut with stream copy
+    rendered = {}
+    normalize_jobs = {}
+    for identity, job in jobs.items():
+        copy_start = get_copy_start(job[0], video_width, video_height, encoder)
+        if copy_start is not None:
+            processed_clip = cut_clip(job[0], job[1], copy_start)
+            if processed_clip:
+                rendered[identity] = processed_clip
+                continue
+        normalize_jobs[identity] = job
+    copied = list(rendered)
+    if copied:
+        logger.info(f"cut {len(copied)} clips with stream copy")
+
+    workers = get_clip_workers(len(normalize_jobs))
+    logger.info(f"normalizing {len(normalize_jobs)} clips with {workers} worker(s)")
+    rendered.update(
+        zip(normalize_jobs.keys(), normalize_clips_cached(list(normalize_jobs.values()), workers))
+    )
+
+    # the encoder writes its own SPS, PPS and time base, a copied clip that does not
+    # share them with the encoded clips is normalized too
+    encoded = [rendered[identity] for identity in normalize_jobs if rendered[identity]]
+    if copied and encoded:
+        mismatched = {
+            identity: jobs[identity]
+            for identity in copied
+            if not ffmpeg.can_join_with_copy([encoded[0].file_path, rendered[identity].file_path])
+        }
+        if mismatched:
+            logger.info(f"normalizing {len(mismatched)} copied clips that differ from the encoded clips")
+            rendered.update(
+                zip(mismatched.keys(), normalize_clips_cached(list(mismatched.values()), workers))
+            )
 
     processed_clips = []
-    subclipped_items = []
     video_duration = 0
-    for video_path in video_paths:
-        clip = VideoFileClip(video_path)
-        clip_duration = clip.duration
-        clip_w, clip_h = clip.size
-        close_clip(clip)
-        
-        start_time = 0
-
-        while start_time < clip_duration:
-            end_time = min(start_time + max_clip_duration, clip_duration)            
-            if clip_duration - start_time >= max_clip_duration:
-                subclipped_items.append(SubClippedVideoClip(file_path= video_path, start_time=start_time, end_time=end_time, width=clip_w, height=clip_h))
-            start_time = end_time    
-            if video_concat_mode.value == VideoConcatMode.sequential.value:
-                break
-
-    # random subclipped_items order
-    if video_concat_mode.value == VideoConcatMode.random.value:
-        random.shuffle(subclipped_items)
-        
-    logger.debug(f"total subclipped items: {len(subclipped_items)}")
-    
-    # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
-    for i, subclipped_item in enumerate(subclipped_items):
-        if video_duration > audio_duration:
-            break
-        
-        logger.debug(f"processing clip {i+1}: {subclipped_item.width}x{subclipped_item.height}, current duration: {video_duration:.2f}s, remaining: {audio_duration - video_duration:.2f}s")
-        
-        try:
-            clip = VideoFileClip(subclipped_item.file_path).subclipped(subclipped_item.start_time, subclipped_item.end_time)
-            clip_duration = clip.duration
-            # Not all videos are same size, so we need to resize them
-            clip_w, clip_h = clip.size
-            if clip_w != video_width or clip_h != video_height:
-                clip_ratio = clip.w / clip.h
-                video_ratio = video_width / video_height
-                logger.debug(f"resizing clip, source: {clip_w}x{clip_h}, ratio: {clip_ratio:.2f}, target: {video_width}x{video_height}, ratio: {video_ratio:.2f}")
-                
-                if clip_ratio == video_ratio:
-                    clip = clip.resized(new_size=(video_width, video_height))
-                else:
-                    if clip_ratio > video_ratio:
-                        scale_factor = video_width / clip_w
-                    else:
-                        scale_factor = video_height / clip_h
-
-                    new_width = int(clip_w * scale_factor)
-                    new_height = int(clip_h * scale_factor)
-
-                    background = ColorClip(size=(video_width, video_height), color=(0, 0, 0)).with_duration(clip_duration)
-                    clip_resized = clip.resized(new_size=(new_width, new_height)).with_position("center")
-                    clip = CompositeVideoClip([background, clip_resized])
-                    
-            shuffle_side = random.choice(["left", "right", "top", "bottom"])
-            if video_transition_mode.value == VideoTransitionMode.none.value:
-                clip = clip
-            elif video_transition_mode.value == VideoTransitionMode.fade_in.value:
-                clip = video_effects.fadein_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-                clip = video_effects.fadeout_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.slide_in.value:
-                clip = video_effects.slidein_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.slide_out.value:
-                clip = video_effects.slideout_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.shuffle.value:
-                transition_funcs = [
-                    lambda c: video_effects.fadein_transition(c, 1),
-                    lambda c: video_effects.fadeout_transition(c, 1),
-                    lambda c: video_effects.slidein_transition(c, 1, shuffle_side),
-                    lambda c: video_effects.slideout_transition(c, 1, shuffle_side),
-                ]
-                shuffle_transition = random.choice(transition_funcs)
-                clip = shuffle_transition(clip)
-
-            if clip.duration > max_clip_duration:
-                clip = clip.subclipped(0, max_clip_duration)
-                
-            # wirte clip to temp file
-            clip_file = f"{output_dir}/temp-clip-{i+1}.mp4"
-            clip.write_videofile(clip_file, logger=None, fps=fps, codec=video_codec, ffmpeg_params=nvenc_params)
-            
-            close_clip(clip)
-        
-            processed_clips.append(SubClippedVideoClip(file_path=clip_file, duration=clip.duration, width=clip_w, height=clip_h))
-            video_duration += clip.duration
-            
-        except Exception as e:
-            logger.error(f"failed to process clip: {str(e)}")
-    
-    # loop processed clips until the video duration matches or exceeds the audio duration.
-    if video_duration < audio_duration:
+    for timeline_clip in timeline.clips:
+        processed_clip = rendered[_clip_identity(timeline_clip)]
+        if processed_clip:
+            processed_clips.append(processed_clip)
+            video_duration += processed_clip.duration
+
+    # clips that failed to render leave a gap, loop the others to cover the audio
+    if processed_clips and audio_duration - video_duration >= 1 / fps:
         logger.warning(f"video duration ({video_duration:.2f}s) is shorter than audio duration ({audio_duration:.2f}s), looping clips to match audio length.")
         base_clips = processed_clips.copy()
         for clip in itertools.cycle(base_clips):
-            if video_duration >= audio_duration:
+            if audio_duration - video_duration < 1 / fps:
                 break
             processed_clips.append(clip)
             video_duration += clip.duration
         logger.info(f"video duration: {video_duration:.2f}s, audio duration: {audio_duration:.2f}s, looped {len(processed_clips)-len(base_clips)} clips")
-     
-    # merge video clips progressively, avoid loading all videos at once to avoid memory overflow
+
+    # merge all clips in a single linear pass, looped clips are simply listed again
     logger.info("starting clip merging process")
     if not processed_clips:
         logger.warning("no clips available for merging")
         return combined_video_path
-    
+
+    clip_files = [clip.file_path for clip in processed_clips]
+
     # if there is only one clip, use it directly
     if len(processed_clips) == 1:
         logger.info("using single clip directly")
-        shutil.copy(processed_clips[0].file_path, combined_video_path)
-        delete_files(processed_clips)
+        shutil.copy(clip_files[0], combined_video_path)
+        delete_files(clip_files)
         logger.info("video combining completed")
         return combined_video_path
-    
-    # create initial video file as base
-    base_clip_path = processed_clips[0].file_path
-    temp_merged_video = f"{output_dir}/temp-merged-video.mp4"
-    temp_merged_next = f"{output_dir}/temp-merged-next.mp4"
-    
-    # copy first clip as initial merged video
-    shutil.copy(base_clip_path, temp_merged_video)
-    
-    # merge remaining video clips one by one
-    for i, clip in enumerate(processed_clips[1:], 1):
-        logger.info(f"merging clip {i}/{len(processed_clips)-1}, duration: {clip.duration:.2f}s")
-        
-        try:
-            # load current base video and next clip to merge
-            base_clip = VideoFileClip(temp_merged_video)
-            next_clip = VideoFileClip(clip.file_path)
-            
-            # merge these two clips
-            merged_clip = concatenate_videoclips([base_clip, next_clip])
-
-            # save merged result to temp file
-            merged_clip.write_videofile(
-                filename=temp_merged_next,
-                threads=threads,
-                logger=None,
-                temp_audiofile_path=output_dir,
-                audio_codec=audio_codec,
-                codec=video_codec,
-                fps=fps,
-                ffmpeg_params=nvenc_params,
-            )
-            close_clip(base_clip)
-            close_clip(next_clip)
-            close_clip(merged_clip)
-            
-            # replace base file with new merged file
-            delete_files(temp_merged_video)
-            os.rename(temp_merged_next, temp_merged_video)
-            
-        except Exception as e:
-            logger.error(f"failed to merge clip: {str(e)}")
-            continue
-    
-    # after merging, rename final result to target file name
-    os.rename(temp_merged_video, combined_video_path)
-    
+
+    try:
+        ffmpeg.concat_videos(
+            video_files=clip_files,
+            output_file=combined_video_path,
+            size=(video_width, video_height),
+            fps=fps,
+            encoder=encoder,
+            threads=threads,
+        )
+    except Exception as e:
+        logger.error(f"failed to merge clips: {str(e)}")
+
     # clean temp files
-    clip_files = [clip.file_path for clip in processed_clips]
-    delete_files(clip_files)
-            
-    logger.info("video combining completed")
+    delete_files(list(set(clip_files)))
+
+    logger.info(f"video combining completed, clip cache: {clip_cache.stats()}")
     return combined_video_path
 
 
 def wrap_text(text, max_width, font="Arial", fontsize=60):
-    # Create ImageFont
-    font = ImageFont.truetype(font, fontsize)
-
-    def get_text_size(inner_text):
-        inner_text = inner_text.strip()
-        left, top, right, bottom = font.getbbox(inner_text)
-        return right - left, bottom - top
-
-    width, height = get_text_size(text)
-    if width <= max_width:
-        return text, height
-
-    processed = True
-
-    _wrapped_lines_ = []
-    words = text.split(" ")
-    _txt_ = ""
-    for word in words:
-        _before = _txt_
-        _txt_ += f"{word} "
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            if _txt_.strip() == word.strip():
-                processed = False
-                break
-            _wrapped_lines_.append(_before)
-            _txt_ = f"{word} "
-    _wrapped_lines_.append(_txt_)
-    if processed:
-        _wrapped_lines_ = [line.strip() for line in _wrapped_lines_]
-        result = "\n".join(_wrapped_lines_).strip()
-        height = len(_wrapped_lines_) * height
-        return result, height
-
-    _wrapped_lines_ = []
-    chars = list(text)
-    _txt_ = ""
-    for word in chars:
-        _txt_ += word
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            _wrapped_lines_.append(_txt_)
-            _txt_ = ""
-    _wrapped_lines_.append(_txt_)
-    result = "\n".join(_wrapped_lines_).strip()
-    height = len(_wrapped_lines_) * height
-    return result, height
+    return text_layout.wrap_text(text, max_width, font, fontsize)
+
+
+def _render_subtitle_sprite(text: str, params: VideoParams, font_path: str, max_width: float) -> np.ndarray:
+    wrapped_txt, txt_height = wrap_text(
+        text, max_width=max_width, font=font_path, fontsize=int(params.font_size)
+    )
+    text_clip = TextClip(
+        text=wrapped_txt,
+        font=font_path,
+        font_size=int(params.font_size),
+        color=params.text_fore_color,
+        bg_color=params.text_background_color,
+        stroke_color=params.stroke_color,
+        stroke_width=int(params.stroke_width),
+    )
+    rgb = text_clip.get_frame(0)
+    if text_clip.mask is not None:
+        alpha = (text_clip.mask.get_frame(0) * 255).round()
+    else:
+        alpha = np.full(rgb.shape[:2], 255)
+    return np.dstack([rgb, alpha]).astype("uint8")
+
+
+def get_subtitle_sprite(text: str, params: VideoParams, font_path: str, max_width: float) -> np.ndarray:
+    """
+    Returns the subtitle line rasterized into an RGBA image. Sprites are memoized in the
+    process and on disk, so every line is rendered once across video_count variants,
+    render chunks and repeated renders.
+    """
+    key = file_cache.FileCache.make_key(
+        text,
+        file_cache.file_hash(font_path) if os.path.isfile(font_path) else font_path,
+        int(params.font_size),
+        params.text_fore_color,
+        params.text_background_color,
+        params.stroke_color,
+        int(params.stroke_width),
+        int(max_width),
+    )
+    with _subtitle_sprites_lock:
+        sprite = _subtitle_sprites.get(key)
+        if sprite is not None:
+            _subtitle_sprites.move_to_end(key)
+            return sprite
+
+    cached_file = subtitle_cache.get(key, "png")
+    if cached_file:
+        try:
+            with Image.open(cached_file) as image:
+                sprite = np.array(image.convert("RGBA"))
+        except Exception as e:
+            logger.warning(f"failed to read cached subtitle: {str(e)}")
+
+    if sprite is None:
+        sprite = _render_subtitle_sprite(text, params, font_path, max_width)
+        if subtitle_cache.enabled:
+            # named like the FileCache temp files, which eviction skips
+            temp_file = f"{subtitle_cache.path(key, 'png')}.{os.getpid()}.{threading.get_ident()}.sprite.tmp"
+            try:
+                Image.fromarray(sprite, "RGBA").save(temp_file, "PNG")
+                subtitle_cache.put(key, temp_file, "png")
+            finally:
+                delete_files(temp_file)
+
+    with _subtitle_sprites_lock:
+        _subtitle_sprites[key] = sprite
+        while len(_subtitle_sprites) > max_subtitle_sprites:
+            _subtitle_sprites.popitem(last=False)
+    return sprite
+
+
+def create_text_clip(
+    subtitle_item: TimelineSubtitle,
+    params: VideoParams,
+    font_path: str,
+    video_width: int,
+    video_height: int,
+):
+    params.font_size = int(params.font_size)
+    params.stroke_width = int(params.stroke_width)
+    sprite = get_subtitle_sprite(subtitle_item.text, params, font_path, video_width * 0.9)
+    _clip = ImageClip(sprite, transparent=True)
+    duration = subtitle_item.end - subtitle_item.start
+    _clip = _clip.with_start(subtitle_item.start)
+    _clip = _clip.with_end(subtitle_item.end)
+    _clip = _clip.with_duration(duration)
+    if params.subtitle_position == "bottom":
+        _clip = _clip.with_position(("center", video_height * 0.95 - _clip.h))
+    elif params.subtitle_position == "top":
+        _clip = _clip.with_position(("center", video_height * 0.05))
+    elif params.subtitle_position == "custom":
+        # Ensure the subtitle is fully within the screen bounds
+        margin = 10  # Additional margin, in pixels
+        max_y = video_height - _clip.h - margin
+        min_y = margin
+        custom_y = (video_height - _clip.h) * (params.custom_position / 100)
+        custom_y = max(
+            min_y, min(custom_y, max_y)
+        )  # Constrain the y value within the valid range
+        _clip = _clip.with_position(("center", custom_y))
+    else:  # center
+        _clip = _clip.with_position(("center", "center"))
+    return _clip
+
+
+def compose_overlays(video_clip, overlay_clips: list):
+    """
+    Composites the overlays on the video, the video is the opaque background so no mask
+    is computed, and only the overlays playing at each frame are blitted.
+    """
+    return IntervalCompositeVideoClip(
+        [video_clip, *overlay_clips], use_bgclip=True
+    ).with_duration(video_clip.duration)
+
+
+def get_render_chunks(duration: float) -> int:
+    """
+    Number of time ranges the final video is split into and rendered in parallel,
+    `video_render_chunks = 0` uses as many chunks as clip workers.
+    """
+    chunks = int(config.app.get("video_render_chunks", 0) or 0)
+    if chunks <= 0:
+        chunks = get_clip_workers(max_render_chunks)
+    return max(1, min(chunks, max_render_chunks, int(duration // min_chunk_duration)))
+
+
+def get_chunk_ranges(duration: float, chunks: int) -> List[tuple]:
+    """
+    Splits the video into time ranges on frame boundaries. Every chunk is encoded on its
+    own and starts with a keyframe, so the chunks are joined with stream copy.
+    """
+    total_frames = int(round(duration * fps))
+    boundaries = [round(i * total_frames / chunks) for i in range(chunks + 1)]
+    return [(boundaries[i] / fps, boundaries[i + 1] / fps) for i in range(chunks)]
+
+
+def get_chunk_subtitles(subtitles: List[TimelineSubtitle], start: float, end: float) -> List[TimelineSubtitle]:
+    """
+    The subtitles shown between `start` and `end`, cut to the range and timed from its start.
+    """
+    return [
+        item.model_copy(
+            update={"start": max(item.start, start) - start, "end": min(item.end, end) - start}
+        )
+        for item in subtitles
+        if item.end > start and item.start < end
+    ]
+
+
+def render_chunk(
+    video_path: str,
+    output_file: str,
+    start: float,
+    end: float,
+    subtitles: List[TimelineSubtitle],
+    params: VideoParams,
+    font_path: str,
+    video_width: int,
+    video_height: int,
+    encoder: EncoderProfile,
+) -> str:
+    """
+    Renders the range of the video from `start` to `end` with `subtitles`, which are timed
+    from `start`.
+    """
+    video_clip = VideoFileClip(video_path, audio=False).subclipped(start, end)
+
+    text_clips = [
+        create_text_clip(item, params, font_path, video_width, video_height) for item in subtitles
+    ]
+    if text_clips:
+        video_clip = compose_overlays(video_clip, text_clips)
+
+    video_clip.write_videofile(
+        output_file,
+        audio=False,
+        codec=encoder.codec,
+        threads=1,
+        logger=None,
+        fps=fps,
+        ffmpeg_params=encoder.ffmpeg_params,
+    )
+    close_clip(video_clip)
+    return output_file
+
+
+def _render_chunk_job(job: tuple) -> str:
+    return render_chunk(*job)
+
+
+def render_chunks(
+    video_path: str,
+    video_file: str,
+    subtitles: List[TimelineSubtitle],
+    params: VideoParams,
+    font_path: str,
+    video_width: int,
+    video_height: int,
+    encoder: EncoderProfile,
+    duration: float,
+    chunks: int,
+) -> str:
+    """
+    Renders the time ranges of the final video in separate processes with the subtitles
+    that fall in each range and joins them with stream copy into `video_file`.
+    """
+    base_name = os.path.splitext(video_file)[0]
+    jobs = [
+        (
+            video_path,
+            f"{base_name}-chunk-{i + 1}.mp4",
+            start,
+            end,
+            get_chunk_subtitles(subtitles, start, end),
+            params,
+            font_path,
+            video_width,
+            video_height,
+            encoder,
+        )
+        for i, (start, end) in enumerate(get_chunk_ranges(duration, chunks))
+    ]
+    logger.info(f"rendering video in {len(jobs)} chunks")
+
+    chunk_files = [job[1] for job in jobs]
+    try:
+        mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=len(jobs), mp_context=mp_context) as executor:
+            chunk_files = list(executor.map(_render_chunk_job, jobs))
+
+        ffmpeg.concat_videos(
+            video_files=chunk_files,
+            output_file=video_file,
+            size=(video_width, video_height),
+            fps=fps,
+            encoder=encoder,
+            threads=params.n_threads or 2,
+        )
+    finally:
+        delete_files(chunk_files)
+    return video_file
 
 
 def generate_video(
@@ -376,9 +734,23 @@ def generate_video(
     subtitle_path: str,
     output_file: str,
     params: VideoParams,
+    timeline: Timeline = None,
 ):
+    """
+    Adds the subtitle events and audio tracks of `timeline` to the combined video.
+    Without a timeline they are read from `subtitle_path` and `audio_path` first.
+    """
     aspect = VideoAspect(params.video_aspect)
     video_width, video_height = aspect.to_resolution()
+    if timeline is None:
+        timeline = Timeline(
+            width=video_width,
+            height=video_height,
+            fps=fps,
+            subtitle_path=subtitle_path or "",
+            subtitles=timeline_service.get_subtitles(subtitle_path),
+            audio_tracks=timeline_service.get_audio_tracks(audio_path, params),
+        )
 
     logger.info(f"generating video: {video_width} x {video_height}")
     logger.info(f"  ① video: {video_path}")
@@ -388,8 +760,7 @@ def generate_video(
 
     # https://github.com/harry0703/MoneyPrinterTurbo/issues/217
     # PermissionError: [WinError 32] The process cannot access the file because it is being used by another process: 'final-1.mp4.tempTEMP_MPY_wvf_snd.mp3'
-    # write into the same directory as the output file
-    output_dir = os.path.dirname(output_file)
+    # temp files are written into the same directory as the output file
 
     font_path = ""
     if params.subtitle_enabled:
@@ -401,143 +772,210 @@ def generate_video(
 
         logger.info(f"  ⑤ font: {font_path}")
 
-    def create_text_clip(subtitle_item):
-        params.font_size = int(params.font_size)
-        params.stroke_width = int(params.stroke_width)
-        phrase = subtitle_item[1]
-        max_width = video_width * 0.9
-        wrapped_txt, txt_height = wrap_text(
-            phrase, max_width=max_width, font=font_path, fontsize=params.font_size
-        )
-        interline = int(params.font_size * 0.25)
-        size=(int(max_width), int(txt_height + params.font_size * 0.25 + (interline * (wrapped_txt.count("\n") + 1))))
-
-        _clip = TextClip(
-            text=wrapped_txt,
-            font=font_path,
-            font_size=params.font_size,
-            color=params.text_fore_color,
-            bg_color=params.text_background_color,
-            stroke_color=params.stroke_color,
-            stroke_width=params.stroke_width,
-            # interline=interline,
-            # size=size,
-        )
-        duration = subtitle_item[0][1] - subtitle_item[0][0]
-        _clip = _clip.with_start(subtitle_item[0][0])
-        _clip = _clip.with_end(subtitle_item[0][1])
-        _clip = _clip.with_duration(duration)
-        if params.subtitle_position == "bottom":
-            _clip = _clip.with_position(("center", video_height * 0.95 - _clip.h))
-        elif params.subtitle_position == "top":
-            _clip = _clip.with_position(("center", video_height * 0.05))
-        elif params.subtitle_position == "custom":
-            # Ensure the subtitle is fully within the screen bounds
-            margin = 10  # Additional margin, in pixels
-            max_y = video_height - _clip.h - margin
-            min_y = margin
-            custom_y = (video_height - _clip.h) * (params.custom_position / 100)
-            custom_y = max(
-                min_y, min(custom_y, max_y)
-            )  # Constrain the y value within the valid range
-            _clip = _clip.with_position(("center", custom_y))
-        else:  # center
-            _clip = _clip.with_position(("center", "center"))
-        return _clip
-
-    video_clip = VideoFileClip(video_path).without_audio()
-    audio_clip = AudioFileClip(audio_path).with_effects(
-        [afx.MultiplyVolume(params.voice_volume)]
-    )
+    video_clip = VideoFileClip(video_path, audio=False)
+
+    # the video is rendered without audio, the audio track is written once in the
+    # meantime and both are muxed with stream copy
+    base_name = os.path.splitext(output_file)[0]
+    audio_file = f"{base_name}-audio.m4a"
+    video_file = f"{base_name}-video.mp4"
+    ass_file = ""
+    encoder = video_encoders.get_encoder(params.video_encoder)
+    chunks = get_render_chunks(video_clip.duration)
+    subtitle_renderer = (
+        params.subtitle_renderer or config.app.get("subtitle_renderer", "moviepy")
+    ).strip().lower()
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            audio_future = executor.submit(
+                audio.mix_audio, timeline, video_clip.duration, audio_file
+            )
 
-    def make_textclip(text):
-        return TextClip(
-            text=text,
-            font=font_path,
-            font_size=params.font_size,
+            if timeline.subtitles and subtitle_renderer == "libass":
+                # the subtitles are drawn by ffmpeg while encoding, outside the python frame loop
+                close_clip(video_clip)
+                ass_file = f"{base_name}.ass"
+                ass.create_ass_file(timeline.subtitles, params, video_width, video_height, ass_file)
+                ffmpeg.burn_subtitles(
+                    video_file=video_path,
+                    subtitle_file=ass_file,
+                    output_file=video_file,
+                    encoder=encoder,
+                    fonts_dir=utils.font_dir(),
+                    threads=params.n_threads or 2,
+                )
+            elif chunks > 1:
+                duration = video_clip.duration
+                close_clip(video_clip)
+                # rasterize the subtitles once, the chunk processes read them from the cache
+                for item in timeline.subtitles:
+                    get_subtitle_sprite(item.text, params, font_path, video_width * 0.9)
+                render_chunks(
+                    video_path=video_path,
+                    video_file=video_file,
+                    subtitles=timeline.subtitles,
+                    params=params,
+                    font_path=font_path,
+                    video_width=video_width,
+                    video_height=video_height,
+                    encoder=encoder,
+                    duration=duration,
+                    chunks=chunks,
+                )
+            else:
+                if timeline.subtitles:
+                    text_clips = []
+                    for item in timeline.subtitles:
+                        clip = create_text_clip(item, params, font_path, video_width, video_height)
+                        text_clips.append(clip)
+                    video_clip = compose_overlays(video_clip, text_clips)
+
+                video_clip.write_videofile(
+                    video_file,
+                    audio=False,
+                    codec=encoder.codec,
+                    threads=params.n_threads or 2,
+                    logger=None,
+                    fps=fps,
+                    ffmpeg_params=encoder.ffmpeg_params,
+                )
+                close_clip(video_clip)
+
+            audio_future.result()
+
+        ffmpeg.mux_audio(video_file, audio_file, output_file)
+    finally:
+        delete_files([audio_file, video_file, ass_file])
+
+
+def get_zoom_boxes(width: int, height: int, duration: float) -> np.ndarray:
+    """
+    The crop rectangle (left, top, right, bottom) of every frame of the zoom effect of
+    image materials: a centered crop that shrinks from the whole image to 1 / zoom of it,
+    the zoom grows by 3% per second of the clip.
+    """
+    frames = max(1, int(round(duration * fps)))
+    t = np.arange(frames) / fps
+    zoom = 1 + (duration * 0.03) * (t / duration)
+    crop_w = width / zoom
+    crop_h = height / zoom
+    left = (width - crop_w) / 2
+    top = (height - crop_h) / 2
+    return np.stack([left, top, left + crop_w, top + crop_h], axis=1)
+
+
+def image_to_video(image_file: str, video_file: str, duration: float, encoder: EncoderProfile = None) -> str:
+    """
+    Renders an image as a clip zooming into its center. The image is decoded once, at a
+    reduced size where the format allows it, and every frame is a crop of it scaled to
+    the output size.
+    """
+    encoder = encoder or video_encoders.get_encoder()
+    with Image.open(image_file) as img:
+        scale = min(1.0, max_image_size / max(img.size))
+        # even sizes, yuv420p needs them
+        width = max(2, int(img.width * scale) // 2 * 2)
+        height = max(2, int(img.height * scale) // 2 * 2)
+        # lets jpeg decode at 1/2, 1/4 or 1/8 of the size, as long as it is still larger
+        img.draft("RGB", (width, height))
+        image = img.convert("RGB")
+    if image.size != (width, height):
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+    boxes = get_zoom_boxes(width, height, duration)
+
+    def make_frame(t):
+        box = boxes[min(int(round(t * fps)), len(boxes) - 1)]
+        return np.asarray(
+            image.resize((width, height), Image.Resampling.BILINEAR, box=tuple(box))
         )
 
-    if subtitle_path and os.path.exists(subtitle_path):
-        sub = SubtitlesClip(
-            subtitles=subtitle_path, encoding="utf-8", make_textclip=make_textclip
-        )
-        text_clips = []
-        for item in sub.subtitles:
-            clip = create_text_clip(subtitle_item=item)
-            text_clips.append(clip)
-        video_clip = CompositeVideoClip([video_clip, *text_clips])
-
-    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
-    if bgm_file:
-        try:
-            bgm_clip = AudioFileClip(bgm_file).with_effects(
-                [
-                    afx.MultiplyVolume(params.bgm_volume),
-                    afx.AudioFadeOut(3),
-                    afx.AudioLoop(duration=video_clip.duration),
-                ]
-            )
-            audio_clip = CompositeAudioClip([audio_clip, bgm_clip])
-        except Exception as e:
-            logger.error(f"failed to add bgm: {str(e)}")
+    clip = VideoClip(make_frame, duration=duration)
+    clip.write_videofile(video_file, fps=fps, logger=None, codec=encoder.codec, ffmpeg_params=encoder.ffmpeg_params)
+    close_clip(clip)
+    return video_file
 
-    video_clip = video_clip.with_audio(audio_clip)
-    video_clip.write_videofile(
-        output_file,
-        audio_codec=audio_codec,
-        codec=video_codec,
-        temp_audiofile_path=output_dir,
-        threads=params.n_threads or 2,
-        logger=None,
-        fps=fps,
-        ffmpeg_params=nvenc_params,
+
+def _image_to_video_job(job: tuple) -> str:
+    return image_to_video(*job)
+
+
+def image_cache_key(image_file: str, duration: float, encoder: EncoderProfile) -> str:
+    # the clip keeps the aspect of the image, the video aspect is applied when it is normalized
+    return file_cache.FileCache.make_key(
+        file_cache.file_hash(image_file), duration, max_image_size, fps, encoder.key
     )
-    video_clip.close()
-    del video_clip
 
 
-def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
+def images_to_videos(jobs: List[tuple], workers: int = 1) -> List[str]:
+    """
+    Converts the images of `jobs`, converted clips are looked up in and added to the
+    image cache, so an image is only encoded once for the same clip duration and encoder.
+    """
+    results = [""] * len(jobs)
+    cache_keys = [None] * len(jobs)
+    missed = []
+    for i, job in enumerate(jobs):
+        image_file, video_file, duration, encoder = job
+        if image_cache.enabled:
+            try:
+                cache_keys[i] = image_cache_key(image_file, duration, encoder)
+            except OSError as e:
+                logger.warning(f"failed to build image cache key: {str(e)}")
+
+        cached_file = image_cache.get(cache_keys[i]) if cache_keys[i] else ""
+        if cached_file:
+            logger.debug(f"image cache hit: {image_file}")
+            file_cache.link_or_copy(cached_file, video_file)
+            results[i] = video_file
+        else:
+            missed.append(i)
+
+    missed_jobs = [jobs[i] for i in missed]
+    if workers <= 1 or len(missed_jobs) <= 1:
+        video_files = [_image_to_video_job(job) for job in missed_jobs]
+    else:
+        # spawn instead of fork, tasks run in threads of the api server
+        mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(missed_jobs)), mp_context=mp_context) as executor:
+            video_files = list(executor.map(_image_to_video_job, missed_jobs))
+
+    for i, video_file in zip(missed, video_files):
+        results[i] = video_file
+        if cache_keys[i]:
+            image_cache.put(cache_keys[i], video_file)
+    return results
+
+
+def preprocess_video(materials: List[MaterialInfo], clip_duration=4, video_encoder: str = ""):
+    encoder = video_encoders.get_encoder(video_encoder)
+    jobs = []
+    images = []
     for material in materials:
         if not material.url:
             continue
 
         ext = utils.parse_extension(material.url)
-        try:
-            clip = VideoFileClip(material.url)
-        except Exception:
-            clip = ImageClip(material.url)
+        if ext in const.FILE_TYPE_IMAGES:
+            with Image.open(material.url) as img:
+                width, height = img.size
+        else:
+            width, height = probe.probe(material.url).size
 
-        width = clip.size[0]
-        height = clip.size[1]
         if width < 480 or height < 480:
             logger.warning(f"low resolution material: {width}x{height}, minimum 480x480 required")
             continue
 
         if ext in const.FILE_TYPE_IMAGES:
             logger.info(f"processing image: {material.url}")
-            # Create an image clip and set its duration to 3 seconds
-            clip = (
-                ImageClip(material.url)
-                .with_duration(clip_duration)
-                .with_position("center")
-            )
-            # Apply a zoom effect using the resize method.
-            # A lambda function is used to make the zoom effect dynamic over time.
-            # The zoom effect starts from the original size and gradually scales up to 120%.
-            # t represents the current time, and clip.duration is the total duration of the clip (3 seconds).
-            # Note: 1 represents 100% size, so 1.2 represents 120% size.
-            zoom_clip = clip.resized(
-                lambda t: 1 + (clip_duration * 0.03) * (t / clip.duration)
-            )
+            jobs.append((material.url, f"{material.url}.mp4", clip_duration, encoder))
+            images.append(material)
+
+    if not jobs:
+        return materials
 
-            # Optionally, create a composite video clip containing the zoomed clip.
-            # This is useful when you want to add other elements to the video.
-            final_clip = CompositeVideoClip([zoom_clip])
-
-            # Output the video to a file.
-            video_file = f"{material.url}.mp4"
-            final_clip.write_videofile(video_file, fps=30, logger=None, codec=video_codec, ffmpeg_params=nvenc_params)
-            close_clip(clip)
-            material.url = video_file
-            logger.success(f"image processed: {video_file}")
-    return materials
\ No newline at end of file
+    video_files = images_to_videos(jobs, get_clip_workers(len(jobs)))
+    for material, video_file in zip(images, video_files):
+        material.url = video_file
+        logger.success(f"image processed: {video_file}")
+    return materials
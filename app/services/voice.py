@@ -6,13 +6,14 @@ from typing import Union
 from xml.sax.saxutils import unescape
 
 import edge_tts
-import requests
 from edge_tts import SubMaker, submaker
 from edge_tts.submaker import mktimestamp
 from loguru import logger
 from moviepy.video.tools import subtitles
 
 from app.config import config
+from app.services import probe
+from app.services.utils import http_client
 from app.utils import utils
 
 
@@ -1207,7 +1208,9 @@ def siliconflow_tts(
                 f"start siliconflow tts, model: {model}, voice: {voice}, try: {i + 1}"
             )
 
-            response = requests.post(url, json=payload, headers=headers)
+            response = http_client.post(
+                url, json=payload, headers=headers, timeout=(30, 120)
+            )
 
             if response.status_code == 200:
                 # 保存音频文件
@@ -1219,12 +1222,7 @@ def siliconflow_tts(
 
                 # 获取音频文件的实际长度
                 try:
-                    # 尝试使用moviepy获取音频长度
-                    from moviepy import AudioFileClip
-
-                    audio_clip = AudioFileClip(voice_file)
-                    audio_duration = audio_clip.duration
-                    audio_clip.close()
+                    audio_duration = probe.get_duration(voice_file)
 
                     # 将音频长度转换为100纳秒单位（与edge_tts兼容）
                     audio_duration_100ns = int(audio_duration * 10000000)
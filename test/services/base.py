@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.utils import utils
+
+
+class StorageTestCase(unittest.TestCase):
+    """
+    Runs every test with the storage directory, and so the caches and indexes in it,
+    under the temporary directory `temp_dir`.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        patcher = mock.patch.object(utils, "storage_dir", self._storage_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _storage_dir(self, sub_dir="", create=False):
+        d = os.path.join(self.temp_dir.name, "storage", sub_dir)
+        if create:
+            os.makedirs(d, exist_ok=True)
+        return d
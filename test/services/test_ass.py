@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image, ImageDraw
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import TimelineSubtitle, VideoParams
+from app.services import video
+from app.services.utils import ass, text_layout
+from app.utils import utils
+
+font_name = "Charm-Bold.ttf"
+font_path = os.path.join(utils.font_dir(), font_name)
+
+
+class TestAss(unittest.TestCase):
+    def setUp(self):
+        self.params = VideoParams(
+            video_subject="test",
+            font_name=font_name,
+            font_size=60,
+            stroke_width=1.5,
+            subtitle_position="custom",
+            custom_position=70.0,
+        )
+
+    def test_custom_position_matches_text_clip(self):
+        draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+        font = text_layout.get_font(font_path, 60)
+        ascent = ass.get_font_ascent(font_path, 60)
+        for text, line_count in [
+            ("A short line", 1),
+            ("A subtitle long enough to be wrapped over two or even three lines on a portrait video", 3),
+        ]:
+            item = TimelineSubtitle(start=0, end=2, text=text)
+            with mock.patch.object(video.subtitle_cache, "max_size", 0):
+                clip = video.create_text_clip(item, self.params, font_path, 1080, 1920)
+            _, expected_top = clip.pos(0)
+
+            lines = ass.get_custom_position(text, self.params, font_path, 1080, 1920)
+            self.assertEqual(len(lines), line_count)
+            self.assertEqual(" ".join(line for line, _ in lines), text)
+            self.assertTrue(all(x == 540 for _, (x, _) in lines))
+            # the first baseline is as far below the top of the TextClip as PIL draws it
+            first_line, (_, y) = lines[0]
+            line_ascent = -draw.textbbox((0, 0), first_line, font=font, stroke_width=1, anchor="ls")[1]
+            self.assertAlmostEqual(y + ascent, expected_top + line_ascent, delta=1, msg=text)
+            # and the lines are as far apart as PIL puts them
+            tops = [y for _, (_, y) in lines]
+            line_height = font.getbbox("A", stroke_width=1)[3] + 1 + 4
+            for previous, current in zip(tops, tops[1:]):
+                self.assertAlmostEqual(current - previous, line_height, delta=1)
+
+    def test_create_ass_file(self):
+        subtitles = [
+            TimelineSubtitle(start=0, end=2, text="A short line"),
+            TimelineSubtitle(
+                start=2,
+                end=4.5,
+                text="A subtitle long enough to be wrapped over two or even three lines on a portrait video",
+            ),
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            ass_file = ass.create_ass_file(
+                subtitles, self.params, 1080, 1920, os.path.join(temp_dir, "subtitle.ass")
+            )
+            with open(ass_file, encoding="utf-8") as f:
+                events = [line for line in f.read().splitlines() if line.startswith("Dialogue:")]
+
+        # one event for each line of the wrapped subtitle
+        self.assertEqual(len(events), 4)
+        self.assertTrue(events[0].startswith("Dialogue: 0,0:00:00.00,0:00:02.00,Default,,0,0,0,,{\\an8\\pos(540,"))
+        wrapped = events[1:]
+        for event in wrapped:
+            self.assertTrue(event.startswith("Dialogue: 0,0:00:02.00,0:00:04.50,Default,,0,0,0,,{\\an8\\pos(540,"))
+            self.assertNotIn("\\N", event)
+        tops = [int(event.split("\\pos(")[1].split(")")[0].split(",")[1]) for event in events]
+        # the wrapped subtitle is taller, so its first line is higher up
+        self.assertLess(tops[1], tops[0])
+        self.assertEqual(tops[1:], sorted(tops[1:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import Timeline, TimelineAudioTrack
+from app.services import audio
+
+
+class TestAudio(unittest.TestCase):
+    def test_fade_out_envelope(self):
+        gain = audio.fade_out_envelope(length=10, fade_samples=4, volume=0.5, count=10)
+        np.testing.assert_allclose(gain[:6], 0.5)
+        np.testing.assert_allclose(gain[6:], [0.5, 0.375, 0.25, 0.125])
+
+        # only the first samples of a long song are needed
+        gain = audio.fade_out_envelope(length=100, fade_samples=10, volume=1.0, count=20)
+        np.testing.assert_allclose(gain, 1.0)
+
+    def test_mix_audio(self):
+        rate = 10
+        voice = np.full((25, 2), 0.5, dtype=np.float32)
+        song = np.ones((8, 2), dtype=np.float32)
+        timeline = Timeline(
+            width=1080,
+            height=1920,
+            audio_tracks=[
+                TimelineAudioTrack(kind="voice", source="voice.mp3", volume=0.5),
+                TimelineAudioTrack(kind="bgm", source="bgm.mp3", volume=0.2, loop=True, fade_out=0.2),
+            ],
+        )
+
+        mixed = {}
+        with mock.patch.object(audio.narration, "get_pcm", return_value=voice), mock.patch.object(
+            audio, "get_bgm_pcm", return_value=song
+        ), mock.patch.object(
+            audio.ffmpeg, "encode_audio", lambda pcm, sample_rate, output_file: mixed.setdefault("pcm", pcm)
+        ):
+            audio.mix_audio(timeline, duration=3, output_file="mix.m4a", rate=rate)
+
+        pcm = mixed["pcm"]
+        # as long as the video, the voice ends at 2.5s
+        self.assertEqual(pcm.shape, (30, 2))
+        # the song fades out over its last 2 samples and loops
+        bgm = np.tile([0.2] * 6 + [0.2, 0.1], 4)[:30]
+        expected = bgm + np.where(np.arange(30) < 25, 0.25, 0.0)
+        np.testing.assert_allclose(pcm[:, 0], expected, rtol=1e-6)
+        np.testing.assert_allclose(pcm[:, 1], expected, rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+from moviepy import ColorClip, CompositeVideoClip, ImageClip
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.utils.compositing import IntervalCompositeVideoClip
+
+
+class TestIntervalCompositeVideoClip(unittest.TestCase):
+    def setUp(self):
+        self.background = ColorClip((64, 48), (10, 20, 30)).with_duration(10)
+        self.overlays = [
+            ImageClip(np.full((8, 16, 4), 40 * (i + 1), dtype="uint8"))
+            .with_start(start)
+            .with_duration(duration)
+            .with_position(("center", 30))
+            for i, (start, duration) in enumerate([(0, 2), (1.5, 1), (4, 3), (4.5, 0.5), (8, 2)])
+        ]
+
+    def test_playing_clips(self):
+        composite = CompositeVideoClip([self.background, *self.overlays])
+        indexed = IntervalCompositeVideoClip([self.background, *self.overlays])
+        for t in np.arange(0, 10, 0.25):
+            self.assertEqual(indexed.playing_clips(t), composite.playing_clips(t), f"t={t}")
+
+    def test_frames_match_composite(self):
+        composite = CompositeVideoClip([self.background, *self.overlays])
+        indexed = IntervalCompositeVideoClip(
+            [self.background, *self.overlays], use_bgclip=True
+        ).with_duration(self.background.duration)
+        for t in [0, 1.75, 3, 4.6, 9.5]:
+            np.testing.assert_array_equal(indexed.get_frame(t), composite.get_frame(t))
+
+
+if __name__ == "__main__":
+    unittest.main()
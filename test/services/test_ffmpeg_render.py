@@ -0,0 +1,84 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from moviepy.config import FFMPEG_BINARY
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import Timeline, TimelineAudioTrack, TimelineClip, VideoParams
+from app.services import ffmpeg_render, video
+
+
+def count_frames(video_file):
+    """
+    The decoded frames and the frame rate of the video stream.
+    """
+    output = subprocess.run(
+        [FFMPEG_BINARY, "-i", video_file, "-map", "0:v", "-f", "null", "-"],
+        capture_output=True,
+        text=True,
+    ).stderr
+    frames = int(re.findall(r"frame=\s*(\d+)", output)[-1])
+    rate = float(re.search(r"(\d+(?:\.\d+)?) fps", output).group(1))
+    return frames, rate
+
+
+class TestFfmpegRender(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        # a material at 25 fps, rendered at the 30 fps of the timeline
+        self.source = os.path.join(self.temp_dir.name, "source.mp4")
+        self.voice = os.path.join(self.temp_dir.name, "voice.m4a")
+        subprocess.run(
+            [FFMPEG_BINARY, "-y", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=320x240:rate=25",
+             "-t", "6", "-pix_fmt", "yuv420p", self.source],
+            check=True,
+        )
+        subprocess.run(
+            [FFMPEG_BINARY, "-y", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=9",
+             "-ac", "2", self.voice],
+            check=True,
+        )
+        self.timeline = Timeline(
+            width=108,
+            height=192,
+            fps=30,
+            duration=9,
+            clips=[
+                TimelineClip(source=self.source, start=0, end=3),
+                TimelineClip(source=self.source, start=3, end=6),
+                TimelineClip(source=self.source, start=1, end=4, transition="FadeIn"),
+            ],
+            audio_tracks=[TimelineAudioTrack(kind="voice", source=self.voice, duration=9)],
+        )
+        self.params = VideoParams(video_subject="test", subtitle_enabled=False, video_encoder="x264")
+
+    def test_frame_rate_matches_moviepy(self):
+        ffmpeg_file = os.path.join(self.temp_dir.name, "ffmpeg.mp4")
+        ffmpeg_render.render_video(ffmpeg_file, self.timeline, self.params)
+
+        moviepy_file = os.path.join(self.temp_dir.name, "moviepy.mp4")
+        with mock.patch.object(video.clip_cache, "max_size", 0):
+            video.combine_videos(moviepy_file, [], self.voice, timeline=self.timeline, video_encoder="x264")
+
+        frames, rate = count_frames(ffmpeg_file)
+        self.assertEqual(rate, 30)
+        self.assertEqual(frames, 270)
+        self.assertEqual((frames, rate), count_frames(moviepy_file))
+
+    def test_no_voice(self):
+        timeline = self.timeline.model_copy(update={"audio_tracks": []})
+        with self.assertRaisesRegex(ValueError, "no voice track"):
+            ffmpeg_render.render_video(os.path.join(self.temp_dir.name, "video.mp4"), timeline, self.params)
+
+
+if __name__ == "__main__":
+    unittest.main()
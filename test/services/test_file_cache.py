@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import unittest
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.utils import file_cache
+from test.services.base import StorageTestCase
+
+
+class TestFileCache(StorageTestCase):
+    def _write(self, name, size):
+        file_path = os.path.join(self.temp_dir.name, name)
+        with open(file_path, "wb") as f:
+            f.write(os.urandom(size))
+        return file_path
+
+    def test_hit_and_miss(self):
+        cache = file_cache.FileCache("test_cache", max_size_mb=1)
+        key = cache.make_key("source", 0, 5, 1080, 1920)
+        self.assertEqual(cache.get(key), "")
+
+        cache.put(key, self._write("clip.mp4", 1024))
+        cached_file = cache.get(key)
+        self.assertTrue(os.path.isfile(cached_file))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_lru_eviction(self):
+        cache = file_cache.FileCache("test_cache", max_size_mb=1)
+        size = 400 * 1024
+        keys = [cache.make_key(i) for i in range(3)]
+        for i, key in enumerate(keys[:2]):
+            cache.put(key, self._write(f"clip-{i}.mp4", size))
+            os.utime(cache.path(key), (time.time() - 100 + i, time.time() - 100 + i))
+
+        # touch the oldest entry so the second one becomes the least recently used
+        self.assertTrue(cache.get(keys[0]))
+        cache.put(keys[2], self._write("clip-2.mp4", size))
+
+        self.assertTrue(os.path.isfile(cache.path(keys[0])))
+        self.assertFalse(os.path.isfile(cache.path(keys[1])))
+        self.assertTrue(os.path.isfile(cache.path(keys[2])))
+
+    def test_disabled(self):
+        cache = file_cache.FileCache("test_cache", max_size_mb=0)
+        key = cache.make_key("source")
+        self.assertEqual(cache.put(key, self._write("clip.mp4", 16)), "")
+        self.assertEqual(cache.get(key), "")
+
+    def test_file_hash(self):
+        file_path = self._write("clip.mp4", 2048)
+        self.assertEqual(file_cache.file_hash(file_path), file_cache.file_hash(file_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.utils import http_client
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # responses sent before the 200, as (status, headers)
+    failures = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.failures:
+            status, headers = self.failures.pop(0)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestHttpClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.host = f"127.0.0.1:{cls.server.server_port}"
+        cls.url = f"http://{cls.host}/speech"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        http_client._sessions.clear()
+        http_client._stats.clear()
+        Handler.failures = []
+
+    def get_host_stats(self):
+        return next(s for s in http_client.get_stats() if s["host"] == self.host)
+
+    def test_keep_alive(self):
+        for _ in range(5):
+            self.assertEqual(http_client.post(self.url, json={}).json(), {"ok": True})
+        stats = self.get_host_stats()
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["idle_connections"], 1)
+
+    def test_retry(self):
+        Handler.failures = [(429, {"Retry-After": "0"})]
+        r = http_client.post(self.url, json={})
+        self.assertEqual(r.status_code, 200)
+        stats = self.get_host_stats()
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["retries"], 1)
+
+    def test_post_retried_when_not_run(self):
+        Handler.failures = [(503, {"Retry-After": "0"})]
+        self.assertEqual(http_client.post(self.url, json={}).status_code, 200)
+        self.assertEqual(self.get_host_stats()["retries"], 1)
+
+    def test_post_not_retried_when_maybe_run(self):
+        # the provider may have run the request before failing
+        for status in (500, 503, 504):
+            Handler.failures = [(status, {})]
+            self.assertEqual(http_client.post(self.url, json={}).status_code, status)
+        self.assertEqual(self.get_host_stats()["retries"], 0)
+
+    def test_get_retried(self):
+        Handler.failures = [(500, {}), (504, {})]
+        with mock.patch.dict(http_client.config.app, {"http_backoff_factor": 0}):
+            self.assertEqual(http_client.get(self.url).status_code, 200)
+        self.assertEqual(self.get_host_stats()["retries"], 2)
+
+    def test_not_retried(self):
+        Handler.failures = [(400, {})]
+        r = http_client.post(self.url, json={})
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(self.get_host_stats()["retries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import MaterialInfo, VideoConcatMode
+from app.services import material
+
+
+def make_items(count, duration=10):
+    return [
+        MaterialInfo(provider="pexels", url=f"https://videos.example.com/{i}.mp4", duration=duration)
+        for i in range(count)
+    ]
+
+
+class TestDownloadInOrder(unittest.TestCase):
+    def setUp(self):
+        self.started = []
+        self.failing = set()
+        self.lock = threading.Lock()
+
+    def save_video(self, video_url, save_dir="", stop_event=None):
+        with self.lock:
+            self.started.append(video_url)
+        # the later videos finish first
+        index = int(video_url.rsplit("/", 1)[1].split(".")[0])
+        time.sleep(0.05 / (index + 1))
+        if video_url in self.failing:
+            return ""
+        return f"/videos/{index}.mp4"
+
+    def download(self, items, audio_duration):
+        with mock.patch.object(material, "save_video", self.save_video):
+            return material.download_in_order(
+                items, audio_duration=audio_duration, max_clip_duration=5
+            )
+
+    def test_order_and_budget(self):
+        items = make_items(20)
+        paths = self.download(items, audio_duration=12)
+        # 3 clips of 5 seconds cover 12 seconds, in the planned order
+        self.assertEqual(paths, ["/videos/0.mp4", "/videos/1.mp4", "/videos/2.mp4"])
+        self.assertEqual(len(self.started), 3)
+
+    def test_failed_downloads_are_replaced(self):
+        items = make_items(20)
+        self.failing = {items[1].url, items[2].url}
+        paths = self.download(items, audio_duration=12)
+        self.assertEqual(paths, ["/videos/0.mp4", "/videos/3.mp4", "/videos/4.mp4"])
+
+    def test_not_enough_videos(self):
+        items = make_items(3)
+        self.failing = {items[0].url}
+        paths = self.download(items, audio_duration=100)
+        self.assertEqual(paths, ["/videos/1.mp4", "/videos/2.mp4"])
+
+
+class TestSearchAll(unittest.TestCase):
+    def setUp(self):
+        self.results = {
+            "money": ["a", "b"],
+            "finance": ["b", "c"],
+            "city night": ["d"],
+        }
+        # called by each search before it returns
+        self.before_return = {}
+        self.events = []
+
+    def search_videos(self, search_term, minimum_duration, video_aspect):
+        if search_term in self.before_return:
+            self.before_return[search_term]()
+        self.events.append(f"searched {search_term}")
+        return [
+            MaterialInfo(provider="pexels", url=f"https://videos.example.com/{name}.mp4", duration=10)
+            for name in self.results[search_term]
+        ]
+
+    def test_search_all(self):
+        # every search waits until all of them are running
+        barrier = threading.Barrier(len(self.results), timeout=10)
+        self.before_return = {search_term: barrier.wait for search_term in self.results}
+        items = list(material.search_all(self.search_videos, list(self.results)))
+        self.assertEqual(
+            [item.url.rsplit("/", 1)[1] for item in items], ["a.mp4", "b.mp4", "c.mp4", "d.mp4"]
+        )
+
+    def test_downloads_start_before_all_searches_finished(self):
+        downloading = threading.Event()
+        # the last search only finishes once a download started
+        self.before_return = {"city night": lambda: self.assertTrue(downloading.wait(timeout=10))}
+
+        def save_video(video_url, save_dir="", stop_event=None):
+            downloading.set()
+            self.events.append(f"downloaded {video_url.rsplit('/', 1)[1]}")
+            return video_url
+
+        with mock.patch.object(material, "search_videos_pexels", self.search_videos), mock.patch.object(
+            material, "save_video", save_video
+        ):
+            paths = material.download_videos(
+                "task",
+                list(self.results),
+                video_contact_mode=VideoConcatMode.sequential,
+                audio_duration=12,
+                max_clip_duration=5,
+            )
+        self.assertEqual(len(paths), 3)
+        self.assertLess(self.events.index("downloaded a.mp4"), self.events.index("searched city night"))
+
+
+class BrokenStream(io.BytesIO):
+    """
+    A response body whose connection drops after `limit` bytes.
+    """
+
+    def __init__(self, data, limit):
+        super().__init__(data)
+        self.size = len(data)
+        self.limit = limit
+
+    def read(self, size=-1):
+        if self.tell() >= self.limit and self.limit < self.size:
+            raise requests.exceptions.ConnectionError("connection reset")
+        return super().read(min(size, self.limit - self.tell()))
+
+
+class TestDownloadFile(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.file_path = os.path.join(self.temp_dir.name, "video.mp4")
+        self.data = os.urandom(10000)
+        self.requests = []
+        # the byte after which the connection drops, None for a complete response
+        self.drop_at = None
+        self.supports_range = True
+        self.content_length = len(self.data)
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(dict(headers or {}))
+        offset = 0
+        r = requests.Response()
+        r.status_code = 200
+        range_header = (headers or {}).get("Range")
+        if range_header and self.supports_range:
+            offset = int(range_header[len("bytes=") : -1])
+            r.status_code = 206
+            r.headers["Content-Range"] = f"bytes {offset}-{len(self.data) - 1}/{len(self.data)}"
+        r.headers["Content-Length"] = str(self.content_length - offset)
+        body = self.data[offset:]
+        limit = len(body) if self.drop_at is None else self.drop_at - offset
+        r.raw = BrokenStream(body, limit)
+        return r
+
+    def download(self, stop_event=None):
+        with mock.patch.object(material.http_client, "get", self.get):
+            return material.download_file(
+                "https://videos.example.com/1.mp4",
+                self.file_path,
+                stop_event=stop_event,
+                chunk_size=1024,
+            )
+
+    def read_file(self):
+        with open(self.file_path, "rb") as f:
+            return f.read()
+
+    def test_download(self):
+        self.assertTrue(self.download())
+        self.assertEqual(self.read_file(), self.data)
+        self.assertFalse(os.path.exists(f"{self.file_path}.part"))
+
+    def test_resume(self):
+        self.drop_at = 4096
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.download()
+        # nothing is taken for a downloaded video
+        self.assertFalse(os.path.exists(self.file_path))
+
+        self.drop_at = None
+        self.assertTrue(self.download())
+        self.assertEqual(self.requests[-1]["Range"], "bytes=4096-")
+        self.assertEqual(self.read_file(), self.data)
+
+    def test_resume_not_supported(self):
+        self.drop_at = 4096
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.download()
+        self.drop_at = None
+        self.supports_range = False
+        self.assertTrue(self.download())
+        self.assertEqual(self.read_file(), self.data)
+
+    def test_content_length_mismatch(self):
+        # the server closes the connection early without an error
+        self.content_length = len(self.data) + 100
+        with self.assertRaises(material.IncompleteDownloadError):
+            self.download()
+        self.assertFalse(os.path.exists(self.file_path))
+
+    def test_cancel(self):
+        stop_event = threading.Event()
+        stop_event.set()
+        self.assertFalse(self.download(stop_event))
+        self.assertFalse(os.path.exists(self.file_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
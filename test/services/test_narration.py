@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services import narration
+from app.services.utils import ffmpeg
+
+
+class TestNarration(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        # the narration of a task, a tone written by ffmpeg
+        self.audio_file = os.path.join(self.temp_dir.name, "audio.m4a")
+        pcm = 0.5 * np.sin(np.linspace(0, 2000 * np.pi, 44100 * 2, dtype=np.float32))
+        ffmpeg.encode_audio(np.repeat(pcm[:, np.newaxis], 2, axis=1), 44100, self.audio_file)
+
+    def test_prepare_decodes_once(self):
+        with mock.patch.object(
+            narration.ffmpeg, "decode_audio_files", wraps=ffmpeg.decode_audio_files
+        ) as decode:
+            narration.prepare(self.audio_file, [narration.mix_format, narration.whisper_format])
+            mix = narration.get_pcm(self.audio_file)
+            speech = narration.get_pcm(self.audio_file, *narration.whisper_format)
+            narration.prepare(self.audio_file, [narration.mix_format, narration.whisper_format])
+        self.assertEqual(decode.call_count, 1)
+
+        self.assertIsInstance(mix, np.memmap)
+        self.assertEqual(mix.shape[1], 2)
+        self.assertEqual(speech.shape[1], 1)
+        self.assertAlmostEqual(narration.get_duration(self.audio_file), 2.0, delta=0.1)
+        self.assertAlmostEqual(len(speech) / 16000, len(mix) / 44100, delta=0.01)
+        self.assertGreater(np.abs(mix).max(), 0.4)
+
+    def test_stale_pcm(self):
+        duration = narration.get_duration(self.audio_file)
+        # the narration is generated again, shorter
+        pcm = np.zeros((44100, 2), dtype=np.float32)
+        ffmpeg.encode_audio(pcm, 44100, self.audio_file)
+        os.utime(self.audio_file, ns=(0, 0))
+        self.assertLess(narration.get_duration(self.audio_file), duration - 0.5)
+
+    def test_remove(self):
+        narration.prepare(self.audio_file, [narration.mix_format, narration.whisper_format])
+        self.assertEqual(len(os.listdir(self.temp_dir.name)), 5)
+        narration.remove(self.audio_file)
+        self.assertEqual(os.listdir(self.temp_dir.name), ["audio.m4a"])
+        # decoded again when needed
+        self.assertAlmostEqual(narration.get_duration(self.audio_file), 2.0, delta=0.1)
+
+    def test_narrations_decode_in_parallel(self):
+        other_file = os.path.join(self.temp_dir.name, "other.m4a")
+        ffmpeg.encode_audio(np.zeros((44100, 2), dtype=np.float32), 44100, other_file)
+
+        # both decodes have to be running at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=10)
+        original = ffmpeg.decode_audio_files
+
+        def decode_audio_files(audio_file, outputs):
+            barrier.wait()
+            return original(audio_file, outputs)
+
+        errors = []
+
+        def get_duration(audio_file):
+            try:
+                narration.get_duration(audio_file)
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(narration.ffmpeg, "decode_audio_files", decode_audio_files):
+            threads = [
+                threading.Thread(target=get_duration, args=(audio_file,))
+                for audio_file in (self.audio_file, other_file)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            sorted(f for f in os.listdir(self.temp_dir.name) if f.endswith(".tmp")), []
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import glob
+import os
+import shutil
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services import probe
+from app.utils import utils
+from test.services.base import StorageTestCase
+
+resources_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "resources")
+
+
+class TestProbe(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        probe._db = None
+
+    def tearDown(self):
+        if probe._db is not None:
+            probe._db.close()
+            probe._db = None
+
+    def test_headers_match_ffmpeg(self):
+        files = glob.glob(os.path.join(resources_dir, "*.mp4"))
+        files += sorted(glob.glob(os.path.join(utils.song_dir(), "*.mp3")))[:3]
+        self.assertTrue(files)
+        for file_path in files:
+            with mock.patch.object(probe, "probe_ffmpeg") as probe_ffmpeg:
+                info = probe._probe(file_path)
+            probe_ffmpeg.assert_not_called()
+
+            infos = ffmpeg_parse_infos(file_path)
+            self.assertAlmostEqual(info.duration, infos["duration"], delta=0.01, msg=file_path)
+            if infos.get("video_found"):
+                self.assertEqual(list(info.size), list(infos["video_size"]), file_path)
+                self.assertAlmostEqual(info.fps, infos["video_fps"], delta=0.01, msg=file_path)
+
+    def test_index(self):
+        video_file = os.path.join(self.temp_dir.name, "video.mp4")
+        shutil.copyfile(os.path.join(resources_dir, "2.png.mp4"), video_file)
+
+        with mock.patch.object(probe, "_probe", wraps=probe._probe) as parse:
+            first = probe.probe(video_file)
+            second = probe.probe(video_file)
+            self.assertEqual(parse.call_count, 1)
+            self.assertEqual(first, second)
+
+            # a changed file is probed again
+            os.utime(video_file, ns=(0, 0))
+            probe.probe(video_file)
+            self.assertEqual(parse.call_count, 2)
+
+    def test_prune(self):
+        files = []
+        for name in ("kept.mp4", "deleted.mp4", "replaced.mp4"):
+            files.append(os.path.join(self.temp_dir.name, name))
+            shutil.copyfile(os.path.join(resources_dir, "2.png.mp4"), files[-1])
+            probe.probe(files[-1])
+        os.remove(files[1])
+        os.utime(files[2], ns=(0, 0))
+
+        # pruned when the index is opened again
+        probe._db.close()
+        probe._db = None
+        paths = [row[0] for row in probe._get_db().execute("SELECT path FROM probes")]
+        self.assertEqual(paths, [os.path.abspath(files[0])])
+
+        # and after every prune_interval new entries
+        os.remove(files[0])
+        with mock.patch.object(probe, "prune_interval", 1):
+            probe.probe(files[2])
+        paths = [row[0] for row in probe._get_db().execute("SELECT path FROM probes")]
+        self.assertEqual(paths, [os.path.abspath(files[2])])
+
+    def test_truncated_file(self):
+        source = os.path.join(resources_dir, "2.png.mp4")
+        truncated_file = os.path.join(self.temp_dir.name, "truncated.mp4")
+        with open(source, "rb") as src, open(truncated_file, "wb") as dst:
+            dst.write(src.read(os.path.getsize(source) // 2))
+
+        with self.assertRaises(Exception):
+            probe.probe(truncated_file)
+
+
+if __name__ == "__main__":
+    unittest.main()
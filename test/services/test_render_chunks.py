@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from moviepy.config import FFMPEG_BINARY
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import TimelineSubtitle, VideoParams
+from app.services import encoder as video_encoders
+from app.services import video
+from app.utils import utils
+from test.services.test_ffmpeg_render import count_frames
+
+
+class TestChunkRanges(unittest.TestCase):
+    def test_frame_boundaries(self):
+        for duration, chunks in [(10, 3), (7.37, 4), (61.01, 8)]:
+            ranges = video.get_chunk_ranges(duration, chunks)
+            self.assertEqual(len(ranges), chunks)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertAlmostEqual(ranges[-1][1], round(duration * video.fps) / video.fps)
+            for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, next_start)
+            for start, end in ranges:
+                for t in (start, end):
+                    self.assertAlmostEqual(t * video.fps, round(t * video.fps), places=6)
+
+    def test_chunk_count(self):
+        with mock.patch.object(video, "get_clip_workers", lambda jobs: jobs), mock.patch.dict(
+            video.config.app, {"video_render_chunks": 0}
+        ):
+            # as many chunks as workers, at most 8
+            self.assertEqual(video.get_render_chunks(600), 8)
+            # every chunk is at least 2 seconds long
+            self.assertEqual(video.get_render_chunks(7.9), 3)
+            self.assertEqual(video.get_render_chunks(1.5), 1)
+            with mock.patch.dict(video.config.app, {"video_render_chunks": 20}):
+                self.assertEqual(video.get_render_chunks(600), 8)
+            with mock.patch.dict(video.config.app, {"video_render_chunks": 2}):
+                self.assertEqual(video.get_render_chunks(600), 2)
+
+    def test_chunk_subtitles(self):
+        subtitles = [
+            TimelineSubtitle(start=0, end=1.5, text="first"),
+            TimelineSubtitle(start=1.5, end=3.5, text="across"),
+            TimelineSubtitle(start=4, end=5, text="last"),
+        ]
+        self.assertEqual(
+            [(item.text, item.start, item.end) for item in video.get_chunk_subtitles(subtitles, 0, 2)],
+            [("first", 0, 1.5), ("across", 1.5, 2)],
+        )
+        self.assertEqual(
+            [(item.text, item.start, item.end) for item in video.get_chunk_subtitles(subtitles, 2, 4)],
+            [("across", 0, 1.5)],
+        )
+        self.assertEqual(video.get_chunk_subtitles(subtitles, 5, 6), [])
+
+
+class TestRenderChunks(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.video_path = os.path.join(self.temp_dir.name, "combined.mp4")
+        subprocess.run(
+            [FFMPEG_BINARY, "-y", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=108x192:rate=30",
+             "-t", "6.5", "-pix_fmt", "yuv420p", self.video_path],
+            check=True,
+        )
+        self.font_path = os.path.join(utils.font_dir(), "Charm-Bold.ttf")
+        self.params = VideoParams(video_subject="test", font_size=20, video_encoder="x264")
+        self.subtitles = [
+            TimelineSubtitle(start=0.5, end=2.5, text="first"),
+            TimelineSubtitle(start=3, end=6, text="second"),
+        ]
+        self.encoder = video_encoders.get_encoder("x264")
+
+    def test_same_frames_as_single_render(self):
+        single_file = os.path.join(self.temp_dir.name, "single.mp4")
+        video.render_chunk(
+            self.video_path, single_file, 0, 6.5, self.subtitles,
+            self.params, self.font_path, 108, 192, self.encoder,
+        )
+
+        chunked_file = os.path.join(self.temp_dir.name, "chunked.mp4")
+        video.render_chunks(
+            self.video_path, chunked_file, self.subtitles,
+            self.params, self.font_path, 108, 192, self.encoder, duration=6.5, chunks=3,
+        )
+
+        self.assertEqual(count_frames(chunked_file), count_frames(single_file))
+        self.assertEqual(count_frames(chunked_file), (195, 30))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import sys
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import MaterialInfo, VideoAspect
+from app.services import search_cache
+from test.services.base import StorageTestCase
+
+
+class TestSearchCache(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config = {"search_cache_ttl_hours": 1, "search_cache_stale_hours": 1}
+        patcher = mock.patch.dict(search_cache.config.app, self.config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        search_cache._db = None
+        search_cache._refreshing.clear()
+        for counter in search_cache._stats:
+            search_cache._stats[counter] = 0
+        self.addCleanup(self._close_db)
+        self.fetches = 0
+
+    def _close_db(self):
+        if search_cache._db is not None:
+            search_cache._db.close()
+            search_cache._db = None
+
+    def fetch(self):
+        self.fetches += 1
+        return [MaterialInfo(provider="pexels", url=f"https://example.com/{self.fetches}.mp4", duration=10)]
+
+    def fail(self):
+        self.fetches += 1
+        raise ValueError("quota exceeded")
+
+    def search(self, fetch=None, search_term="Money"):
+        return search_cache.search(
+            "pexels", search_term, VideoAspect.portrait, 20, 5, fetch=fetch or self.fetch
+        )
+
+    def age_entries(self, hours):
+        db = search_cache._get_db()
+        db.execute("UPDATE searches SET created_at = created_at - ?", (hours * 3600,))
+        db.commit()
+
+    def test_hit(self):
+        items = self.search()
+        # the search term is normalized
+        self.assertEqual(self.search(search_term=" money "), items)
+        self.assertEqual(self.fetches, 1)
+        stats = search_cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_stale_while_revalidate(self):
+        first = self.search()
+        self.age_entries(1.5)
+        # the old results are returned while the search runs again
+        self.assertEqual(self.search(), first)
+        for _ in range(100):
+            if not search_cache._refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(self.search()[0].url, "https://example.com/2.mp4")
+        self.assertEqual(search_cache.get_stats()["stale_hits"], 1)
+
+    def test_expired(self):
+        self.search()
+        self.age_entries(3)
+        self.assertEqual(self.search()[0].url, "https://example.com/2.mp4")
+        self.assertEqual(search_cache.get_stats()["misses"], 2)
+
+    def test_prune(self):
+        self.search(search_term="old")
+        self.age_entries(3)
+        # expired results are removed when the index is opened
+        self._close_db()
+        self.assertEqual(search_cache.get_stats()["entries"], 0)
+
+        # and when results are stored
+        self.search(search_term="old")
+        self.age_entries(3)
+        self.search(search_term="new")
+        self.assertEqual(search_cache.get_stats()["entries"], 1)
+
+    def test_failure(self):
+        self.assertEqual(self.search(fetch=self.fail), [])
+        # failures are not cached
+        self.assertEqual(len(self.search()), 1)
+
+        # the last results are used when the search fails
+        self.age_entries(3)
+        self.assertEqual(self.search(fetch=self.fail)[0].url, "https://example.com/2.mp4")
+        self.assertEqual(search_cache.get_stats()["errors"], 2)
+
+    def test_disabled(self):
+        self.config["search_cache_ttl_hours"] = 0
+        with mock.patch.dict(search_cache.config.app, self.config):
+            self.search()
+            self.search()
+        self.assertEqual(self.fetches, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services import probe, song_library
+from app.utils import utils
+from test.services.base import StorageTestCase
+
+
+class TestSongLibrary(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.song_dir = os.path.join(self.temp_dir.name, "songs")
+        os.makedirs(self.song_dir)
+        self.durations = {"long.mp3": 180.0, "short.mp3": 20.0}
+        for name in self.durations:
+            self._write_song(name)
+
+        patchers = [
+            mock.patch.object(utils, "song_dir", lambda sub_dir="": self.song_dir),
+            mock.patch.object(
+                probe,
+                "probe",
+                lambda file_path: probe.MediaInfo(
+                    duration=self.durations[os.path.basename(file_path)], sample_rate=44100
+                ),
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(song_library.ffmpeg, "measure_loudness", return_value=-26.0)
+        self.measure_loudness = patcher.start()
+        self.addCleanup(patcher.stop)
+        song_library._songs, song_library._dir_mtime = [], None
+        song_library._analysis = None
+
+    def _write_song(self, name):
+        with open(os.path.join(self.song_dir, name), "wb") as f:
+            f.write(os.urandom(1024))
+
+    def get_analyzed_songs(self):
+        song_library.get_songs()
+        analysis = song_library._analysis
+        if analysis is not None:
+            analysis.join(timeout=10)
+        return song_library.get_songs()
+
+    def test_index(self):
+        songs = self.get_analyzed_songs()
+        self.assertEqual([song["name"] for song in songs], ["long.mp3", "short.mp3"])
+        self.assertEqual(songs[0]["duration"], 180.0)
+        self.assertEqual(songs[0]["sample_rate"], 44100)
+        self.assertEqual(songs[0]["loudness"], -26.0)
+        self.assertAlmostEqual(songs[0]["gain"], 1.995, places=3)
+        self.assertEqual(self.measure_loudness.call_count, 2)
+
+        # unchanged directory, nothing is analyzed again, not even after a restart
+        song_library.get_songs()
+        song_library._songs, song_library._dir_mtime = [], None
+        self.assertEqual(len(self.get_analyzed_songs()), 2)
+        self.assertEqual(self.measure_loudness.call_count, 2)
+
+        # only the new song is analyzed
+        self.durations["new.mp3"] = 60.0
+        self._write_song("new.mp3")
+        os.utime(self.song_dir, ns=(0, 0))
+        self.assertEqual(len(self.get_analyzed_songs()), 3)
+        self.assertEqual(self.measure_loudness.call_count, 3)
+
+    def test_cold_index(self):
+        # the loudness is measured once the songs were returned
+        measured = threading.Event()
+        self.measure_loudness.side_effect = lambda file_path: measured.wait(timeout=10) and -26.0
+
+        songs = song_library.get_songs()
+        self.assertEqual([song["duration"] for song in songs], [180.0, 20.0])
+        self.assertEqual([song["loudness"] for song in songs], [None, None])
+        self.assertEqual(song_library.pick_song(min_duration=60)["name"], "long.mp3")
+
+        measured.set()
+        songs = self.get_analyzed_songs()
+        self.assertEqual([song["loudness"] for song in songs], [-26.0, -26.0])
+        self.assertEqual(self.measure_loudness.call_count, 2)
+        # the measured songs are in the index
+        song_library._songs, song_library._dir_mtime = [], None
+        self.assertEqual(song_library.get_songs()[0]["gain"], 1.995)
+
+    def test_pick_song(self):
+        for _ in range(20):
+            self.assertEqual(song_library.pick_song(min_duration=60)["name"], "long.mp3")
+        # no song is long enough, any song is picked
+        self.assertIn(song_library.pick_song(min_duration=600)["name"], self.durations)
+
+    def test_suggested_gain(self):
+        self.assertEqual(song_library.suggested_gain(None), 1.0)
+        self.assertEqual(song_library.suggested_gain(song_library.target_loudness), 1.0)
+        self.assertEqual(song_library.suggested_gain(-70.0), song_library.max_gain)
+        self.assertEqual(song_library.suggested_gain(0.0), song_library.min_gain)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from moviepy.config import FFMPEG_BINARY
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import Timeline, TimelineClip
+from app.services import encoder as video_encoders
+from app.services import video
+from app.services.utils import ffmpeg
+from test.services.test_ffmpeg_render import count_frames
+
+width, height = 108, 192
+
+
+def make_video(file_path, rate=30, pix_fmt="yuv420p", gop=30, duration=6, params=()):
+    subprocess.run(
+        [FFMPEG_BINARY, "-y", "-loglevel", "error",
+         "-f", "lavfi", "-i", f"testsrc=size={width}x{height}:rate={rate}",
+         "-t", str(duration), "-c:v", "libx264", "-pix_fmt", pix_fmt,
+         "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0", *params, file_path],
+        check=True,
+    )
+    return file_path
+
+
+class TestStreamCopy(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.encoder = video_encoders.get_encoder("x264")
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def get_copy_start(self, source, start, end=None):
+        timeline_clip = TimelineClip(source=source, start=start, end=end or start + 2)
+        return video.get_copy_start(timeline_clip, width, height, self.encoder)
+
+    def test_matching_source(self):
+        # a keyframe every second
+        source = make_video(self.path("source.mp4"))
+        self.assertEqual(self.get_copy_start(source, 2), 2)
+        # the cut moves to the nearest keyframe
+        self.assertEqual(self.get_copy_start(source, 1.3), 1)
+        self.assertEqual(self.get_copy_start(source, 2.6), 3)
+        # the cut must fit in the source from the shifted start
+        self.assertIsNone(self.get_copy_start(source, 4.8, 6))
+
+    def test_transition(self):
+        source = make_video(self.path("source.mp4"))
+        timeline_clip = TimelineClip(source=source, start=2, end=4, transition="FadeIn")
+        self.assertIsNone(video.get_copy_start(timeline_clip, width, height, self.encoder))
+
+    def test_mismatched_format(self):
+        self.assertIsNone(self.get_copy_start(make_video(self.path("yuv444p.mp4"), pix_fmt="yuv444p"), 2))
+        self.assertIsNone(self.get_copy_start(make_video(self.path("25fps.mp4"), rate=25, gop=25), 2))
+
+    def test_keyframe_too_far(self):
+        # keyframes at 0 and 3 seconds, none within 0.5s of 1.5
+        source = make_video(self.path("source.mp4"), gop=90)
+        self.assertIsNone(self.get_copy_start(source, 1.5))
+        self.assertEqual(self.get_copy_start(source, 0.4), 0)
+
+    def test_can_join_with_copy(self):
+        first = make_video(self.path("first.mp4"))
+        second = make_video(self.path("second.mp4"))
+        self.assertTrue(ffmpeg.can_join_with_copy([first, second, first]))
+        # another SPS, with the same codec, profile, size, fps and pixel format
+        refs = make_video(self.path("refs.mp4"), params=["-refs", "1"])
+        self.assertFalse(ffmpeg.can_join_with_copy([first, refs]))
+        timescale = make_video(self.path("timescale.mp4"), params=["-video_track_timescale", "90000"])
+        self.assertFalse(ffmpeg.can_join_with_copy([first, timescale]))
+
+    def test_copied_clips_joined_with_encoded_clips(self):
+        source = make_video(self.path("source.mp4"), params=["-refs", "1"])
+        timeline = Timeline(
+            width=width,
+            height=height,
+            fps=30,
+            duration=6,
+            clips=[
+                TimelineClip(source=source, start=0, end=2),
+                TimelineClip(source=source, start=2, end=4, transition="FadeIn"),
+                TimelineClip(source=source, start=4, end=6),
+            ],
+        )
+        joined = []
+
+        def concat_videos(video_files, output_file, **kwargs):
+            joined.append(ffmpeg.can_join_with_copy(video_files))
+            return concat(video_files, output_file, **kwargs)
+
+        concat = ffmpeg.concat_videos
+        output_file = self.path("combined.mp4")
+        with mock.patch.object(video.clip_cache, "max_size", 0), mock.patch.object(
+            video.ffmpeg, "concat_videos", concat_videos
+        ):
+            video.combine_videos(output_file, [], "", timeline=timeline, video_encoder="x264")
+
+        # the copied clips were normalized like the clip with the transition
+        self.assertEqual(joined, [True])
+        self.assertEqual(count_frames(output_file), (180, 30))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+import unittest
+from collections import OrderedDict
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from moviepy import TextClip
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import VideoParams
+from app.services import video
+from app.utils import utils
+from test.services.base import StorageTestCase
+
+font_path = os.path.join(utils.font_dir(), "Charm-Bold.ttf")
+text = "A subtitle long enough to be wrapped over two lines"
+render_subtitle_sprite = video._render_subtitle_sprite
+
+
+class TestSubtitleSprite(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        patchers = [
+            mock.patch.object(video, "_subtitle_sprites", OrderedDict()),
+            mock.patch.multiple(video.subtitle_cache, max_size=1024 * 1024, hits=0, misses=0),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.params = VideoParams(video_subject="test", font_size=60, stroke_width=1.5)
+        self.renders = 0
+
+    def render(self, *args):
+        self.renders += 1
+        return render_subtitle_sprite(*args)
+
+    def get_sprite(self):
+        with mock.patch.object(video, "_render_subtitle_sprite", self.render):
+            return video.get_subtitle_sprite(text, self.params, font_path, 500)
+
+    def test_matches_text_clip(self):
+        wrapped_text, _ = video.wrap_text(text, 500, font_path, 60)
+        self.assertIn("\n", wrapped_text)
+        text_clip = TextClip(
+            text=wrapped_text,
+            font=font_path,
+            font_size=60,
+            color=self.params.text_fore_color,
+            bg_color=self.params.text_background_color,
+            stroke_color=self.params.stroke_color,
+            stroke_width=1,
+        )
+        expected = np.dstack(
+            [text_clip.get_frame(0), (text_clip.mask.get_frame(0) * 255).round()]
+        ).astype("uint8")
+
+        first = self.get_sprite()
+        np.testing.assert_array_equal(first, expected)
+        # from the process memo
+        self.assertIs(self.get_sprite(), first)
+        # from the disk cache, as in another process
+        video._subtitle_sprites.clear()
+        np.testing.assert_array_equal(self.get_sprite(), expected)
+
+        self.assertEqual(self.renders, 1)
+        stats = video.subtitle_cache.stats()
+        self.assertEqual((stats["hits"], stats["entries"]), (1, 1))
+
+    def test_concurrent_renders(self):
+        # both threads render the line and store it at the same time
+        barrier = threading.Barrier(2, timeout=10)
+        temp_files = []
+        put = video.subtitle_cache.put
+
+        def put_together(key, file_path, ext="mp4"):
+            temp_files.append(file_path)
+            barrier.wait()
+            return put(key, file_path, ext)
+
+        sprites = []
+        with mock.patch.object(video.subtitle_cache, "put", put_together):
+            threads = [
+                threading.Thread(
+                    target=lambda: sprites.append(
+                        video.get_subtitle_sprite(text, self.params, font_path, 500)
+                    )
+                )
+                for _ in range(2)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(sprites), 2)
+        self.assertEqual(len(set(temp_files)), 2)
+        self.assertEqual(video.subtitle_cache.stats()["entries"], 1)
+        self.assertEqual(
+            [name for name in os.listdir(video.subtitle_cache.cache_dir) if not name.endswith(".png")],
+            [],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
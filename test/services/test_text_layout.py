@@ -0,0 +1,143 @@
+import os
+import random
+import sys
+import time
+import unittest
+from pathlib import Path
+
+from PIL import ImageFont
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.utils import text_layout
+from app.utils import utils
+
+font_path = os.path.join(utils.font_dir(), "Charm-Bold.ttf")
+
+text_en = (
+    "The Roman Empire was one of the largest empires in history, stretching from the "
+    "rainy hills of Britain to the deserts of Egypt. Its roads, aqueducts and laws "
+    "shaped the cities of Europe for centuries after its fall. "
+) * 20
+text_zh = (
+    "春天的花海，如诗如画般展现在眼前。万物复苏的季节里，大地披上了一袭绚丽多彩的盛装。"
+    "金黄的迎春、粉嫩的樱花、洁白的梨花、艳丽的郁金香，在阳光下竞相绽放。"
+) * 20
+
+
+def legacy_wrap_text(text, max_width, font="Arial", fontsize=60):
+    """The wrap_text of video.py before text_layout, measuring every prefix."""
+    font = ImageFont.truetype(font, fontsize)
+
+    def get_text_size(inner_text):
+        inner_text = inner_text.strip()
+        left, top, right, bottom = font.getbbox(inner_text)
+        return right - left, bottom - top
+
+    width, height = get_text_size(text)
+    if width <= max_width:
+        return text, height
+
+    processed = True
+
+    _wrapped_lines_ = []
+    words = text.split(" ")
+    _txt_ = ""
+    for word in words:
+        _before = _txt_
+        _txt_ += f"{word} "
+        _width, _height = get_text_size(_txt_)
+        if _width <= max_width:
+            continue
+        else:
+            if _txt_.strip() == word.strip():
+                processed = False
+                break
+            _wrapped_lines_.append(_before)
+            _txt_ = f"{word} "
+    _wrapped_lines_.append(_txt_)
+    if processed:
+        _wrapped_lines_ = [line.strip() for line in _wrapped_lines_]
+        result = "\n".join(_wrapped_lines_).strip()
+        height = len(_wrapped_lines_) * height
+        return result, height
+
+    _wrapped_lines_ = []
+    chars = list(text)
+    _txt_ = ""
+    for word in chars:
+        _txt_ += word
+        _width, _height = get_text_size(_txt_)
+        if _width <= max_width:
+            continue
+        else:
+            _wrapped_lines_.append(_txt_)
+            _txt_ = ""
+    _wrapped_lines_.append(_txt_)
+    result = "\n".join(_wrapped_lines_).strip()
+    height = len(_wrapped_lines_) * height
+    return result, height
+
+
+class TestTextLayout(unittest.TestCase):
+    def assert_same_wrapping(self, text, max_width, font_size=60):
+        self.assertEqual(
+            text_layout.wrap_text(text, max_width, font_path, font_size),
+            legacy_wrap_text(text, max_width, font_path, font_size),
+            f"max_width={max_width}, text={text[:40]!r}",
+        )
+
+    def test_wrap_text_matches_legacy(self):
+        for max_width in [100, 300, 540, 972, 1728]:
+            self.assert_same_wrapping(text_en, max_width)
+            self.assert_same_wrapping(text_zh, max_width)
+        # short lines, a word wider than a line, double spaces and trailing spaces
+        for text in [
+            "Hello",
+            "Hello world",
+            "Supercalifragilisticexpialidocious is a word",
+            "a  lot   of    spaces ",
+            "短句",
+        ]:
+            for max_width in [50, 150, 400]:
+                self.assert_same_wrapping(text, max_width)
+
+    def test_wrap_text_matches_legacy_random(self):
+        rng = random.Random(0)
+        words = text_en.split() + list(text_zh[:40])
+        for _ in range(50):
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(1, 40)))
+            self.assert_same_wrapping(text, rng.randint(60, 1200), rng.choice([30, 60, 90]))
+
+
+def benchmark():
+    """
+    Times the legacy and the current wrap_text, run with
+    `python test/services/test_text_layout.py benchmark`.
+    """
+    for name, text in [("en", text_en), ("zh", text_zh)]:
+        begin = time.perf_counter()
+        legacy_wrap_text(text, 972, font_path, 60)
+        legacy_time = time.perf_counter() - begin
+
+        text_layout.get_font.cache_clear()
+        text_layout.get_glyph_advance.cache_clear()
+        begin = time.perf_counter()
+        text_layout.wrap_text(text, 972, font_path, 60)
+        cold_time = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        text_layout.wrap_text(text, 972, font_path, 60)
+        warm_time = time.perf_counter() - begin
+        print(
+            f"wrap_text {name} ({len(text)} chars): legacy {legacy_time * 1000:.1f}ms, "
+            f"cold {cold_time * 1000:.1f}ms, warm {warm_time * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        unittest.main()
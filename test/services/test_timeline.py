@@ -0,0 +1,89 @@
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import VideoConcatMode, VideoTransitionMode
+from app.services import timeline
+from app.services.probe import MediaInfo
+
+
+class TestPlanClips(unittest.TestCase):
+    def setUp(self):
+        # source durations by path, no file is opened
+        self.durations = {}
+        patcher = mock.patch.object(
+            timeline.probe,
+            "probe",
+            lambda path: MediaInfo(duration=self.durations[path], width=1080, height=1920, fps=30),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def plan(self, audio_duration, mode=VideoConcatMode.random, transition=None):
+        return timeline.plan_clips(
+            video_paths=list(self.durations),
+            audio_duration=audio_duration,
+            video_concat_mode=mode,
+            video_transition_mode=transition,
+            max_clip_duration=5,
+        )
+
+    def assert_fills(self, clips, audio_duration):
+        self.assertAlmostEqual(sum(clip.duration for clip in clips), audio_duration, places=6)
+
+    def test_fills_audio_exactly(self):
+        self.durations = {"a.mp4": 12, "b.mp4": 20}
+        clips = self.plan(17)
+        self.assert_fills(clips, 17)
+        # the last clip is trimmed, the others are whole windows
+        self.assertEqual([clip.duration for clip in clips], [5, 5, 5, 2])
+        self.assertEqual(clips[-1].end, clips[-1].start + 2)
+
+    def test_sequential(self):
+        self.durations = {"a.mp4": 12, "b.mp4": 20, "c.mp4": 8}
+        clips = self.plan(13, mode=VideoConcatMode.sequential)
+        self.assertEqual([clip.source for clip in clips], ["a.mp4", "b.mp4", "c.mp4"])
+        self.assertEqual([(clip.start, clip.end) for clip in clips], [(0, 5), (0, 5), (0, 3)])
+
+    def test_leftover_windows_skipped(self):
+        # 6 windows of 5 seconds, the audio needs 2 of them
+        self.durations = {"a.mp4": 15, "b.mp4": 15}
+        clips = self.plan(8)
+        self.assertEqual(len(clips), 2)
+        self.assert_fills(clips, 8)
+        self.assertEqual(len({(clip.source, clip.start) for clip in clips}), 2)
+        # windows shorter than max_clip_duration are not used
+        self.durations = {"a.mp4": 7}
+        self.assertEqual([(clip.start, clip.end) for clip in self.plan(5)], [(0, 5)])
+
+    def test_windows_loop(self):
+        self.durations = {"a.mp4": 10}
+        clips = self.plan(23, transition=VideoTransitionMode.shuffle)
+        self.assertEqual(len(clips), 5)
+        self.assert_fills(clips, 23)
+        # a looped window has the transition it had the first time
+        for clip in clips[2:]:
+            first = next(c for c in clips if c.start == clip.start)
+            self.assertEqual((clip.transition, clip.transition_side), (first.transition, first.transition_side))
+
+    def test_frame_boundaries(self):
+        self.durations = {"a.mp4": 10, "b.mp4": 10}
+        for audio_duration in (7.123456, 12.01, 19.99):
+            clips = self.plan(audio_duration)
+            for clip in clips:
+                frames = clip.duration * timeline.fps
+                self.assertAlmostEqual(frames, round(frames), places=4)
+            total_frames = sum(round(clip.duration * timeline.fps) for clip in clips)
+            self.assertEqual(total_frames, round(audio_duration * timeline.fps))
+
+    def test_no_materials(self):
+        self.durations = {"a.mp4": 3}
+        self.assertEqual(self.plan(10), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
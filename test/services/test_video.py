@@ -81,5 +81,15 @@ class TestVideoService(unittest.TestCase):
         except Exception as e:
             self.fail(f"test wrap_text failed: {str(e)}")
 
+    def test_get_zoom_boxes(self):
+        boxes = vd.get_zoom_boxes(1920, 1080, 4)
+        self.assertEqual(len(boxes), 120)
+        # the first frame is the whole image, the last one is zoomed in about 12%
+        self.assertEqual(tuple(boxes[0]), (0, 0, 1920, 1080))
+        left, top, right, bottom = boxes[-1]
+        self.assertAlmostEqual(1920 / (right - left), 1.119, places=3)
+        self.assertAlmostEqual((left + right) / 2, 960)
+        self.assertAlmostEqual((top + bottom) / 2, 540)
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file